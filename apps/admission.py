@@ -0,0 +1,158 @@
+"""
+Admission Control Module for ws-availability.
+
+This module caps the number of requests processed concurrently by all the
+workers sharing a Redis instance, so that a few clients firing network-wide
+requests can't occupy every worker:
+- `admission_max_requests` requests in total,
+- `admission_max_per_client` requests per client address,
+- `admission_max_expensive` expensive requests, i.e. estimated above
+  `admission_expensive_rows` segments (see `wfcatalog_client.estimate_rows`).
+  With fewer expensive slots than slots in total, cheap requests always
+  find a free slot.
+
+Each cap is a Redis sorted set of the tokens of the admitted requests,
+scored by the time their slot expires: a request takes a slot in every set
+that applies to it, or none, atomically in a Lua script. Slots are released
+when the request ends, and expire after the longest request deadline if the
+worker was killed. A request finding no free slot is answered at once with
+a 503 and a `Retry-After` header (see `root.output`).
+
+Admission control is off while every cap is 0. If Redis fails, requests
+are admitted.
+"""
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+
+import redis
+
+from apps.globals import TIMEOUT
+from apps.redis_client import RedisClient
+from apps.settings import settings
+from apps.wfcatalog_client import estimate_rows
+
+# Redis keys of the admitted requests
+KEY_ALL = "admission:all"
+KEY_EXPENSIVE = "admission:expensive"
+KEY_CLIENT = "admission:client:"
+
+# Seconds a slot outlives the deadline of its request
+SLOT_MARGIN = 60
+
+# KEYS: sorted sets, ARGV: now, expiry, token, then the cap of each set.
+# Returns 0 if admitted, otherwise the number of the first full set.
+ACQUIRE = """
+for i, key in ipairs(KEYS) do
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', ARGV[1])
+    if redis.call('ZCARD', key) >= tonumber(ARGV[3 + i]) then
+        return i
+    end
+end
+for i, key in ipairs(KEYS) do
+    redis.call('ZADD', key, ARGV[2], ARGV[3])
+    redis.call('EXPIREAT', key, math.ceil(tonumber(ARGV[2])))
+end
+return 0
+"""
+
+# KEYS: sorted sets, ARGV: token
+RELEASE = """
+for i, key in ipairs(KEYS) do
+    redis.call('ZREM', key, ARGV[1])
+end
+return 0
+"""
+
+# Registered scripts (acquire, release), see `_scripts`
+SCRIPTS = None
+
+
+def is_expensive(paramslist: list[dict]) -> bool:
+    """
+    Classifies a request by its estimated cost.
+
+    Only estimated if expensive requests are capped.
+
+    Args:
+        paramslist: List of parameter dictionaries.
+
+    Returns:
+        True if the request is estimated above `admission_expensive_rows`.
+    """
+    if not settings.admission_max_expensive:
+        return False
+    return estimate_rows(paramslist) > settings.admission_expensive_rows
+
+
+def _scripts():
+    global SCRIPTS
+    if SCRIPTS is None:
+        rc = RedisClient(settings.cache_host, settings.cache_port)
+        SCRIPTS = (rc.register_script(ACQUIRE), rc.register_script(RELEASE))
+    return SCRIPTS
+
+
+def _slots(client: str, expensive: bool) -> dict[str, int]:
+    """
+    Lists the sorted sets a request needs a slot in, with their cap.
+
+    Args:
+        client: Client address.
+        expensive: True for an expensive request, see `is_expensive`.
+
+    Returns:
+        Dictionary of Redis keys and caps.
+    """
+    slots = {}
+    if settings.admission_max_requests:
+        slots[KEY_ALL] = settings.admission_max_requests
+    if settings.admission_max_per_client:
+        slots[KEY_CLIENT + client] = settings.admission_max_per_client
+    if settings.admission_max_expensive and expensive:
+        slots[KEY_EXPENSIVE] = settings.admission_max_expensive
+    return slots
+
+
+@contextmanager
+def admission(client: str, expensive: bool):
+    """
+    Takes the slots of a request for the time of the context.
+
+    Args:
+        client: Client address.
+        expensive: True for an expensive request, see `is_expensive`.
+
+    Yields:
+        True if the request is admitted, False if it must be turned down.
+    """
+    slots = _slots(client, expensive)
+    if not slots:
+        yield True
+        return
+
+    keys = list(slots)
+    token = uuid.uuid4().hex
+    now = time.time()
+    timeout = max(settings.query_timeout, settings.extent_timeout) or TIMEOUT
+    try:
+        (acquire, release) = _scripts()
+        full = acquire(keys=keys, args=[now, now + timeout + SLOT_MARGIN, token] + list(slots.values()))
+    except redis.RedisError as ex:
+        logging.warning(f"Admission control unavailable, request admitted: {ex}")
+        yield True
+        return
+
+    if full:
+        logging.info(f"Request of {client} turned down, {keys[full - 1]} is full.")
+        yield False
+        return
+
+    try:
+        yield True
+    finally:
+        try:
+            release(keys=keys, args=[token])
+        except redis.RedisError as ex:
+            logging.warning(f"Admission slots of {token} not released: {ex}")
@@ -0,0 +1,192 @@
+"""
+Coverage Module for ws-availability.
+
+This module encodes and decodes the documents of the `availability_coverage`
+collection: one document per network, station, location, channel, quality,
+sample rate and year, maintained by the view builder. It holds:
+- `days`: bitmap of the days of the year with data (bit i is day i + 1).
+- `full`: bitmap of the days covered from midnight to midnight in one span.
+- `gappy`: list of [day, fraction, first, last, spans] for the other days
+  with data, `first`/`last` being microseconds since midnight and `spans`
+  the number of timespans with the one-sample tolerance of `fusion`.
+- `updated`: packed per-day latest `created` time, seconds since the epoch.
+
+Gaps inside a day are always shorter than a day, the coverage therefore
+answers exactly requests merging gaps of a day or more, and extents.
+"""
+from array import array
+from datetime import date, datetime, timedelta
+
+DAY = timedelta(days=1)
+DAY_US = 86400 * 1000000
+EPOCH = datetime(1970, 1, 1)
+
+
+def _us(delta: timedelta) -> int:
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _year_days(year: int) -> int:
+    return (date(year + 1, 1, 1) - date(year, 1, 1)).days
+
+
+def encode(segments, srate: float) -> dict[int, dict]:
+    """
+    Builds the coverage of the segments of one stream, quality and sample rate.
+
+    Args:
+        segments: Availability documents sorted by start time. Compacted
+                  spans give the last update of each of their days
+                  (`updates`, see views/main.js).
+        srate: Sample rate of the segments.
+
+    Returns:
+        Dictionary year -> coverage fields (`days`, `full`, `gappy`, `updated`).
+    """
+    tol = _us(timedelta(seconds=1.0 / srate)) if srate else 0
+    # day -> [first, last, spans, covered, updated], times in us since midnight
+    days = {}
+
+    for segment in segments:
+        ts, te = segment["ts"], segment["te"]
+        if ts > te:
+            continue
+        updates = {u["day"].date(): u["created"] for u in segment.get("updates", ())}
+        day = ts.date()
+        last_day = max(day, (te - timedelta(microseconds=1)).date())
+        while day <= last_day:
+            midnight = datetime(day.year, day.month, day.day)
+            start = max(0, _us(ts - midnight))
+            end = min(DAY_US, _us(te - midnight))
+            updated = int((updates.get(day, segment["created"]) - EPOCH).total_seconds())
+            stats = days.get(day)
+            if stats is None:
+                days[day] = [start, end, 1, end - start, updated]
+            else:
+                if start - stats[1] > tol:
+                    stats[2] += 1
+                stats[3] += max(0, end - max(start, stats[1]))
+                stats[1] = max(stats[1], end)
+                stats[4] = max(stats[4], updated)
+            day += DAY
+
+    years = {}
+    for day in sorted(days):
+        first, last, spans, covered, updated = days[day]
+        year = years.get(day.year)
+        if year is None:
+            size = _year_days(day.year)
+            year = years[day.year] = {
+                "days": bytearray((size + 7) // 8),
+                "full": bytearray((size + 7) // 8),
+                "gappy": [],
+                "updated": array("I", [0] * size),
+            }
+        i = day.timetuple().tm_yday - 1
+        year["days"][i // 8] |= 1 << (i % 8)
+        if first == 0 and last == DAY_US and spans == 1:
+            year["full"][i // 8] |= 1 << (i % 8)
+        else:
+            year["gappy"].append([i + 1, round(covered / DAY_US, 6), first, last, spans])
+        year["updated"][i] = updated
+
+    return {
+        y: dict(
+            fields,
+            days=bytes(fields["days"]),
+            full=bytes(fields["full"]),
+            updated=fields["updated"].tobytes(),
+        )
+        for y, fields in years.items()
+    }
+
+
+def decode(doc: dict) -> list[tuple]:
+    """
+    Lists the days with data of a coverage document.
+
+    Args:
+        doc: Coverage document.
+
+    Returns:
+        List of (first, last, spans, updated) datetimes (spans is an int),
+        one per day with data, in chronological order.
+    """
+    gappy = {g[0]: g for g in doc["gappy"]}
+    updated = array("I")
+    updated.frombytes(bytes(doc["updated"]))
+    bitmap = bytes(doc["days"])
+    new_year = datetime(doc["year"], 1, 1)
+
+    days = []
+    for i in range(len(updated)):
+        if not bitmap[i // 8] & (1 << (i % 8)):
+            continue
+        midnight = new_year + timedelta(days=i)
+        if i + 1 in gappy:
+            (_, _, first, last, spans) = gappy[i + 1]
+        else:
+            (first, last, spans) = (0, DAY_US, 1)
+        days.append(
+            (
+                midnight + timedelta(microseconds=first),
+                midnight + timedelta(microseconds=last),
+                spans,
+                EPOCH + timedelta(seconds=updated[i]),
+            )
+        )
+    return days
+
+
+def spans(docs, start: datetime | None = None, end: datetime | None = None) -> list[list]:
+    """
+    Lists the day ranges with data of consecutive coverage documents of the
+    same stream, quality and sample rate, merging days covered from midnight
+    to midnight.
+
+    Args:
+        docs: Coverage documents sorted by year.
+        start: Only days from this midnight on are kept.
+        end: Only days before this midnight are kept.
+
+    Returns:
+        List of [first, last, spans, updated].
+    """
+    result = []
+    for doc in docs:
+        for first, last, count, updated in decode(doc):
+            if start is not None and first < start:
+                continue
+            if end is not None and first >= end:
+                continue
+            prev = result[-1] if result else None
+            full = count == 1 and last - first == DAY and first.time() == datetime.min.time()
+            if prev is not None and prev[4] and full and prev[1] == first:
+                prev[1] = last
+                prev[3] = max(prev[3], updated)
+            else:
+                result.append([first, last, count, updated, full])
+    return [r[:4] for r in result]
+
+
+def extent(items: list[list], srate: float, mergegaps: float | None) -> tuple:
+    """
+    Reduces day ranges to an extent, see `fusion` in extent mode.
+
+    Args:
+        items: Day ranges returned by `spans`.
+        srate: Sample rate of the stream.
+        mergegaps: Gap tolerance in seconds, either None or at least a day.
+
+    Returns:
+        A tuple (earliest, latest, updated, timespans).
+    """
+    tol = timedelta(seconds=max(mergegaps or 0.0, 1.0 / float(srate)))
+    timespans = 0
+    latest = None
+    for first, last, count, _ in items:
+        timespans += 1 if mergegaps else count
+        if latest is not None and first - latest <= tol:
+            timespans -= 1
+        latest = last if latest is None else max(latest, last)
+    return (items[0][0], latest, max(i[3] for i in items), timespans)
@@ -1,22 +1,31 @@
+import heapq
 import json
 import logging
 import time
 import zipfile
+from itertools import islice
+from operator import itemgetter
 from tempfile import NamedTemporaryFile
 from datetime import datetime, timedelta
-from typing import Any
+from typing import Any, Callable
 
 from flask import make_response
+from pymongo.errors import ExecutionTimeout
 
-from apps.globals import Error
+from apps.globals import Error, HTTP
 from apps.globals import MAX_DATA_ROWS
+from apps.globals import ORDERBY
 from apps.globals import SCHEMAVERSION
 from apps.globals import QUALITY, SAMPLERATE, START, END, UPDATED, STATUS, COUNT
 from apps.utils import error_request
 from apps.utils import overflow_error
 from apps.utils import tictac
+from apps.utils import timestamp_formatter
+from apps import deadline, vectorized
+from apps.settings import settings
 
-from apps.wfcatalog_client import collect_data
+from apps.wfcatalog_client import collect_coverage, collect_data, collect_extents
+from apps.wfcatalog_client import collect_table, NO_UPDATE, TooManyRows
 
 
 """
@@ -29,6 +38,10 @@ from the backend (MongoDB via wfcatalog_client). It handles:
 - Sorting, filtering columns, and merging time spans.
 """
 
+# Below this number of records, the Python fusion is faster than NumPy
+VECTORIZED_MIN_ROWS = 1000
+
+
 def get_header(params: dict) -> list[str]:
     """
     Generates the column header list based on request parameters.
@@ -125,7 +138,7 @@ def records_to_text(params: dict, data: list[list[Any]], sep: str = " ") -> str:
         sizes = get_column_widths(data, header)
         # pad header and rows according to the maximum column width
         header = [val.ljust(sz) for val, sz in zip(header, sizes)]
-        for row in data:
+        for row in deadline.checked(data):
             row[:] = [val.ljust(sz) for val, sz in zip(row, sizes)]
 
     if params["format"] in ["geocsv", "zip"]:
@@ -163,7 +176,7 @@ def records_to_dictlist(params: dict, data: list[list[Any]]) -> dict:
     else:
         start = -3 if params["showlastupdate"] else -2
         prev_row = data[0]
-        for row in data:
+        for row in deadline.checked(data):
             if not dictlist or row[:start] != prev_row[:start]:
                 dictlist.append(dict(zip(header[:start], row[:start])))
                 dictlist[-1]["timespans"] = list()
@@ -179,22 +192,24 @@ def records_to_dictlist(params: dict, data: list[list[Any]]) -> dict:
     }
 
 
-def sort_records(params: dict, data: list[list[Any]]) -> None:
+def _sort_key(params: dict) -> tuple[Callable, bool]:
     """
-    Sorts data records in-place based on the 'orderby' parameter.
+    Returns the sort key of the 'orderby' parameter.
 
     Args:
         params: Dictionary of request parameters.
-        data: List of data records (modified in-place).
+
+    Returns:
+        A tuple (key function, reverse).
     """
     if params["extent"] and params["orderby"] == "timespancount":
-        data.sort(key=lambda x: x[COUNT])
+        return itemgetter(COUNT), False
     elif params["extent"] and params["orderby"] == "timespancount_desc":
-        data.sort(key=lambda x: x[COUNT], reverse=True)
+        return itemgetter(COUNT), True
     elif params["orderby"] == "latestupdate":
-        data.sort(key=lambda x: x[UPDATED])
+        return itemgetter(UPDATED), False
     elif params["orderby"] == "latestupdate_desc":
-        data.sort(key=lambda x: x[UPDATED], reverse=True)
+        return itemgetter(UPDATED), True
     else:
         # Default sorting: NSLC (Network, Station, Location, Channel), 
         # then Time (Start, End), then Quality, then SampleRate
@@ -207,16 +222,58 @@ def sort_records(params: dict, data: list[list[Any]]) -> None:
         # 2. Start time, End time (x[START], x[END])
         # 3. Quality (x[QUALITY])
         # 4. Sample rate (x[SAMPLERATE])
-        data.sort(key=lambda x: (
-            x[0],           # Network
-            x[1],           # Station
-            x[2],           # Location
-            x[3],           # Channel
-            x[START],       # Start time (ascending - earliest first)
-            x[END],         # End time
-            x[QUALITY],     # Quality
-            x[SAMPLERATE]   # Sample rate
-        ))
+        return itemgetter(0, 1, 2, 3, START, END, QUALITY, SAMPLERATE), False
+
+
+def _default_order(params: dict) -> bool:
+    """
+    Tells whether the records are requested in the default order, in which
+    they are merged: 'orderby' is missing (None) or its first value.
+    """
+    return params["orderby"] in (None, ORDERBY[0])
+
+
+def _merged_in_order(params: dict) -> bool:
+    """
+    Tells whether merged records come in the requested order. Records are
+    merged per (quality, sample rate) within a channel, which is the
+    default order only once quality and sample rate are merged too.
+    """
+    return _default_order(params) and {"quality", "samplerate"} <= set(params["merge"])
+
+
+def sort_records(params: dict, data: list[list[Any]]) -> None:
+    """
+    Sorts data records in-place based on the 'orderby' parameter.
+
+    Args:
+        params: Dictionary of request parameters.
+        data: List of data records (modified in-place).
+    """
+    key, reverse = _sort_key(params)
+    data.sort(key=key, reverse=reverse)
+
+
+def top_records(params: dict, data, limit: int) -> list[list[Any]]:
+    """
+    Selects the first `limit` records in the 'orderby' order.
+
+    Uses a bounded heap, so only `limit` records are kept in memory while
+    `data` is consumed. The result is the same as sorting (stable) and
+    slicing.
+
+    Args:
+        params: Dictionary of request parameters.
+        data: Iterable of data records.
+        limit: Number of records to keep.
+
+    Returns:
+        Sorted list of at most `limit` records.
+    """
+    key, reverse = _sort_key(params)
+    if reverse:
+        return heapq.nlargest(limit, data, key=key)
+    return heapq.nsmallest(limit, data, key=key)
 
 
 #    else:
@@ -248,17 +305,19 @@ def select_columns(
         indexes = indexes + [COUNT, STATUS]
     if params["format"] == "request":
         indexes = [0, 1, 2, 3] + [START, END]
+    format_time = timestamp_formatter()
+    format_updated = timestamp_formatter("seconds")
 
-    for row in data:
+    for row in deadline.checked(data):
         if params["start"] and row[START] < params["start"]:
             row[START] = params["start"]
         if params["end"] and row[END] > params["end"]:
             row[END] = params["end"]
-        row[START] = row[START].isoformat(timespec="microseconds") + "Z"
-        row[END] = row[END].isoformat(timespec="microseconds") + "Z"
+        row[START] = format_time(row[START])
+        row[END] = format_time(row[END])
 
         if params["showlastupdate"] and params["format"] != "request":
-            row[UPDATED] = row[UPDATED].isoformat(timespec="seconds") + "Z"
+            row[UPDATED] = format_updated(row[UPDATED])
 
         if params["format"] != "json":
             row[:] = [str(row[i]) for i in indexes]
@@ -285,42 +344,77 @@ def fusion(
     """
 
     tic = time.time()
-    merge = list()
+    engine = settings.fusion_engine
+    if engine == "auto":
+        engine = "numpy" if len(data) >= VECTORIZED_MIN_ROWS else "python"
+    if engine == "numpy" and vectorized.HAS_NUMPY:
+        merge = vectorized.fusion(params, data, indexes, _python_fusion)
+        deadline.check()
+    else:
+        engine = "python"
+        merge = list(iter_fusion(params, data, indexes))
+    logging.debug(f"Data merged ({engine}) in {tictac(tic)} seconds.")
+    return merge
+
+
+def _python_fusion(params: dict, data, indexes: list[int]) -> list[list[Any]]:
+    return list(iter_fusion(params, data, indexes))
+
+
+def iter_fusion(params: dict, data, indexes: list[int]):
+    """
+    Lazy version of `fusion`.
+
+    A merged record is yielded as soon as a record that can't be merged into
+    it is read, so the caller may stop reading `data` early.
+
+    Args:
+        params: Dictionary of request parameters (used for 'mergegaps' tolerance).
+        data: Iterable of ordered data records.
+        indexes: List of column indexes to check for equality when grouping.
+
+    Yields:
+        Merged data records.
+    """
+    current = None
     timespancount = 0
     tol = params["mergegaps"] if params["mergegaps"] is not None else 0.0
 
     # The fusion step needs the rows to be sorted.
     #    data.sort(key=lambda x: x[:UPDATED]) # done by postgres
 
-    for row in data:
-        if merge and [row[i] for i in indexes] == [merge[-1][i] for i in indexes]:
-            sample_size = 1.0 / float(merge[-1][SAMPLERATE])
+    for row in deadline.checked(data):
+        if current is not None and [row[i] for i in indexes] == [current[i] for i in indexes]:
+            sample_size = 1.0 / float(current[SAMPLERATE])
             tol2 = timedelta(seconds=max([tol, sample_size]))
             sametrace = (
-                row[START] - merge[-1][END] <= tol2
+                row[START] - current[END] <= tol2
                 # (never occurs if sorted ?)
-                and merge[-1][START] <= row[END] + tol2
+                and current[START] <= row[END] + tol2
             )
             if not sametrace:
                 timespancount += 1
-            merge[-1][COUNT] = timespancount
+            current[COUNT] = timespancount
 
             if params["extent"] or sametrace:
-                if row[UPDATED] > merge[-1][UPDATED]:
-                    merge[-1][UPDATED] = row[UPDATED]
-                # if row[START] < merge[-1][START]:  # never occurs if sorted
-                #    merge[-1][START] = row[START]
-                if row[END] > merge[-1][END]:
-                    merge[-1][END] = row[END]
+                if row[UPDATED] > current[UPDATED]:
+                    current[UPDATED] = row[UPDATED]
+                # if row[START] < current[START]:  # never occurs if sorted
+                #    current[START] = row[START]
+                if row[END] > current[END]:
+                    current[END] = row[END]
             else:
-                merge.append(list(row))
+                yield current
+                current = list(row)
         else:
-            merge.append(list(row))
+            if current is not None:
+                yield current
+            current = list(row)
             timespancount = 1
-            merge[-1][COUNT] = 1
+            current[COUNT] = 1
 
-    logging.debug(f"Data merged in {tictac(tic)} seconds.")
-    return merge
+    if current is not None:
+        yield current
 
 
 def get_indexes(params: dict) -> list[int]:
@@ -390,12 +484,21 @@ def get_output(param_dic_list: list[dict]) -> Any:
     Main entry point for generating the output response.
 
     Orchestrates the data retrieval pipeline:
-    1. Collects data from wfcatalog (via `wfcatalog_client.collect_data`).
+    1. Collects data from wfcatalog (via `wfcatalog_client.collect_data`, or
+       `wfcatalog_client.collect_table` into columns), precomputed extents (via `wfcatalog_client.collect_extents`) or the
+       day coverage (via `wfcatalog_client.collect_coverage`).
     2. Checks for no-data conditions.
-    3. Merges and sorts data.
+    3. Merges (unless already merged), sorts data and applies `limit`. With
+       the default order, segments are read and merged lazily until `limit`
+       merged rows are complete, with other orders only the top `limit`
+       merged rows are kept.
     4. Selects columns and formats output.
     5. Builds the HTTP response.
 
+    Past the deadline of the request (see `apps.deadline`), a 408 response
+    is returned instead. Requests over `MAX_DATA_ROWS` segments get a 413,
+    jobs over their own `max_rows` parameter (see `jobs.job_params`).
+
     Args:
         param_dic_list: List of parameter dictionaries (usually one, or multiple for POST).
 
@@ -408,8 +511,38 @@ def get_output(param_dic_list: list[dict]) -> Any:
         data = None
         response = None
         params = param_dic_list[0]
+        max_rows = params.get("max_rows", MAX_DATA_ROWS)
 
-        data = collect_data(param_dic_list)
+        data = collect_extents(param_dic_list) if params["extent"] else None
+        if data is None:
+            data = collect_coverage(param_dic_list)
+        # Extents from either collection are already merged
+        merged = data is not None and params["extent"]
+        indexes = get_indexes(params)
+
+        # When merged rows come in the requested order, the first `limit`
+        # ones only need the first segments: they are read and merged lazily.
+        if data is None and params["limit"] < MAX_DATA_ROWS and _merged_in_order(params):
+            rows = collect_data(param_dic_list, lazy=True)
+            data = list(islice(iter_fusion(params, rows, indexes), params["limit"]))
+            merged = True
+            logging.info(f"Number of merged rows read for limit {params['limit']}: {len(data)}")
+        elif data is None:
+            # Segments fetched as columns are merged without building a
+            # record per segment
+            table = collect_table(param_dic_list)
+            if table is not None:
+                # Checked on the segments, as on the records below
+                if max_rows and table.num_rows > max_rows:
+                    return overflow_error(Error.TOO_MUCH_ROWS)
+                data = vectorized.fusion_table(
+                    params, table, indexes, _python_fusion, NO_UPDATE
+                )
+                deadline.check()
+                merged = True
+                logging.info(f"Number of segments read as columns: {table.num_rows}")
+            else:
+                data = collect_data(param_dic_list)
 
         if data is None:
             return data
@@ -419,22 +552,36 @@ def get_output(param_dic_list: list[dict]) -> Any:
 
         nrows = len(data)
         logging.info(f"Number of collected rows: {nrows}")
-        if nrows > MAX_DATA_ROWS:
+        if max_rows and nrows > max_rows:
             return overflow_error(Error.TOO_MUCH_ROWS)
 
-        indexes = get_indexes(params)
-        # Always run fusion to clean up DB overlaps/fragmentation
-        data = fusion(params, data, indexes)
-        data = data[: params["limit"]]
-
-        if params["orderby"] != "nslc_time_quality_samplerate":
-            sort_records(params, data)
+        if not _merged_in_order(params) and params["limit"] < nrows:
+            # Only `limit` merged rows are kept while merging, in the
+            # requested order
+            rows = data if merged else iter_fusion(params, data, indexes)
+            data = top_records(params, rows, params["limit"])
+        else:
+            if not merged:
+                # Always run fusion to clean up DB overlaps/fragmentation
+                data = fusion(params, data, indexes)
+            if not _merged_in_order(params):
+                sort_records(params, data)
+                deadline.check()
+            data = data[: params["limit"]]
 
         data = select_columns(params, data, indexes)
         logging.info(f"Final row number: {len(data)}")
         response = get_response(params, data)
         logging.debug(f"Processing in {tictac(tic)} seconds.")
         return response
+    except TooManyRows as ex:
+        logging.info(str(ex))
+        return overflow_error(Error.TOO_MUCH_ROWS_ESTIMATED)
+    except (deadline.DeadlineExceeded, ExecutionTimeout) as ex:
+        logging.warning(f"Request stopped: {ex}")
+        return error_request(
+            msg=HTTP._408_, details=Error.TIMEOUT.format(deadline.timeout()), code=408
+        )
     except Exception as ex:
         logging.exception(str(ex))
     finally:
@@ -0,0 +1,103 @@
+"""
+Request Deadline Module for ws-availability.
+
+This module holds the deadline of the request being processed, in a context
+variable: it follows the request through the call stack without being
+passed around, and each request (or thread, see `wfcatalog_client`) sees its
+own. It is enforced in two ways:
+- MongoDB queries get the remaining time as `maxTimeMS` (see `max_time_ms`),
+  the server aborts them with an `ExecutionTimeout` error.
+- Loops over records check it every `CHECK_EVERY` records (see `checked`),
+  long steps check it in between (see `check`).
+
+Both end in a 408 response (see `data_access_layer.get_output`), the worker
+stays alive with its connection pools and caches. Without a deadline, the
+checks do nothing.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Records processed between two deadline checks
+CHECK_EVERY = 10000
+
+# (expiry on the monotonic clock, timeout in seconds) of the current request
+_DEADLINE: ContextVar[tuple[float, float] | None] = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the deadline of the current request has passed."""
+
+
+@contextmanager
+def deadline(seconds: float):
+    """
+    Sets the deadline of the code run within the context.
+
+    Args:
+        seconds: Time allowed from now, 0 for no deadline.
+    """
+    token = _DEADLINE.set((time.monotonic() + seconds, seconds) if seconds else None)
+    try:
+        yield
+    finally:
+        _DEADLINE.reset(token)
+
+
+def timeout() -> float | None:
+    """Returns the timeout of the current deadline in seconds, or None."""
+    current = _DEADLINE.get()
+    return current[1] if current is not None else None
+
+
+def remaining() -> float | None:
+    """Returns the seconds left before the deadline, or None."""
+    current = _DEADLINE.get()
+    return current[0] - time.monotonic() if current is not None else None
+
+
+def check() -> None:
+    """
+    Checks the deadline of the current request.
+
+    Raises:
+        DeadlineExceeded: If it has passed.
+    """
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"Deadline of {timeout()} seconds exceeded.")
+
+
+def max_time_ms() -> int | None:
+    """
+    Returns the time left as a MongoDB `maxTimeMS`, or None.
+
+    Raises:
+        DeadlineExceeded: If the deadline has passed already.
+    """
+    check()
+    left = remaining()
+    return max(int(left * 1000), 1) if left is not None else None
+
+
+def checked(data):
+    """
+    Checks the deadline while `data` is iterated.
+
+    Args:
+        data: Iterable of records.
+
+    Returns:
+        `data` itself without a deadline, otherwise an iterator over `data`
+        raising `DeadlineExceeded` once it has passed.
+    """
+    if _DEADLINE.get() is None:
+        return data
+    return _checked(data)
+
+
+def _checked(data):
+    for i, row in enumerate(data):
+        if not i % CHECK_EVERY:
+            check()
+        yield row
@@ -48,9 +48,14 @@ class Error:
     START_LATER = "The starttime cannot be later than the endtime: "
     TOO_LONG_DURATION = "Too many days requested (greater than "
     TOO_MUCH_ROWS = f"The request exceeds the limit of {MAX_ROWS} rows."
+    TOO_MUCH_ROWS_ESTIMATED = (
+        f"The request is estimated to exceed the limit of {MAX_ROWS} rows by far,"
+        " please narrow the selection or the time window."
+    )
     UNSPECIFIED = "Error processing your request."
+    SATURATED = "Too many requests are being processed, please retry later."
     NODATA = "Your query doesn't match any available data."
-    TIMEOUT = f"Your query exceeds timeout ({TIMEOUT} seconds)."
+    TIMEOUT = "Your query exceeds timeout ({:g} seconds)."
     MISSING = "Missing parameter: "
     BAD_VAL = " Invalid value: "
     CHAR = "White space(s) or invalid string. Invalid value for: "
@@ -77,6 +82,8 @@ class Error:
     NODATA_CODE = f"Accepted nodata values are: {NODATA_CODE}." + BAD_VAL
     NO_WILDCARDS = "Wildcards or lists are not allowed in network parameter if there are wildcards (* or more than one ?) in station parameters."
     NO_SELECTION = "Request contains no selections."
+    UNKNOWN_JOB = "Unknown or expired job: "
+    JOB_NOT_DONE = "The result of the job is not available yet, job status: "
 
 
 class HTTP:
@@ -0,0 +1,376 @@
+"""
+Asynchronous Jobs Module for ws-availability.
+
+This module runs very large availability requests (multi-million-row dumps)
+in the background, so that they don't hold an API worker for minutes:
+- `submit` validates a `/jobs/query` or `/jobs/extent` request like its
+  synchronous counterpart, queues it in Redis and answers at once with a 202
+  and the job ID.
+- Job workers (`python -m apps.jobs`) take jobs from the queue, compute the
+  response with `get_output` within the `jobs_timeout` deadline, and stream
+  it into a file of `jobs_dir`. A taken job is kept in a processing list
+  until it is done, so that the job of a worker that died is marked failed
+  (see `recover_jobs`).
+- `status` reports the state of a job (queued, running, done or failed),
+  `result` serves the response once the job is done, with the status code
+  and headers of the synchronous request.
+
+Job records are kept in Redis and result files in `jobs_dir` for `jobs_ttl`
+seconds; `jobs_dir` must be shared by the API and the job workers.
+
+Usage:
+    python -m apps.jobs --workers 2
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import time
+import traceback
+import uuid
+from datetime import datetime
+from typing import Any
+
+from flask import Flask, jsonify, request, send_file
+
+from apps import deadline
+from apps.data_access_layer import get_output
+from apps.globals import HTTP, MAX_DATA_ROWS, Error
+from apps.redis_client import RedisClient
+from apps.root import valid_requests
+from apps.settings import settings
+from apps.utils import error_request
+
+# Redis keys of the job queue, the jobs being run and the job records
+KEY_QUEUE = "jobs:queue"
+KEY_PROCESSING = "jobs:processing"
+KEY_JOB = "job:"
+
+# Seconds a job worker waits for a job before checking the maintenance
+POLL_TIMEOUT = 30
+
+# Seconds between the maintenance runs of a job worker (`clean_results` and
+# `recover_jobs`), whatever the traffic
+CLEAN_INTERVAL = 300
+
+# Seconds past its deadline a job still running is considered lost
+STALE_MARGIN = 300
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+# Application providing the request context of the jobs
+APP = Flask(__name__)
+
+
+def _redis() -> RedisClient:
+    return RedisClient(settings.cache_host, settings.cache_port)
+
+
+def _now() -> str:
+    return datetime.utcnow().strftime(TIME_FORMAT)
+
+
+def result_path(job_id: str) -> str:
+    """Returns the path of the result file of a job."""
+    return os.path.join(settings.jobs_dir, job_id)
+
+
+def get_job(job_id: str) -> dict | None:
+    """
+    Reads the record of a job.
+
+    Args:
+        job_id: Job ID.
+
+    Returns:
+        The job record, or None if unknown or expired.
+    """
+    if not JOB_ID.fullmatch(job_id):
+        return None
+    return _redis().get(KEY_JOB + job_id)
+
+
+def save_job(job: dict) -> None:
+    """Writes the record of a job, it expires after `jobs_ttl` seconds."""
+    _redis().set(KEY_JOB + job["id"], job, settings.jobs_ttl)
+
+
+def _public(job: dict) -> dict:
+    """Returns the fields of a job record shown to the client."""
+    root = request.url_root
+    fields = ("id", "status", "submitted", "started", "finished", "code")
+    info = {k: job[k] for k in fields if job.get(k) is not None}
+    info["status_url"] = f"{root}jobs/{job['id']}"
+    if job["status"] in ("done", "failed"):
+        info["result_url"] = f"{root}jobs/{job['id']}/result"
+    return info
+
+
+def unknown_job(job_id: str) -> Any:
+    return error_request(msg=HTTP._404_, details=Error.UNKNOWN_JOB + job_id, code=404)
+
+
+def submit() -> Any:
+    """
+    Queues the request of the current `/jobs/query` or `/jobs/extent` call.
+
+    Returns:
+        A 202 response with the job status, or the validation error.
+    """
+    try:
+        (valid_param_dicts, result) = valid_requests()
+
+        if valid_param_dicts:
+            job = {
+                "id": uuid.uuid4().hex,
+                "status": "queued",
+                "submitted": _now(),
+                "path": request.full_path.replace("/jobs/", "/", 1),
+                "params": valid_param_dicts,
+            }
+            save_job(job)
+            _redis().push(KEY_QUEUE, job["id"])
+            logging.info(f"Job {job['id']} queued: {job['path']}")
+
+            info = _public(job)
+            response = jsonify(info)
+            response.status_code = 202
+            response.headers["Location"] = info["status_url"]
+            return response
+
+    except Exception as excep:
+        result = {"msg": HTTP._500_, "details": Error.UNSPECIFIED, "code": 500}
+        logging.exception(str(excep))
+
+    return error_request(
+        msg=result["msg"], details=result["details"], code=result["code"]
+    )
+
+
+def status(job_id: str) -> Any:
+    """
+    Reports the status of a job.
+
+    Args:
+        job_id: Job ID.
+
+    Returns:
+        A JSON response with the job status, or a 404.
+    """
+    job = get_job(job_id)
+    if job is None:
+        return unknown_job(job_id)
+    return jsonify(_public(job))
+
+
+def result(job_id: str) -> Any:
+    """
+    Serves the response computed by a job.
+
+    Args:
+        job_id: Job ID.
+
+    Returns:
+        The response of the request, a 404 if the job is unknown, expired
+        or not done yet, or a 500 if it failed.
+    """
+    job = get_job(job_id)
+    if job is None:
+        return unknown_job(job_id)
+    if job["status"] == "failed":
+        return error_request(msg=HTTP._500_, details=Error.UNSPECIFIED, code=500)
+    if job["status"] != "done" or not os.path.exists(result_path(job_id)):
+        return error_request(
+            msg=HTTP._404_, details=Error.JOB_NOT_DONE + job["status"], code=404
+        )
+
+    response = send_file(result_path(job_id), mimetype=job["content_type"])
+    response.status_code = job["code"]
+    response.headers["Content-Type"] = job["content_type"]
+    for key, val in job["headers"].items():
+        response.headers[key] = val
+    return response
+
+
+def job_params(paramslist: list[dict]) -> list[dict]:
+    """
+    Lifts the row limits of synchronous requests for a job.
+
+    The `MAX_DATA_ROWS` and `max_estimated_rows` limits are replaced by
+    `jobs_max_rows` (0 = none, the job is then only bounded by its
+    deadline). Selections without an explicit `limit` return all their rows.
+
+    Args:
+        paramslist: Validated parameter dictionaries of the job.
+
+    Returns:
+        Parameter dictionaries for `get_output`.
+    """
+    max_rows = settings.jobs_max_rows
+    return [
+        dict(
+            params,
+            max_rows=max_rows,
+            limit=(max_rows or sys.maxsize)
+            if params["limit"] == MAX_DATA_ROWS
+            else params["limit"],
+        )
+        for params in paramslist
+    ]
+
+
+def run_job(job_id: str) -> dict | None:
+    """
+    Computes the response of a job into its result file.
+
+    Args:
+        job_id: Job ID.
+
+    Returns:
+        The updated job record, or None if the job expired meanwhile.
+    """
+    job = get_job(job_id)
+    if job is None:
+        logging.warning(f"Job {job_id} expired before running.")
+        return None
+
+    job.update(status="running", started=_now())
+    save_job(job)
+    logging.info(f"Job {job_id} started: {job['path']}")
+
+    try:
+        with APP.test_request_context(job["path"]):
+            with deadline.deadline(settings.jobs_timeout):
+                response = get_output(job_params(job["params"]))
+            if not response:
+                raise Exception("get_output returned empty response")
+
+            # Streams the body, large responses aren't held in memory twice
+            tmp = result_path(job_id) + ".tmp"
+            with open(tmp, "wb") as f:
+                for chunk in response.iter_encoded():
+                    f.write(chunk)
+            os.replace(tmp, result_path(job_id))
+
+        job.update(
+            status="done",
+            code=response.status_code,
+            content_type=response.headers.get("Content-Type"),
+            headers={
+                k: v for k, v in response.headers.items()
+                if k.lower() not in ("content-type", "content-length")
+            },
+        )
+    except Exception as excep:
+        logging.error(traceback.format_exc())
+        job.update(status="failed", code=500, error=str(excep))
+
+    job["finished"] = _now()
+    save_job(job)
+    logging.info(f"Job {job_id} {job['status']} ({job['code']}).")
+    return job
+
+
+def clean_results() -> int:
+    """
+    Deletes the result files older than `jobs_ttl` seconds.
+
+    Returns:
+        The number of files deleted.
+    """
+    deleted = 0
+    expiry = time.time() - settings.jobs_ttl
+    for entry in os.scandir(settings.jobs_dir):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < expiry:
+                os.remove(entry.path)
+                deleted += 1
+        except OSError as ex:
+            logging.warning(f"Result {entry.name} not deleted: {ex}")
+    return deleted
+
+
+def recover_jobs() -> int:
+    """
+    Fails the jobs of the processing list whose worker died.
+
+    A job still running `STALE_MARGIN` seconds after its `jobs_timeout`
+    deadline lost its worker. It is marked failed rather than run again, in
+    case it is what killed the worker. Without a deadline, running jobs are
+    never considered lost. Finished or expired jobs left in the list are
+    dropped.
+
+    Returns:
+        The number of jobs marked failed.
+    """
+    rc = _redis()
+    failed = 0
+    for job_id in rc.items(KEY_PROCESSING):
+        job = get_job(job_id)
+        if job is None or job["status"] in ("done", "failed"):
+            rc.remove(KEY_PROCESSING, job_id)
+            continue
+        if job["status"] != "running" or not settings.jobs_timeout:
+            continue
+        started = datetime.strptime(job["started"], TIME_FORMAT)
+        running = (datetime.utcnow() - started).total_seconds()
+        if running < settings.jobs_timeout + STALE_MARGIN:
+            continue
+        # Another worker may be recovering the same job
+        if rc.remove(KEY_PROCESSING, job_id):
+            job.update(status="failed", code=500, error="Job worker lost.", finished=_now())
+            save_job(job)
+            logging.warning(f"Job {job_id} failed, its worker was lost.")
+            failed += 1
+    return failed
+
+
+def work(max_jobs: int = 0) -> None:
+    """
+    Runs the jobs of the queue, one at a time.
+
+    Expired results are deleted and lost jobs recovered every
+    `CLEAN_INTERVAL` seconds, between jobs.
+
+    Args:
+        max_jobs: Number of jobs to run before returning, 0 = forever.
+    """
+    os.makedirs(settings.jobs_dir, exist_ok=True)
+    done = 0
+    cleaned = None
+    while not max_jobs or done < max_jobs:
+        if cleaned is None or time.monotonic() - cleaned >= CLEAN_INTERVAL:
+            clean_results()
+            recover_jobs()
+            cleaned = time.monotonic()
+
+        # The job stays in the processing list until it is finished
+        job_id = _redis().move(KEY_QUEUE, KEY_PROCESSING, POLL_TIMEOUT)
+        if job_id is None:
+            continue
+        try:
+            run_job(job_id)
+        finally:
+            _redis().remove(KEY_PROCESSING, job_id)
+        done += 1
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] [%(process)d] [%(levelname)s] %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S +0000",
+    )
+    parser = argparse.ArgumentParser(description="Run availability jobs.")
+    parser.add_argument("--workers", type=int, default=1, help="jobs run concurrently")
+    args = parser.parse_args()
+
+    workers = [multiprocessing.Process(target=work) for _ in range(max(1, args.workers))]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
@@ -29,3 +29,39 @@ class RedisClient:
             self._redis.set(key, pickle.dumps(obj))
         else:
             self._redis.setex(key, expiration, pickle.dumps(obj))
+
+    def mget(self, keys: list[str]) -> list:
+        return [
+            pickle.loads(object) if object else None
+            for object in self._redis.mget(keys)
+        ]
+
+    def set_many(self, objects: dict, expiration: int = 0):
+        if not objects:
+            return
+        pipe = self._redis.pipeline(transaction=False)
+        for key, obj in objects.items():
+            if expiration == 0:
+                pipe.set(key, pickle.dumps(obj))
+            else:
+                pipe.setex(key, expiration, pickle.dumps(obj))
+        pipe.execute()
+
+    def push(self, key: str, obj):
+        self._redis.lpush(key, pickle.dumps(obj))
+
+    def move(self, source: str, destination: str, timeout: int = 0):
+        item = self._redis.brpoplpush(source, destination, timeout)
+        return pickle.loads(item) if item else None
+
+    def remove(self, key: str, obj) -> int:
+        return self._redis.lrem(key, 1, pickle.dumps(obj))
+
+    def items(self, key: str) -> list:
+        return [pickle.loads(item) for item in self._redis.lrange(key, 0, -1)]
+
+    def ping(self) -> bool:
+        return self._redis.ping()
+
+    def register_script(self, script: str):
+        return self._redis.register_script(script)
@@ -150,6 +150,21 @@ class RestrictionInventory:
         ]
 
 
+def changed_seed_ids(old: dict, new: dict) -> set[str]:
+    """
+    Lists the seed IDs whose epochs or restrictions differ between two
+    inventories, including seed IDs added or removed.
+    """
+    def history(inv, seed_id):
+        return [(e.start, e.end, e.restriction) for e in inv.get(seed_id, [])]
+
+    return set(
+        seed_id
+        for seed_id in set(old) | set(new)
+        if history(old, seed_id) != history(new, seed_id)
+    )
+
+
 if __name__ == "__main__":
     restricted = RestrictionInventory()
     print(restricted)
@@ -15,10 +15,12 @@ from flask import request
 
 from flask import request
 
+from apps import admission, deadline
 from apps.data_access_layer import get_output
 from apps.globals import HTTP, MAX_DATA_ROWS, MAX_DAYS, MAX_MERGEGAPS, TIMEOUT, Error
 from apps.parameters import Parameters
 from apps.models import QueryParameters
+from apps.settings import settings
 from pydantic import ValidationError
 from apps.utils import (
     check_base_parameters,
@@ -203,6 +205,52 @@ def get_post_params() -> list[dict]:
     return paramslist
 
 
+def client_address() -> str:
+    """
+    Returns the address of the client, as forwarded by the proxy if any.
+
+    Only the last `X-Forwarded-For` address, appended by the reverse proxy,
+    is trusted: the addresses before it are sent by the client.
+    """
+    return request.access_route[-1] if request.access_route else str(request.remote_addr)
+
+
+def unavailable_error() -> Any:
+    """
+    Builds the 503 response of a request turned down by admission control.
+    """
+    response = error_request(msg=HTTP._503_, details=Error.SATURATED, code=503)
+    response.headers["Retry-After"] = str(settings.admission_retry_after)
+    return response
+
+
+def valid_requests() -> tuple[list[dict], dict]:
+    """
+    Validates the parameters of a GET or POST request.
+
+    Returns:
+        A tuple containing:
+        - valid_param_dicts (list): Parameter dictionaries of the valid
+          selections, empty if none.
+        - result (dict): Validation result/error of the last selection.
+    """
+    valid_param_dicts = list()
+    result = {"msg": HTTP._400_, "details": Error.UNKNOWN_PARAM, "code": 400}
+    logging.debug(request.url)
+
+    if request.method == "POST":
+        for params in get_post_params():
+            params["base_url"] = request.base_url
+            (params, result) = checks_post(params)
+            if result["code"] == 200:
+                valid_param_dicts.append(params)
+    else:
+        (params, result) = checks_get()
+        if result["code"] == 200:
+            valid_param_dicts.append(params)
+    return valid_param_dicts, result
+
+
 def output() -> Any:
     """
     Main request handler for generating the response.
@@ -210,7 +258,9 @@ def output() -> Any:
     Orchestrates the flow:
     1. Determines request method (GET/POST).
     2. Calls validation logic.
-    3. Spawns a background process to fetch data (via `get_output`).
+    3. Spawns a background process to fetch data (via `get_output`), within
+       the deadline of the endpoint (`query_timeout` or `extent_timeout`),
+       if admitted (see `apps.admission`).
     4. returns the formatted response or an error.
 
     Returns:
@@ -218,25 +268,23 @@ def output() -> Any:
     """
 
     try:
-        valid_param_dicts = list()
-        result = {"msg": HTTP._400_, "details": Error.UNKNOWN_PARAM, "code": 400}
-        logging.debug(request.url)
-
-        if request.method == "POST":
-            for params in get_post_params():
-                params["base_url"] = request.base_url
-                (params, result) = checks_post(params)
-                if result["code"] == 200:
-                    valid_param_dicts.append(params)
-        else:
-            (params, result) = checks_get()
-            if result["code"] == 200:
-                valid_param_dicts.append(params)
+        (valid_param_dicts, result) = valid_requests()
 
         if valid_param_dicts:
+            timeout = (
+                settings.extent_timeout
+                if valid_param_dicts[0]["extent"]
+                else settings.query_timeout
+            )
 
             # Direct call to get_output, relying on Gunicorn workers for concurrency
-            resp = get_output(valid_param_dicts)
+            with admission.admission(
+                client_address(), admission.is_expensive(valid_param_dicts)
+            ) as admitted:
+                if not admitted:
+                    return unavailable_error()
+                with deadline.deadline(timeout):
+                    resp = get_output(valid_param_dicts)
             if resp:
                 return resp
             else:
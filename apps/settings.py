@@ -3,6 +3,8 @@ from typing import Literal
 from pydantic import Field, field_validator, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+from apps.globals import TIMEOUT
+
 class Settings(BaseSettings):
     """
     Application Settings using Pydantic.
@@ -28,6 +30,61 @@ class Settings(BaseSettings):
     cache_inventory_key: str = Field("inventory", alias="CACHE_INVENTORY_KEY")
     cache_inventory_period: int = Field(0, alias="CACHE_INVENTORY_PERIOD")
     cache_resp_period: int = Field(1200, alias="CACHE_RESP_PERIOD")
+    cache_negative_period: int = Field(60, alias="CACHE_NEGATIVE_PERIOD")
+
+    # Answer /extent from the `availability_extent` collection
+    extent_collection: bool = Field(False, alias="EXTENT_COLLECTION")
+
+    # Answer /extent and coarse /query from the `availability_coverage` collection
+    coverage_collection: bool = Field(False, alias="COVERAGE_COLLECTION")
+
+    # Fetch segments into Arrow columns with pymongoarrow (optional dependency)
+    arrow_fetch: bool = Field(False, alias="ARROW_FETCH")
+
+    # Time shards of long windows, read concurrently by more than one worker
+    query_shard_days: int = Field(365, ge=1, alias="QUERY_SHARD_DAYS")
+    query_shard_workers: int = Field(1, ge=1, alias="QUERY_SHARD_WORKERS")
+
+    # Requests handled concurrently per process by the gthread workers of
+    # gunicorn.conf.py; MongoDB connections are opened on demand
+    request_threads: int = Field(4, ge=1, alias="REQUEST_THREADS")
+
+    # Pre-flight estimate of the segments of a request, see `estimate_rows`.
+    # Requests estimated above `max_estimated_rows` are rejected, 0 = no estimate.
+    estimate_rows_per_day: float = Field(1.0, alias="ESTIMATE_ROWS_PER_DAY")
+    max_estimated_rows: int = Field(0, alias="MAX_ESTIMATED_ROWS")
+
+    # Deadline of /query and /extent requests in seconds, 0 = none. Keep it
+    # below the Gunicorn timeout, the request then ends with a 408 instead of
+    # the worker being killed.
+    query_timeout: float = Field(TIMEOUT - 60, ge=0, alias="QUERY_TIMEOUT")
+    extent_timeout: float = Field(TIMEOUT - 60, ge=0, alias="EXTENT_TIMEOUT")
+
+    # Concurrent requests of all workers, in total, per client and estimated
+    # above `admission_expensive_rows` segments, 0 = no cap. Turned down
+    # requests get a 503 with `Retry-After: admission_retry_after`.
+    admission_max_requests: int = Field(0, ge=0, alias="ADMISSION_MAX_REQUESTS")
+    admission_max_per_client: int = Field(0, ge=0, alias="ADMISSION_MAX_PER_CLIENT")
+    admission_max_expensive: int = Field(0, ge=0, alias="ADMISSION_MAX_EXPENSIVE")
+    admission_expensive_rows: int = Field(100_000, alias="ADMISSION_EXPENSIVE_ROWS")
+    admission_retry_after: int = Field(10, ge=0, alias="ADMISSION_RETRY_AFTER")
+
+    # Asynchronous jobs (/jobs/query and /jobs/extent), run by `python -m
+    # apps.jobs` into result files of `jobs_dir`, shared with the API and
+    # kept `jobs_ttl` seconds. `jobs_timeout` is their deadline, 0 = none.
+    # `jobs_max_rows` replaces the row limits of synchronous requests (see
+    # `jobs.job_params`), 0 = none.
+    jobs: bool = Field(False, alias="JOBS")
+    jobs_dir: str = Field("/tmp/ws-availability-jobs", alias="JOBS_DIR")
+    jobs_ttl: int = Field(86400, ge=1, alias="JOBS_TTL")
+    jobs_timeout: float = Field(3600, ge=0, alias="JOBS_TIMEOUT")
+    jobs_max_rows: int = Field(0, ge=0, alias="JOBS_MAX_ROWS")
+
+    # Fusion implementation, "auto" uses NumPy for large responses if installed
+    fusion_engine: Literal["auto", "python", "numpy"] = Field("auto", alias="FUSION_ENGINE")
+
+    # Filter on the `restr` field stamped by the view builder and the cacher
+    restriction_stamped: bool = Field(False, alias="RESTRICTION_STAMPED")
 
     model_config = SettingsConfigDict(env_file='.env', env_file_encoding='utf-8', extra='ignore')
 
@@ -69,6 +126,7 @@ def load_legacy_config():
             "CACHE_INVENTORY_KEY": getattr(Config, "CACHE_INVENTORY_KEY", None),
             "CACHE_INVENTORY_PERIOD": getattr(Config, "CACHE_INVENTORY_PERIOD", None),
             "CACHE_RESP_PERIOD": getattr(Config, "CACHE_RESP_PERIOD", None),
+            "CACHE_NEGATIVE_PERIOD": getattr(Config, "CACHE_NEGATIVE_PERIOD", None),
         }
     except ImportError:
         return {}
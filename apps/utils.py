@@ -1,3 +1,4 @@
+import functools
 import re
 import sys
 import time
@@ -108,6 +109,21 @@ def tictac(tic):
     return round(time.time() - tic, 2)
 
 
+# Timestamps memoized by a formatter, the most recently used are kept
+TIMESTAMP_MEMO_SIZE = 16384
+
+
+def timestamp_formatter(timespec="microseconds"):
+    # ISO 8601 UTC formatting memoized per value: boundaries repeat a lot in
+    # a response (midnights, same times across channels of a station). The
+    # memo is bounded, distinct values of large responses don't pile up.
+    @functools.lru_cache(maxsize=TIMESTAMP_MEMO_SIZE)
+    def format_timestamp(value):
+        return value.isoformat(timespec=timespec) + "Z"
+
+    return format_timestamp
+
+
 # Result HTTP code 400 shortcut function
 def error_param(params, dmesg):
     return (params, {"msg": HTTP._400_, "details": dmesg, "code": 400})
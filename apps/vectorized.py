@@ -0,0 +1,249 @@
+"""
+Vectorized Fusion Module for ws-availability.
+
+This module implements the `fusion` step of `data_access_layer` over NumPy
+columns: merge keys are dictionary-encoded into integer codes and times are
+converted to int64 microseconds, then group boundaries, gap tolerances and
+span merging are computed with array operations.
+
+Within a group of consecutive records with the same key, the Python
+`fusion` compares each record with the end of the current merged record,
+which is the running maximum of the ends of the group as long as records are
+sorted by start time and start before they end. The tolerance only depends
+on the sample rate of the first record of the merged record, constant if
+the whole group has one sample rate. Groups not meeting these conditions
+are merged by the Python implementation.
+
+Columns come either from records (`fusion`) or from an Arrow table fetched
+by `wfcatalog_client.collect_table` (`fusion_table`), in which case records
+are only built for the merged timespans.
+
+NumPy is optional, `HAS_NUMPY` tells whether it is available.
+"""
+from datetime import datetime, timedelta
+from operator import itemgetter
+from typing import Any, Callable
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from apps.globals import SAMPLERATE, START, END, UPDATED, COUNT
+
+HAS_NUMPY = np is not None
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+# Record fields of an Arrow table, in record column order
+TABLE_FIELDS = ["net", "sta", "loc", "cha", "qlt", "srate"]
+
+
+def _to_us(data: list[list[Any]], column: int):
+    # Much faster than letting NumPy convert datetime objects
+    return np.fromiter(((r[column] - EPOCH) // MICROSECOND for r in data), np.int64, len(data))
+
+
+def _from_us(value) -> datetime:
+    return EPOCH + timedelta(microseconds=int(value))
+
+
+def _bounds(keys: list, n: int) -> list[int]:
+    # Indexes where consecutive records change key, with 0 and n
+    changes = np.zeros(max(n - 1, 0), dtype=bool)
+    for key in keys:
+        changes |= key[1:] != key[:-1]
+    return np.concatenate(([0], np.flatnonzero(changes) + 1, [n])).tolist()
+
+
+def fusion(
+    params: dict, data: list[list[Any]], indexes: list[int], fallback: Callable
+) -> list[list[Any]]:
+    """
+    Merges adjacent time spans, see `data_access_layer.fusion`.
+
+    Args:
+        params: Dictionary of request parameters (used for 'mergegaps' tolerance).
+        data: List of ordered data records.
+        indexes: List of column indexes to check for equality when grouping.
+        fallback: Python fusion, called with the records of the groups that
+                  can't be vectorized.
+
+    Returns:
+        A new list of merged data records, identical to the Python fusion.
+    """
+    if not data:
+        return []
+    n = len(data)
+
+    # Dictionary-encoded merge key
+    key = itemgetter(*indexes)
+    codes = {}
+    keys = np.fromiter((codes.setdefault(key(r), len(codes)) for r in data), np.int64, n)
+
+    return _fuse(
+        params,
+        indexes,
+        _bounds([keys], n),
+        _to_us(data, START),
+        _to_us(data, END),
+        _to_us(data, UPDATED),
+        np.array([r[SAMPLERATE] for r in data], dtype=np.float64),
+        lambda i: list(data[i]),
+        fallback,
+    )
+
+
+def fusion_table(
+    params: dict, table, indexes: list[int], fallback: Callable, no_update: datetime
+) -> list[list[Any]]:
+    """
+    Merges the adjacent time spans of an Arrow table of segments.
+
+    Args:
+        params: Dictionary of request parameters (used for 'mergegaps' tolerance).
+        table: Table of ordered segments, with the `TABLE_FIELDS`, `ts`, `te`
+               and optionally `created` and `restr` columns.
+        indexes: List of column indexes to check for equality when grouping.
+        fallback: Python fusion, called with the records of the groups that
+                  can't be vectorized.
+        no_update: Last update of the records if `created` isn't a column.
+
+    Returns:
+        A list of merged data records, as `fusion` returns for the records
+        of the segments.
+    """
+    n = table.num_rows
+    if not n:
+        return []
+
+    # Dictionary-encoded codes and sample rates: records share the values
+    codes, values = [], []
+    for field in TABLE_FIELDS:
+        column = table[field].combine_chunks().dictionary_encode()
+        codes.append(column.indices.to_numpy())
+        values.append(column.dictionary.to_pylist())
+    values[2] = [loc if loc else "--" for loc in values[2]]
+
+    def times(field):
+        column = table[field].combine_chunks().to_numpy(zero_copy_only=False)
+        return column.astype("datetime64[us]").view(np.int64)
+
+    ts, te = times("ts"), times("te")
+    updated = times("created") if "created" in table.column_names else None
+    restr = (
+        table["restr"].combine_chunks().to_pylist()
+        if "restr" in table.column_names
+        else [None] * n
+    )
+
+    def record(i):
+        return [v[c[i]] for v, c in zip(values, codes)] + [
+            _from_us(ts[i]),
+            _from_us(te[i]),
+            _from_us(updated[i]) if updated is not None else no_update,
+            restr[i],
+            1,
+        ]
+
+    return _fuse(
+        params,
+        indexes,
+        _bounds([codes[i] for i in indexes], n),
+        ts,
+        te,
+        updated,
+        np.array(values[SAMPLERATE], dtype=np.float64)[codes[SAMPLERATE]],
+        record,
+        fallback,
+    )
+
+
+def _fuse(params, indexes, bounds, ts, te, updated, srate, record, fallback):
+    """
+    Merges the groups of records between consecutive `bounds`.
+
+    All groups are processed at once, Python only loops over the merged
+    records. `record(i)` builds a new record i, times are int64 microseconds
+    and `updated` may be None if records have no last update.
+    """
+    tol = params["mergegaps"] if params["mergegaps"] is not None else 0.0
+    n = len(ts)
+    starts = np.array(bounds[:-1], dtype=np.int64)
+    group = np.repeat(np.arange(len(starts), dtype=np.int64), np.diff(bounds))
+    inner = group[1:] == group[:-1]
+
+    # Groups the running maximum can't handle
+    bad = np.zeros(len(starts), dtype=bool)
+    bad[group[1:][inner & ((ts[1:] < ts[:-1]) | (srate[1:] != srate[:-1]))]] = True
+    bad[group[ts > te]] = True
+
+    # Tolerance of each record, computed as the Python fusion does
+    rates, rate = np.unique(srate, return_inverse=True)
+    tolerances = []
+    for r in rates.tolist():
+        tol2 = timedelta(seconds=max([tol, 1.0 / float(r)]))
+        tolerances.append((tol2.days * 86400 + tol2.seconds) * 1000000 + tol2.microseconds)
+    tol2 = np.array(tolerances, dtype=np.int64)[rate]
+
+    # Running maximum of the ends within each group: ends are ranked, and
+    # the group number put in front of the rank resets the maximum
+    values, rank = np.unique(te, return_inverse=True)
+    ends = values[np.maximum.accumulate((group << 32) | rank) & 0xFFFFFFFF]
+
+    newspan = np.ones(n, dtype=bool)
+    newspan[1:] = ~inner | (ts[1:] - ends[:-1] > tol2[1:])
+    spans = np.flatnonzero(newspan)
+    span_group = group[spans]
+    timespans = np.bincount(span_group, minlength=len(starts))
+
+    merge = []
+    if params["extent"]:
+        last_ends = np.maximum.reduceat(te, starts).tolist()
+        if updated is not None:
+            last_updated = np.maximum.reduceat(updated, starts).tolist()
+        for g, (a, b) in enumerate(zip(bounds[:-1], bounds[1:])):
+            if bad[g]:
+                merge += fallback(params, [record(i) for i in range(a, b)], indexes)
+                continue
+            row = record(a)
+            row[END] = _from_us(last_ends[g])
+            if updated is not None:
+                row[UPDATED] = _from_us(last_updated[g])
+            row[COUNT] = int(timespans[g])
+            merge.append(row)
+        return merge
+
+    sizes = np.diff(np.append(spans, n)).tolist()
+    last_ends = np.maximum.reduceat(te, spans).tolist()
+    if updated is not None:
+        last_updated = np.maximum.reduceat(updated, spans).tolist()
+    # Number of each timespan within its group, from 1
+    first_span = np.concatenate(([0], np.cumsum(timespans)[:-1]))
+    number = (np.arange(len(spans)) - first_span[span_group] + 1).tolist()
+    span_group = span_group.tolist()
+    timespans = timespans.tolist()
+    bad = bad.tolist()
+
+    for j, i in enumerate(spans.tolist()):
+        g, k = span_group[j], number[j]
+        if bad[g]:
+            if k == 1:
+                a, b = bounds[g], bounds[g + 1]
+                merge += fallback(params, [record(i) for i in range(a, b)], indexes)
+            continue
+        row = record(i)
+        if sizes[j] > 1:
+            row[END] = _from_us(last_ends[j])
+            if updated is not None:
+                row[UPDATED] = _from_us(last_updated[j])
+        # Same timespan counts as the Python fusion, which numbers the
+        # merged record when it's extended and when it's closed
+        if k < timespans[g]:
+            row[COUNT] = k + 1
+        elif sizes[j] > 1 or k == 1:
+            row[COUNT] = k
+        merge.append(row)
+
+    return merge
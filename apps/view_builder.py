@@ -0,0 +1,558 @@
+"""
+View Builder Module for ws-availability.
+
+This module builds the `availability` materialized view from the WFCatalog
+`daily_streams` and `c_segments` collections, like views/main.js, but:
+- Only daily streams created or updated since the last run are processed. The
+  processed-up-to `created` time (the watermark) is stored in the
+  `availability_meta` collection.
+- The work is split per network and day range and run by a pool of workers.
+- The extents of the touched streams are refreshed (see `EXTENT_COLLECTION`).
+- With `COVERAGE_COLLECTION`, the day coverage of the touched streams is
+  refreshed (see `apps.coverage`).
+- With `RESTRICTION_STAMPED`, the restriction status of the touched streams
+  is stamped on their segments (see `stamp_restrictions`).
+- Spans compacted by views/main.js holding a processed daily stream are
+  split back (see `split_spans`).
+
+The aggregations run on the MongoDB server, workers only wait for them, so a
+thread pool is used.
+
+Usage:
+    python -m apps.view_builder --workers 4 --chunk-days 30
+"""
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import groupby
+from operator import itemgetter
+
+from pymongo import MongoClient, UpdateOne
+
+from apps import coverage
+from apps.restriction import RestrictionInventory
+from apps.settings import settings
+
+META_ID = "view_builder"
+
+# Stamped on segments the API never returns: unknown seed IDs, start > end
+UNKNOWN = "UNKNOWN"
+
+
+def get_db(workers: int = 1):
+    """
+    Connects to the WFCatalog database.
+
+    The API client (see `wfcatalog_client.get_db_client`) is limited to one
+    connection, the builder needs one per worker.
+
+    Args:
+        workers: Number of concurrent workers.
+
+    Returns:
+        The WFCatalog database.
+    """
+    client = MongoClient(
+        settings.mongodb_host,
+        settings.mongodb_port,
+        username=settings.mongodb_usr,
+        password=settings.mongodb_pwd,
+        authSource=settings.mongodb_name,
+        maxPoolSize=max(1, workers),
+        directConnection=True,
+    )
+    return client.get_database(settings.mongodb_name)
+
+
+def get_watermark(db) -> datetime | None:
+    """
+    Reads the `created` time up to which daily streams were processed.
+
+    Args:
+        db: WFCatalog database.
+
+    Returns:
+        The watermark, or None if the view was never built.
+    """
+    meta = db.availability_meta.find_one({"_id": META_ID})
+    return meta["created"] if meta else None
+
+
+def set_watermark(db, created: datetime) -> None:
+    """
+    Stores the `created` time up to which daily streams were processed.
+
+    Args:
+        db: WFCatalog database.
+        created: New watermark.
+    """
+    db.availability_meta.update_one(
+        {"_id": META_ID},
+        {"$set": {"created": created, "updated": datetime.utcnow()}},
+        upsert=True,
+    )
+
+
+def created_filter(since: datetime | None, until: datetime) -> dict:
+    """
+    Builds the filter selecting daily streams created in (since, until].
+
+    Args:
+        since: Lower bound (excluded), None for no bound.
+        until: Upper bound (included).
+
+    Returns:
+        MongoDB query document on `created`.
+    """
+    created = {"$lte": until}
+    if since is not None:
+        created["$gt"] = since
+    return {"created": created}
+
+
+def split_range(start: datetime, end: datetime, days: int) -> list[tuple[datetime, datetime]]:
+    """
+    Splits a time range into windows of whole UTC days.
+
+    Args:
+        start: Start of the range (included).
+        end: End of the range (included).
+        days: Length of a window in days.
+
+    Returns:
+        List of (start, end) windows, end excluded, covering the range.
+    """
+    windows = []
+    ts = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    while ts <= end:
+        te = ts + timedelta(days=days)
+        windows.append((ts, te))
+        ts = te
+    return windows
+
+
+def plan_chunks(db, since: datetime | None, until: datetime, days: int = 30, networks: list[str] | None = None) -> list[dict]:
+    """
+    Splits the daily streams to process into chunks of work.
+
+    Args:
+        db: WFCatalog database.
+        since: Watermark of the previous run, None to process everything.
+        until: Watermark of this run.
+        days: Length of the day range of a chunk.
+        networks: Optional list of network codes to restrict the build to.
+
+    Returns:
+        List of MongoDB query documents, one per network and day range.
+    """
+    match = created_filter(since, until)
+    if networks:
+        match["net"] = {"$in": networks}
+
+    chunks = []
+    ranges = db.daily_streams.aggregate(
+        [
+            {"$match": match},
+            {"$group": {"_id": "$net", "first": {"$min": "$ts"}, "last": {"$max": "$ts"}}},
+            {"$sort": {"_id": 1}},
+        ]
+    )
+    for r in ranges:
+        for ts, te in split_range(r["first"], r["last"], days):
+            chunks.append(dict(match, net=r["_id"], ts={"$gte": ts, "$lt": te}))
+    return chunks
+
+
+def daily_pipeline(match: dict) -> list[dict]:
+    """
+    Builds the aggregation materializing complete daily streams.
+
+    Args:
+        match: Query document selecting the daily streams.
+
+    Returns:
+        Aggregation pipeline.
+    """
+    return [
+        {"$match": dict(match, avail={"$gte": 100})},
+        {
+            "$project": {
+                "net": 1,
+                "sta": 1,
+                "loc": 1,
+                "cha": 1,
+                "qlt": 1,
+                "stream": "$_id",
+                "srate": {"$arrayElemAt": ["$srate", 0]},
+                "ts": 1,
+                "te": 1,
+                "created": 1,
+                "restr": {"$literal": "OPEN"},
+                "count": {"$literal": 1},
+            }
+        },
+        {"$merge": {"into": "availability", "on": "_id", "whenMatched": "replace"}},
+    ]
+
+
+def continuous_pipeline(match: dict) -> list[dict]:
+    """
+    Builds the aggregation materializing the continuous segments of
+    incomplete daily streams.
+
+    Args:
+        match: Query document selecting the daily streams.
+
+    Returns:
+        Aggregation pipeline.
+    """
+    return [
+        {"$match": dict(match, avail={"$lt": 100})},
+        {
+            "$lookup": {
+                "from": "c_segments",
+                "localField": "_id",
+                "foreignField": "streamId",
+                "as": "c_segments",
+            }
+        },
+        {"$unwind": "$c_segments"},
+        {
+            "$project": {
+                "_id": "$c_segments._id",
+                "stream": "$_id",
+                "net": 1,
+                "sta": 1,
+                "loc": 1,
+                "cha": 1,
+                "qlt": 1,
+                "srate": "$c_segments.srate",
+                "ts": "$c_segments.ts",
+                "te": "$c_segments.te",
+                "created": 1,
+                "restr": {"$literal": "OPEN"},
+                "count": {"$literal": 1},
+            }
+        },
+        {"$merge": {"into": "availability", "on": "_id", "whenMatched": "replace"}},
+    ]
+
+
+def split_spans(db, match: dict) -> int:
+    """
+    Drops the compacted spans holding a daily stream about to be processed
+    again, and materializes all their daily streams again, see
+    `splitReprocessedSpans` in views/main.js. The view builder doesn't
+    compact them again.
+
+    Args:
+        db: WFCatalog database.
+        match: Query document selecting the daily streams processed.
+
+    Returns:
+        Number of spans split.
+    """
+    ids = [s["_id"] for s in db.daily_streams.find(match, projection={"_id": 1})]
+    spans = list(db.availability.find({"sources": {"$in": ids}}, projection={"sources": 1}))
+    if not spans:
+        return 0
+
+    db.availability.delete_many({"_id": {"$in": [span["_id"] for span in spans]}})
+    sources = {"_id": {"$in": [source for span in spans for source in span["sources"]]}}
+    db.daily_streams.aggregate(daily_pipeline(sources))
+    db.daily_streams.aggregate(continuous_pipeline(sources))
+    return len(spans)
+
+
+def process_chunk(db, match: dict) -> set[tuple]:
+    """
+    Materializes the segments of a chunk of daily streams.
+
+    Args:
+        db: WFCatalog database.
+        match: Query document selecting the daily streams of the chunk.
+
+    Returns:
+        Set of (net, sta, loc, cha) of the streams touched.
+    """
+    streams = set(
+        (s["_id"]["net"], s["_id"]["sta"], s["_id"]["loc"], s["_id"]["cha"])
+        for s in db.daily_streams.aggregate(
+            [
+                {"$match": match},
+                {"$group": {"_id": {"net": "$net", "sta": "$sta", "loc": "$loc", "cha": "$cha"}}},
+            ]
+        )
+    )
+    if streams:
+        split_spans(db, match)
+        db.daily_streams.aggregate(daily_pipeline(match))
+        db.daily_streams.aggregate(continuous_pipeline(match))
+    return streams
+
+
+def load_inventory() -> RestrictionInventory:
+    """
+    Loads the epoch inventory cached by the cacher.
+
+    Returns:
+        The restriction inventory.
+    """
+    return RestrictionInventory(
+        settings.cache_host, settings.cache_port, settings.cache_inventory_key
+    )
+
+
+def all_streams(db) -> set[tuple]:
+    """
+    Lists the streams of the `availability` view.
+
+    Args:
+        db: WFCatalog database.
+
+    Returns:
+        Set of (net, sta, loc, cha).
+    """
+    return set(
+        (s["_id"]["net"], s["_id"]["sta"], s["_id"]["loc"], s["_id"]["cha"])
+        for s in db.availability.aggregate(
+            [{"$group": {"_id": {"net": "$net", "sta": "$sta", "loc": "$loc", "cha": "$cha"}}}],
+            allowDiskUse=True,
+        )
+    )
+
+
+def restriction_status(inventory: RestrictionInventory, segment: dict) -> str | None:
+    """
+    Computes the `restr` value of a segment, with the rules the API applies
+    to unstamped segments (see `wfcatalog_client._apply_restricted_bit`).
+
+    Args:
+        inventory: Restriction inventory.
+        segment: Availability document.
+
+    Returns:
+        "OPEN", "RESTRICTED", "PARTIAL", None if no epoch covers the segment,
+        or UNKNOWN if the segment must never be returned.
+    """
+    sid = ".".join([segment["net"], segment["sta"], segment["loc"], segment["cha"]])
+    if sid not in inventory._inv or segment["ts"] > segment["te"]:
+        return UNKNOWN
+    if sid not in inventory._restricted_seedIDs:
+        return "OPEN"
+    r = inventory.is_restricted(sid, segment["ts"].date(), segment["te"].date())
+    return r.name if r else None
+
+
+def stamp_restrictions(db, inventory: RestrictionInventory, streams) -> int:
+    """
+    Stamps the restriction status of segments on their `restr` field.
+
+    Segments of open streams are updated in bulk, segments of streams with
+    restricted epochs one by one, and only if their status changed.
+
+    Args:
+        db: WFCatalog database.
+        inventory: Restriction inventory.
+        streams: Iterable of (net, sta, loc, cha).
+
+    Returns:
+        Number of streams stamped.
+    """
+    if not inventory.is_populated:
+        logging.error("Inventory isn't cached, restrictions weren't stamped.")
+        return 0
+
+    count = 0
+    for stream in streams:
+        codes = dict(zip(("net", "sta", "loc", "cha"), stream))
+        sid = ".".join(stream)
+        count += 1
+
+        if sid not in inventory._inv:
+            db.availability.update_many(codes, {"$set": {"restr": UNKNOWN}})
+            continue
+        if sid not in inventory._restricted_seedIDs:
+            db.availability.update_many(
+                dict(codes, restr={"$ne": "OPEN"}), {"$set": {"restr": "OPEN"}}
+            )
+            db.availability.update_many(
+                dict(codes, **{"$expr": {"$gt": ["$ts", "$te"]}}),
+                {"$set": {"restr": UNKNOWN}},
+            )
+            continue
+
+        updates = []
+        for segment in db.availability.find(codes, projection={"ts": 1, "te": 1, "restr": 1}):
+            status = restriction_status(inventory, dict(segment, **codes))
+            if "restr" not in segment or segment["restr"] != status:
+                updates.append(UpdateOne({"_id": segment["_id"]}, {"$set": {"restr": status}}))
+        if updates:
+            db.availability.bulk_write(updates, ordered=False)
+
+    return count
+
+
+def update_extent(db, stream: tuple) -> None:
+    """
+    Recomputes the extents of a stream, see `updateStreamExtent` in
+    views/main.js.
+
+    Args:
+        db: WFCatalog database.
+        stream: Tuple (net, sta, loc, cha).
+    """
+    codes = dict(zip(("net", "sta", "loc", "cha"), stream))
+    extents = []
+    extent = None
+
+    segments = db.availability.find(codes).sort([("qlt", 1), ("srate", 1), ("ts", 1)])
+    for segment in segments:
+        if segment["ts"] > segment["te"]:
+            continue
+        if extent is None or (extent["qlt"], extent["srate"]) != (segment["qlt"], segment["srate"]):
+            extent = dict(
+                codes,
+                qlt=segment["qlt"],
+                srate=segment["srate"],
+                earliest=segment["ts"],
+                latest=segment["te"],
+                updated=segment["created"],
+                timespans=1,
+                restr=segment["restr"],
+            )
+            extents.append(extent)
+            continue
+        if (segment["ts"] - extent["latest"]).total_seconds() > 1.0 / segment["srate"]:
+            extent["timespans"] += 1
+        extent["latest"] = max(extent["latest"], segment["te"])
+        extent["updated"] = max(extent["updated"], segment["created"])
+
+    for e in extents:
+        db.availability_extent.replace_one(
+            dict(codes, qlt=e["qlt"], srate=e["srate"]), e, upsert=True
+        )
+
+    # Drop extents of qualities/sample rates no longer present
+    stale = dict(codes)
+    if extents:
+        stale["$nor"] = [{"qlt": e["qlt"], "srate": e["srate"]} for e in extents]
+    db.availability_extent.delete_many(stale)
+
+
+def update_coverage(db, stream: tuple) -> None:
+    """
+    Recomputes the day coverage of a stream, one document per quality,
+    sample rate and year.
+
+    Args:
+        db: WFCatalog database.
+        stream: Tuple (net, sta, loc, cha).
+    """
+    codes = dict(zip(("net", "sta", "loc", "cha"), stream))
+    keys = []
+
+    segments = db.availability.find(
+        codes, projection={"qlt": 1, "srate": 1, "ts": 1, "te": 1, "created": 1, "updates": 1}
+    ).sort([("qlt", 1), ("srate", 1), ("ts", 1)])
+    for (qlt, srate), group in groupby(segments, key=itemgetter("qlt", "srate")):
+        for year, fields in coverage.encode(group, srate).items():
+            key = dict(codes, qlt=qlt, srate=srate, year=year)
+            db.availability_coverage.replace_one(key, dict(key, **fields), upsert=True)
+            keys.append({"qlt": qlt, "srate": srate, "year": year})
+
+    # Drop years, qualities or sample rates no longer present
+    stale = dict(codes)
+    if keys:
+        stale["$nor"] = keys
+    db.availability_coverage.delete_many(stale)
+
+
+def build(db, workers: int = 4, days: int = 30, networks: list[str] | None = None, since: datetime | None = None, full: bool = False, inventory: RestrictionInventory | None = None) -> int:
+    """
+    Brings the `availability` view up to date.
+
+    The watermark is only moved forward if every chunk succeeded, failed
+    chunks are therefore retried by the next run.
+
+    Args:
+        db: WFCatalog database.
+        workers: Number of chunks processed concurrently.
+        days: Length of the day range of a chunk.
+        networks: Optional list of network codes to restrict the build to.
+                  The watermark isn't moved by partial builds.
+        since: Process daily streams created after this time instead of the
+               stored watermark.
+        full: Process all daily streams.
+        inventory: Restriction inventory to stamp the touched streams with.
+
+    Returns:
+        Number of streams touched.
+    """
+    if full:
+        since = None
+    elif since is None:
+        since = get_watermark(db)
+    last = db.daily_streams.find_one({}, projection={"created": 1}, sort=[("created", -1)])
+    if last is None:
+        logging.info("No daily streams to process.")
+        return 0
+    until = last["created"]
+
+    chunks = plan_chunks(db, since, until, days, networks)
+    logging.info(f"Processing daily streams created in ({since}, {until}]: {len(chunks)} chunks.")
+
+    streams = set()
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(process_chunk, db, chunk) for chunk in chunks]
+        for chunk, future in zip(chunks, futures):
+            try:
+                streams |= future.result()
+            except Exception as ex:
+                failed += 1
+                logging.error(f"Chunk {chunk} failed: {ex}")
+
+        if inventory is not None:
+            stamp_restrictions(db, inventory, sorted(streams))
+        list(pool.map(lambda s: update_extent(db, s), sorted(streams)))
+        if settings.coverage_collection:
+            list(pool.map(lambda s: update_coverage(db, s), sorted(streams)))
+
+    if failed:
+        logging.error(f"{failed}/{len(chunks)} chunks failed, watermark kept.")
+    elif not networks:
+        set_watermark(db, until)
+    logging.info(f"Updated {len(streams)} streams.")
+    return len(streams)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] [0] [%(levelname)s] %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S +0000",
+    )
+    parser = argparse.ArgumentParser(description="Build the availability view.")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent chunks")
+    parser.add_argument("--chunk-days", type=int, default=30, help="day range of a chunk")
+    parser.add_argument("--networks", help="comma separated network codes")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="ignore the watermark, process streams created after this time")
+    parser.add_argument("--full", action="store_true", help="process all daily streams")
+    parser.add_argument("--restamp", action="store_true", help="stamp the restriction status of all streams")
+    args = parser.parse_args()
+
+    db = get_db(args.workers)
+    inventory = load_inventory() if settings.restriction_stamped or args.restamp else None
+    if args.restamp:
+        logging.info(f"Stamped {stamp_restrictions(db, inventory, sorted(all_streams(db)))} streams.")
+    build(
+        db,
+        args.workers,
+        args.chunk_days,
+        args.networks.split(",") if args.networks else None,
+        args.since,
+        args.full,
+        inventory,
+    )
@@ -0,0 +1,220 @@
+"""
+Cache Warm-up Module for ws-availability.
+
+This module replays the most frequent (or most expensive) availability
+requests found in a request log to pre-populate the row cache, e.g. after a
+view update, a Redis flush or at API start-up. Supported logs are:
+- JSONL files with one object per request, holding the request `url` (or
+  `path`/`request`) and optionally its `duration` in seconds.
+- Apache/Nginx access logs in common or combined format.
+
+Requests are canonicalized the same way the row cache is keyed, so requests
+differing only in output options or sub-day start/end count as one.
+
+`warm_worker` warms up an API worker itself: it loads the inventory and
+opens the Redis and MongoDB connections before the first request (see the
+`post_fork` hook of `gunicorn.conf.py`).
+
+Usage:
+    python -m apps.warmup access.log --top 200 --workers 4
+"""
+import argparse
+import json
+import logging
+import re
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlsplit
+
+from apps import wfcatalog_client
+from apps.parameters import Parameters
+from apps.redis_client import RedisClient
+from apps.restriction import RestrictionInventory
+from apps.root import check_parameters
+from apps.settings import settings
+from apps.wfcatalog_client import _cache_key, collect_data, get_db_client
+
+ACCESS_LOG_REQUEST = re.compile(r'"GET (\S+) HTTP/[0-9.]+"')
+URL_FIELDS = ("url", "path", "request")
+DURATION_FIELDS = ("duration", "elapsed")
+
+
+def parse_log_line(line: str) -> tuple[str | None, float | None]:
+    """
+    Extracts the requested URL and its duration from a log line.
+
+    Args:
+        line: A JSONL record or an access log line.
+
+    Returns:
+        A tuple (url, duration), each None if not available.
+    """
+    line = line.strip()
+    if line.startswith("{"):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return None, None
+        url = next((record[f] for f in URL_FIELDS if isinstance(record.get(f), str)), None)
+        if url and url.startswith(("GET ", "POST ")):
+            method, url = url.split(" ", 1)
+            url = url.split(" ")[0] if method == "GET" else None
+        duration = next(
+            (float(record[f]) for f in DURATION_FIELDS if isinstance(record.get(f), (int, float))),
+            None,
+        )
+        return url, duration
+
+    match = ACCESS_LOG_REQUEST.search(line)
+    return (match.group(1), None) if match else (None, None)
+
+
+def url_to_params(url: str) -> dict | None:
+    """
+    Validates an availability request URL into a parameter dictionary.
+
+    Args:
+        url: Requested URL or path with query string.
+
+    Returns:
+        The validated parameters, or None if the URL isn't a valid
+        `/query` or `/extent` request.
+    """
+    parts = urlsplit(url)
+    if not parts.path.rstrip("/").endswith(("/query", "/extent")):
+        return None
+
+    params = Parameters().todict()
+    args = dict(parse_qsl(parts.query, keep_blank_values=True))
+    for key, val in args.items():
+        if key not in params:
+            return None
+        params[key] = val
+    for key, alias in params["constraints"]["alias"]:
+        if key not in args:
+            params[key] = params[alias]
+        params[alias] = params[key]
+    params["base_url"] = parts.path
+
+    (params, result) = check_parameters(params)
+    return params if result["code"] == 200 else None
+
+
+def rank_requests(lines, top: int = 100, rank: str = "frequency") -> list[dict]:
+    """
+    Ranks the canonical requests found in a request log.
+
+    Args:
+        lines: Iterable of log lines.
+        top: Number of requests to keep.
+        rank: "frequency" to rank by number of occurrences, "cost" to rank by
+              total duration (requests without duration count 1 second).
+
+    Returns:
+        List of parameter dictionaries, most important first.
+    """
+    scores = Counter()
+    requests = {}
+    for line in lines:
+        url, duration = parse_log_line(line)
+        params = url_to_params(url) if url else None
+        if params is None:
+            continue
+        key = _cache_key(params)
+        requests.setdefault(key, params)
+        scores[key] += (duration or 1.0) if rank == "cost" else 1
+
+    logging.info(f"Found {len(requests)} distinct requests in {sum(scores.values())} hits.")
+    return [requests[key] for key, _ in scores.most_common(top)]
+
+
+def warm_cache(path: str, top: int = 100, workers: int = 2, rank: str = "frequency") -> int:
+    """
+    Pre-populates the row cache with the top requests of a request log.
+
+    Args:
+        path: Path to the request log.
+        top: Number of requests to replay.
+        workers: Maximum number of requests replayed concurrently.
+        rank: Ranking criteria, see `rank_requests`.
+
+    Returns:
+        The number of requests replayed successfully.
+    """
+    with open(path, encoding="utf-8", errors="replace") as log:
+        selections = rank_requests(log, top, rank)
+
+    def replay(params: dict) -> bool:
+        try:
+            collect_data([params])
+            return True
+        except Exception as ex:
+            logging.warning(f"Warm-up of {_cache_key(params)} failed: {ex}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        done = sum(pool.map(replay, selections))
+
+    logging.info(f"Warmed up {done}/{len(selections)} requests from {path}.")
+    return done
+
+
+def _load_inventory() -> None:
+    if not wfcatalog_client.RESTRICTED_INVENTORY:
+        wfcatalog_client.RESTRICTED_INVENTORY = RestrictionInventory(
+            settings.cache_host,
+            settings.cache_port,
+            settings.cache_inventory_key,
+        )
+
+
+def warm_worker() -> dict[str, float | None]:
+    """
+    Prepares an API worker for its first request.
+
+    Loads the restriction inventory, and opens and pings the Redis and
+    MongoDB connections, which are otherwise done lazily by the first
+    request. A failing step is logged and doesn't prevent the worker from
+    starting, it is retried by the first request.
+
+    Returns:
+        Seconds taken by each step, None for the failed steps.
+    """
+    steps = {
+        "inventory": _load_inventory,
+        "redis": lambda: RedisClient(settings.cache_host, settings.cache_port).ping(),
+        "mongodb": lambda: get_db_client().admin.command("ping"),
+    }
+    timings = {}
+    for name, step in steps.items():
+        start = time.perf_counter()
+        try:
+            step()
+            timings[name] = time.perf_counter() - start
+        except Exception as ex:
+            logging.warning(f"Worker warm-up of {name} failed: {ex}")
+            timings[name] = None
+
+    logging.info(
+        "Worker warmed up: "
+        + ", ".join(
+            f"{name} {'failed' if t is None else f'{t:.2f} s'}" for name, t in timings.items()
+        )
+    )
+    return timings
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] [0] [%(levelname)s] %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S +0000",
+    )
+    parser = argparse.ArgumentParser(description="Warm up the availability cache.")
+    parser.add_argument("log", help="request log (JSONL or access log)")
+    parser.add_argument("--top", type=int, default=100, help="requests to replay")
+    parser.add_argument("--workers", type=int, default=2, help="concurrent requests")
+    parser.add_argument("--rank", choices=("frequency", "cost"), default="frequency")
+    args = parser.parse_args()
+    warm_cache(args.log, args.top, args.workers, args.rank)
@@ -6,19 +6,80 @@ Inventory (for restriction checks). It constructs MongoDB queries, retrieves
 availability metrics, and applies access restrictions based on cached inventory data.
 It also manages caching logic using Redis.
 """
+import hashlib
+import heapq
+import itertools
+import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 from fnmatch import fnmatch
+from sys import intern
 # from flask import current_app (Removed)
 from .redis_client import RedisClient
 from pymongo import MongoClient
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from operator import itemgetter
 from typing import Any
 
+try:
+    import pyarrow
+    import pyarrow.compute as pc
+    from pymongoarrow.api import Schema, aggregate_arrow_all, find_arrow_all
+except ImportError:  # Optional, see `collect_table`
+    pyarrow = None
+
 from .restriction import RestrictionInventory
+from apps import coverage, deadline
+from apps.globals import START, END
+from apps.globals import ORDERBY
 
 RESTRICTED_INVENTORY = None
 
-PROJ = {
+
+class TooManyRows(Exception):
+    """Raised before fetching a request estimated to be too large."""
+
+
+# Orders on the last update
+ORDERBY_UPDATE = [orderby for orderby in ORDERBY if orderby.startswith("latestupdate")]
+
+# Order of the segments returned by MongoDB, required by the fusion step. It
+# is the order of the recommended index, see README.md.
+SORT_FIELDS = ["net", "sta", "loc", "cha", "qlt", "srate", "ts", "te"]
+
+# Record column of the sort fields
+SORT_COLUMNS = {"net": 0, "sta": 1, "loc": 2, "cha": 3, "qlt": 4, "srate": 5, "ts": 6, "te": 7}
+
+# Order of the records returned by `mongo_request`
+ROW_ORDER = itemgetter(*[SORT_COLUMNS[field] for field in SORT_FIELDS])
+
+# Last update of segments fetched without `created`, see `_projection`
+NO_UPDATE = datetime.min
+
+# Types of the segment fields fetched by `collect_table`
+ARROW_TYPES = (
+    {
+        "net": pyarrow.string(),
+        "sta": pyarrow.string(),
+        "loc": pyarrow.string(),
+        "cha": pyarrow.string(),
+        "qlt": pyarrow.string(),
+        "srate": pyarrow.float64(),
+        "ts": pyarrow.timestamp("ms"),
+        "te": pyarrow.timestamp("ms"),
+        "created": pyarrow.timestamp("ms"),
+        "restr": pyarrow.string(),
+    }
+    if pyarrow is not None
+    else {}
+)
+
+# First batch size of the cursors read entirely. Further batches are only
+# limited by the 16 MB of the server.
+BATCH_SIZE = 100000
+
+EXTENT_PROJ = {
     "_id": 0,
     "net": 1,
     "sta": 1,
@@ -26,10 +87,10 @@ PROJ = {
     "cha": 1,
     "qlt": 1,
     "srate": 1,
-    "ts": 1,
-    "te": 1,
-    "created": 1,
-    "count": 1,
+    "earliest": 1,
+    "latest": 1,
+    "updated": 1,
+    "timespans": 1,
     "restr": 1,
 }
 
@@ -49,7 +110,9 @@ def get_db_client():
             username=settings.mongodb_usr,
             password=settings.mongodb_pwd,
             authSource=settings.mongodb_name,
-            maxPoolSize=1,
+            # One connection per request thread (gthread workers) and per
+            # concurrent time shard (see `_time_shards`), opened on demand
+            maxPoolSize=settings.request_threads + settings.query_shard_workers,
             connect=False,
             directConnection=True,
             retryReads=False,
@@ -57,10 +120,25 @@ def get_db_client():
         )
     return DB_CLIENT
 
+
+# Threads reading the time shards of a request, see `_read_concurrently`
+SHARD_EXECUTOR = None
+
+def get_shard_executor():
+    global SHARD_EXECUTOR
+    if SHARD_EXECUTOR is None:
+        SHARD_EXECUTOR = ThreadPoolExecutor(
+            max_workers=settings.query_shard_workers, thread_name_prefix="shard"
+        )
+    return SHARD_EXECUTOR
+
 def mongo_request(paramslist: list[dict]) -> tuple[list[dict], list[list[Any]]]:
     """
     Constructs and executes MongoDB queries to retrieve availability metrics.
 
+    Long time windows are split into time shards (see `_time_shards`), read
+    concurrently with the other selections and merged back in order.
+
     Args:
         paramslist: List of dictionaries containing URL query parameters.
 
@@ -69,60 +147,569 @@ def mongo_request(paramslist: list[dict]) -> tuple[list[dict], list[list[Any]]]:
         - qries (list): List of executed MongoDB query objects (for logging).
         - result (list): Aggregated list of metric records extracted from the DB.
     """
-    db_name = settings.mongodb_name
-
-    result = []
-
     # List of queries executed agains the DB, let's keep it for logging
     qries = []
-    
+    shards = []
+    fields = _sort_fields(paramslist[0])
+
+    for params in paramslist:
+        qry = _selection_query(params)
+        if qry is None:
+            continue
+        for shard in _time_shards(qry, params):
+            qries.append(shard)
+            shards.append((shard, params))
+
+    def read(shard):
+        (qry, params) = shard
+        cursor = _window_updates(_query_cursor(qry, params, fields, BATCH_SIZE), params)
+
+        # Eager query execution instead of a cursor
+        include_restricted = params.get("includerestricted", False)
+        if settings.restriction_stamped:
+            return list(_stamped_rows(cursor, include_restricted))
+        return _apply_restricted_bit(_split_compacted(cursor), include_restricted)
+
+    parts = _read_concurrently(read, shards)
+
+    # Each part is sorted already, only several selections or shards need
+    # merging
+    if len(parts) == 1:
+        return qries, parts[0]
+    return qries, list(heapq.merge(*parts, key=_row_order(paramslist[0])))
+
+
+def mongo_stream(params: dict):
+    """
+    Reads the records of a single selection lazily.
+
+    Unlike `mongo_request`, MongoDB is only asked for the next batch of
+    segments when the previous one was consumed, so a caller needing only
+    the first records doesn't read the whole selection.
+
+    Args:
+        params: Dictionary of query parameters.
+
+    Yields:
+        Availability records, in the order of `_row_order`.
+    """
+    selection = _selection_cursor(params, _sort_fields(params))
+    if selection is None:
+        return
+    (qry, cursor) = selection
+    logging.debug(qry)
+
+    include_restricted = params.get("includerestricted", False)
+    segments = _window_updates(cursor, params)
+    try:
+        if settings.restriction_stamped:
+            yield from _stamped_rows(segments, include_restricted)
+        else:
+            yield from _restricted_rows(_split_compacted(segments), include_restricted)
+    finally:
+        # Release the server-side cursor if the caller stopped early
+        cursor.close()
+
+
+def _selection_cursor(params: dict, fields: list[str], batch_size: int = 0):
+    """
+    Queries the segments of a selection.
+
+    Args:
+        params: Dictionary of query parameters, wildcards are expanded in place.
+        fields: Fields to sort the segments on, see `_sort_fields`.
+        batch_size: Size of the first batch, 0 for the server default (101).
+
+    Returns:
+        A tuple (query, cursor), or None if the selection doesn't match any
+        known stream.
+    """
+    qry = _selection_query(params)
+    if qry is None:
+        return None
+    return qry, _query_cursor(qry, params, fields, batch_size)
+
+
+def _query_cursor(qry: dict, params: dict, fields: list[str], batch_size: int = 0):
+    """
+    Runs the query of a selection, or of one of its time shards.
+
+    Args:
+        qry: MongoDB query, see `_selection_query`.
+        params: Dictionary of query parameters.
+        fields: Fields to sort the segments on, see `_sort_fields`.
+        batch_size: Size of the first batch, 0 for the server default (101).
+
+    Returns:
+        MongoDB cursor.
+    """
     # Use GLOBAL client (Fix for Connection Churn & Thread Exhaustion)
     client = get_db_client()
-    db = client.get_database(db_name)
-    
+    db = client.get_database(settings.mongodb_name)
+
+    # Segments are sorted by MongoDB, walking the index if nothing is
+    # merged, otherwise grouped by the merged key.
+    projection = _projection(params)
+    if fields != SORT_FIELDS:
+        options = {"batchSize": batch_size} if batch_size else {}
+        options.update(_time_limit("maxTimeMS"))
+        cursor = db.availability.aggregate(
+            [
+                {"$match": qry},
+                {"$sort": {field: 1 for field in fields}},
+                {"$project": projection},
+            ],
+            allowDiskUse=True,
+            **options,
+        )
+    else:
+        # The index of the README serves this sort. No allow_disk_use: the
+        # find option only exists from MongoDB 4.4.
+        cursor = db.availability.find(
+            qry,
+            projection=projection,
+            sort=[(field, 1) for field in fields],
+            batch_size=batch_size,
+            **_time_limit(),
+        )
+    return cursor
+
+
+def _time_limit(option: str = "max_time_ms") -> dict:
+    """
+    Builds the option limiting a MongoDB query to the time left before the
+    deadline of the request, see `deadline.max_time_ms`.
+
+    Args:
+        option: Name of the option, `maxTimeMS` for aggregations.
+
+    Returns:
+        Dictionary of keyword arguments, empty without deadline.
+    """
+    ms = deadline.max_time_ms()
+    return {option: ms} if ms is not None else {}
+
+
+def _selection_query(params: dict) -> dict | None:
+    """
+    Builds the MongoDB query of the segments of a selection.
+
+    Args:
+        params: Dictionary of query parameters, wildcards are expanded in place.
+
+    Returns:
+        MongoDB query, or None if the selection doesn't match any known stream.
+    """
+    params = _expand_wildcards(params)
+    if not params["network"]:
+        # No stream of the inventory matches, MongoDB can't return anything
+        logging.debug("Selection doesn't match any known stream.")
+        return None
+
+    # Crop datetimes to accomodate sub-segment queries.
+    # e.g. net=NL&sta=HGN&start=2018-01-06T06:00:00&end=2018-01-06T12:00:00
+    # when we have one 24h segment for 2018-01-06
+    start, end = crop_datetimes(params)
+    qry = _codes_query(params)
+    if start is not None:
+        te = {"$gt": start}
+        qry["te"] = te
+    if end is not None:
+        ts = {"$lt": end}
+        qry["ts"] = ts
+    include_restricted = params.get("includerestricted", False)
+    if settings.restriction_stamped:
+        qry["restr"] = _restricted_filter(include_restricted)
+
+    # if end:
+    #    te = {"$lte": end}
+    #    qry["te"] = te
+
+    return qry
+
+
+def _time_shards(qry: dict, params: dict) -> list[dict]:
+    """
+    Splits the query of a long time window into time shards.
+
+    With more than one `query_shard_workers`, a window starting more than
+    `query_shard_days` before its end (or now) is cut into shards of that
+    many days, to be read concurrently on several connections. Shards
+    partition the segments on their start time, the first one keeping every
+    segment starting before the window, so each segment is read once and
+    the sorted shards of a selection can be merged back (see
+    `mongo_request`). Windows without a start aren't split.
+
+    Args:
+        qry: MongoDB query of a selection, see `_selection_query`.
+        params: Dictionary of query parameters.
+
+    Returns:
+        List of MongoDB queries, [qry] if the window isn't split.
+    """
+    if settings.query_shard_workers <= 1 or params["start"] is None:
+        return [qry]
+
+    start, end = crop_datetimes(params)
+    if end is None:
+        end = datetime.utcnow()
+    period = timedelta(days=settings.query_shard_days)
+    bounds = []
+    bound = start + period
+    while bound < end:
+        bounds.append(bound)
+        bound += period
+    if not bounds:
+        return [qry]
+
+    shards = []
+    for lower, upper in zip([None] + bounds, bounds + [None]):
+        ts = dict(qry.get("ts", {}))
+        if lower is not None:
+            ts["$gte"] = lower
+        if upper is not None:
+            ts["$lt"] = upper
+        shards.append(dict(qry, ts=ts))
+    return shards
+
+
+def _read_concurrently(read, items: list) -> list:
+    """
+    Calls `read` on every item, in the threads of `get_shard_executor`.
+
+    Each call runs in a copy of the context of the caller, which holds the
+    request deadline.
+
+    Args:
+        read: Function reading a selection or time shard.
+        items: Arguments of `read`.
+
+    Returns:
+        List of the results, in the order of `items`.
+    """
+    if settings.query_shard_workers > 1 and len(items) > 1:
+        contexts = [copy_context() for _ in items]
+        return list(
+            get_shard_executor().map(lambda context, item: context.run(read, item), contexts, items)
+        )
+    return [read(item) for item in items]
+
+
+def _optional_fields(params: dict) -> list[str]:
+    """
+    Lists the segment fields a request needs besides codes and times.
+
+    `created` is only used to show or sort on the last update, together with
+    the per-day updates of compacted spans (see `_window_updates`), and
+    `restr` in extent mode or to find PARTIAL segments when restrictions are
+    stamped.
+    `count` is never needed, `fusion` computes the timespan counts.
+
+    Args:
+        params: Dictionary of query parameters.
+
+    Returns:
+        List of MongoDB fields.
+    """
+    fields = []
+    if params.get("showlastupdate") or params.get("orderby") in ORDERBY_UPDATE:
+        fields.append("created")
+    if params.get("extent") or settings.restriction_stamped:
+        fields.append("restr")
+    return fields
+
+
+def _projection(params: dict) -> dict:
+    """
+    Builds the projection of the segments of a selection.
+
+    Fields a request doesn't need are neither sent by MongoDB nor decoded.
+
+    Args:
+        params: Dictionary of query parameters.
+
+    Returns:
+        MongoDB projection.
+    """
+    projection = {"_id": 0}
+    for field in SORT_FIELDS + _optional_fields(params):
+        projection[field] = 1
+    if "created" in projection:
+        projection["updates"] = 1
+    return projection
+
+
+def _sort_fields(params: dict) -> list[str]:
+    """
+    Lists the fields the segments of a selection are sorted on.
+
+    Merged qualities or sample rates are left out of the key, so the
+    segments the fusion step merges are next to each other, in time order.
+
+    Args:
+        params: Dictionary of query parameters.
+
+    Returns:
+        List of MongoDB fields, SORT_FIELDS if nothing is merged.
+    """
+    merge = params.get("merge") or []
+    fields = ["net", "sta", "loc", "cha"]
+    if "quality" not in merge:
+        fields.append("qlt")
+    if "samplerate" not in merge:
+        fields.append("srate")
+    return fields + ["ts", "te"]
+
+
+def _row_order(params: dict) -> itemgetter:
+    """
+    Returns the sort key of the records of a selection, see `_sort_fields`.
+
+    Args:
+        params: Dictionary of query parameters.
+
+    Returns:
+        Record sort key.
+    """
+    return itemgetter(*[SORT_COLUMNS[field] for field in _sort_fields(params)])
+
+
+def _codes_query(params: dict) -> dict:
+    """
+    Builds the MongoDB filter on stream codes and quality.
+
+    Args:
+        params: Dictionary of query parameters with expanded wildcards.
+
+    Returns:
+        MongoDB query document.
+    """
+    qry = {}
+    if params["network"] != "*":
+        network = {"$in": params["network"].split(",")}
+        qry["net"] = network
+    if params["station"] != "*":
+        station = {"$in": params["station"].split(",")}
+        qry["sta"] = station
+    if params["location"] != "*":
+        location = {"$in": params["location"].split(",")}
+        qry["loc"] = location
+    if params["channel"] != "*":
+        qry["cha"] = {"$in": params["channel"].split(",")}
+    if params["quality"] != "*":
+        quality = {"$in": params["quality"].split(",")}
+        qry["qlt"] = quality
+    return qry
+
+
+def collect_extents(paramslist: list[dict]) -> list[list[Any]] | None:
+    """
+    Retrieves precomputed extents from the `availability_extent` collection.
+
+    The view builder maintains one document per (net, sta, loc, cha, qlt,
+    srate) holding earliest, latest, updated and timespans. Such a document
+    is the final `/extent` answer as long as the stream is open and lies
+    entirely inside the requested window, otherwise the caller must fall
+    back to fusing the raw segments.
+
+    Args:
+        paramslist: List of parameter dictionaries.
+
+    Returns:
+        List of extent records, already merged, or None if the request
+        can't be answered from the collection.
+    """
+    merge = paramslist[0]["merge"]
+    if not settings.extent_collection:
+        return None
+    if "quality" in merge or "samplerate" in merge:
+        return None
+
+    db = get_db_client().get_database(settings.mongodb_name)
+
+    extents = {}
     for params in paramslist:
-        params = _expand_wildcards(params)
-        # Crop datetimes to accomodate sub-segment queries.
-        # e.g. net=NL&sta=HGN&start=2018-01-06T06:00:00&end=2018-01-06T12:00:00
-        # when we have one 24h segment for 2018-01-06
-        start, end = crop_datetimes(params)
-        qry = {}
-        if params["network"] != "*":
-            network = {"$in": params["network"].split(",")}
-            qry["net"] = network
-        if params["station"] != "*":
-            station = {"$in": params["station"].split(",")}
-            qry["sta"] = station
-        if params["location"] != "*":
-            location = {"$in": params["location"].split(",")}
-            qry["loc"] = location
-        if params["channel"] != "*":
-            qry["cha"] = {"$in": params["channel"].split(",")}
-        if params["quality"] != "*":
-            quality = {"$in": params["quality"].split(",")}
-            qry["qlt"] = quality
+        # Expand on a copy, the request parameters are still needed as
+        # given if we fall back to the segments.
+        expanded = _expand_wildcards(dict(params))
+        if not expanded["network"]:
+            continue
+
+        qry = _codes_query(expanded)
+        if params["start"] is not None:
+            qry["latest"] = {"$gt": params["start"]}
+        if params["end"] is not None:
+            qry["earliest"] = {"$lt": params["end"]}
+
+        for extent in db.availability_extent.find(qry, projection=EXTENT_PROJ, **_time_limit()):
+            sid = ".".join([extent["net"], extent["sta"], extent["loc"], extent["cha"]])
+            if sid not in RESTRICTED_INVENTORY._known_seedIDs:
+                continue
+            # Restricted streams and extents cut by the window need segments
+            if sid in RESTRICTED_INVENTORY._restricted_seedIDs:
+                return None
+            if params["start"] is not None and extent["earliest"] < params["start"]:
+                return None
+            if params["end"] is not None and extent["latest"] > params["end"]:
+                return None
+
+            row = [
+                extent["net"],
+                extent["sta"],
+                extent["loc"] if extent["loc"] else "--",
+                extent["cha"],
+                extent["qlt"],
+                extent["srate"],
+                extent["earliest"],
+                extent["latest"],
+                extent["updated"],
+                extent["restr"],
+                extent["timespans"],
+            ]
+            extents[tuple(row[:6])] = row
+
+    return [extents[key] for key in sorted(extents)]
+
+
+def collect_coverage(paramslist: list[dict]) -> list[list[Any]] | None:
+    """
+    Builds records from the day coverage in `availability_coverage`.
+
+    The view builder maintains per-year day bitmaps of every stream (see
+    `apps.coverage`). They are exact for extents and for requests merging
+    gaps of at least a day, as long as the time window starts and ends at
+    midnight and the streams are open. Otherwise the caller must fall back
+    to the segments.
+
+    Args:
+        paramslist: List of parameter dictionaries.
+
+    Returns:
+        List of records, or None if the request can't be answered from the
+        coverage. Extents are already merged, `/query` records still need
+        the fusion step.
+    """
+    merge = paramslist[0]["merge"]
+    mergegaps = paramslist[0]["mergegaps"]
+    extent = paramslist[0]["extent"]
+    if not settings.coverage_collection:
+        return None
+    if "quality" in merge or "samplerate" in merge:
+        return None
+    # Gaps within a day are only known as a number of timespans
+    if (mergegaps is None and not extent) or (mergegaps is not None and mergegaps < 86400):
+        return None
+
+    db = get_db_client().get_database(settings.mongodb_name)
+
+    groups = {}
+    for params in paramslist:
+        start, end = params["start"], params["end"]
+        if any(t is not None and t != datetime(t.year, t.month, t.day) for t in (start, end)):
+            return None
+        expanded = _expand_wildcards(dict(params))
+        if not expanded["network"]:
+            continue
+
+        qry = _codes_query(expanded)
         if start is not None:
-            te = {"$gt": start}
-            qry["te"] = te
+            qry["year"] = {"$gte": start.year}
         if end is not None:
-            ts = {"$lt": end}
-            qry["ts"] = ts
+            qry.setdefault("year", {})["$lte"] = end.year
+
+        for doc in db.availability_coverage.find(qry, **_time_limit()):
+            sid = ".".join([doc["net"], doc["sta"], doc["loc"], doc["cha"]])
+            if sid not in RESTRICTED_INVENTORY._known_seedIDs:
+                continue
+            if sid in RESTRICTED_INVENTORY._restricted_seedIDs:
+                return None
+            key = (
+                doc["net"],
+                doc["sta"],
+                doc["loc"] if doc["loc"] else "--",
+                doc["cha"],
+                doc["qlt"],
+                doc["srate"],
+            )
+            # Streams selected by several windows need the segments
+            window, years = groups.setdefault(key, ((start, end), {}))
+            if window != (start, end):
+                return None
+            years[doc["year"]] = doc
+
+    data = []
+    for key in sorted(groups):
+        ((start, end), years) = groups[key]
+        items = coverage.spans([years[y] for y in sorted(years)], start, end)
+        if not items:
+            continue
+        if extent:
+            (earliest, latest, updated, timespans) = coverage.extent(items, key[5], mergegaps)
+            data.append(list(key) + [earliest, latest, updated, "OPEN", timespans])
+        else:
+            data += [list(key) + [first, last, updated, "OPEN", 1] for first, last, _, updated in items]
+    return data
 
-        # if end:
-        #    te = {"$lte": end}
-        #    qry["te"] = te
 
-        qries.append(qry)
+def estimate_rows(paramslist: list[dict]) -> int:
+    """
+    Estimates the number of segments of a request before fetching them.
 
-        cursor = db.availability.find(qry, projection=PROJ)
+    The model is the number of days each matching seed ID of the inventory
+    was operating within the requested window (from its first epoch start to
+    its last epoch end, or today), times `estimate_rows_per_day`: the view
+    builder stores at most one segment per stream and day unless there are
+    gaps. Streams without a start date only count if the window has one.
+
+    Args:
+        paramslist: List of parameter dictionaries.
+
+    Returns:
+        Estimated number of segments.
+    """
+    today = date.today()
+    days = 0
+    for params in paramslist:
+        start, end = crop_datetimes(params)
+        start = start.date() if start is not None else None
+        end = end.date() if end is not None else today
+        for sid in set(_matching_seed_ids(params)):
+            epochs = RESTRICTED_INVENTORY._inv[sid]
+            if not epochs:
+                continue
+            first = epochs[0].start
+            if start is not None and (first is None or first < start):
+                first = start
+            if first is None:
+                continue
+            last = min(end, epochs[-1].end or today)
+            days += max((last - first).days, 0)
+    return int(days * settings.estimate_rows_per_day)
 
-        # Eager query execution instead of a cursor
-        result += _apply_restricted_bit(cursor, params.get("includerestricted", False))
 
-    # Result needs to be sorted, this seems to be required by the fusion step
-    result.sort(key=lambda x: (x[0], x[1], x[2], x[3], x[4]))
+def _check_estimate(paramslist: list[dict]) -> int | None:
+    """
+    Rejects selections estimated to exceed `max_estimated_rows` segments,
+    or the `max_rows` parameter of jobs (see `jobs.job_params`).
+
+    Args:
+        paramslist: List of parameter dictionaries about to be fetched, all
+                    the missing selections of a request at once.
 
-    return qries, result
+    Returns:
+        Estimated number of segments (see `estimate_rows`), None if the
+        limit is 0.
+
+    Raises:
+        TooManyRows: If the estimate exceeds the limit.
+    """
+    limit = paramslist[0].get("max_rows", settings.max_estimated_rows)
+    if not limit:
+        return None
+    estimate = estimate_rows(paramslist)
+    if estimate > limit:
+        raise TooManyRows(f"Request rejected, {estimate} segments estimated.")
+    return estimate
 
 
 def crop_datetimes(params: dict) -> tuple[datetime | None, datetime | None]:
@@ -152,6 +739,76 @@ def crop_datetimes(params: dict) -> tuple[datetime | None, datetime | None]:
     return start_cropped, end_cropped
 
 
+def _restricted_filter(include_restricted: bool = False) -> dict:
+    """
+    Builds the MongoDB filter on the `restr` field stamped by the view builder.
+
+    PARTIAL segments are always fetched: a compacted span may only be
+    partially restricted, see `_stamped_rows`.
+
+    Args:
+        include_restricted: If True, restricted data is included.
+
+    Returns:
+        MongoDB query document on `restr`.
+    """
+    if include_restricted:
+        return {"$ne": "UNKNOWN"}
+    return {"$in": ["OPEN", "PARTIAL", None]}
+
+
+def _stamped_rows(data: Any, include_restricted: bool = False):
+    """
+    Converts segments with a stamped `restr` field into records.
+
+    The restriction status was resolved by the view builder, only PARTIAL
+    segments go through `_apply_restricted_bit` to resolve it per day.
+
+    Args:
+        data: Cursor or list of availability documents from MongoDB.
+        include_restricted: If True, restricted data is included.
+
+    Yields:
+        Availability records.
+    """
+    for segment in deadline.checked(data):
+        if segment.get("restr") == "PARTIAL":
+            yield from _restricted_rows(_split_compacted([segment]), include_restricted)
+        else:
+            yield _segment_row(segment)
+
+
+def _segment_row(segment: dict) -> list[Any]:
+    """
+    Converts an availability document into a record.
+
+    Codes are interned: every decoded document comes with its own strings,
+    sharing them divides the memory of large row sets by almost two, and
+    pickle stores shared strings once in the cache. Fields left out of the
+    projection get placeholders, see `_optional_fields`.
+
+    Args:
+        segment: Availability document.
+
+    Returns:
+        Availability record.
+    """
+    restr = segment.get("restr")
+    return [
+        intern(segment["net"]),
+        intern(segment["sta"]),
+        intern(segment["loc"]) if segment["loc"] else "--",  # Convert empty location to '--'
+        intern(segment["cha"]),
+        intern(segment["qlt"]),
+        segment["srate"],
+        segment["ts"],
+        segment["te"],
+        segment.get("created", NO_UPDATE),
+        intern(restr) if restr else restr,
+        1,
+    ]
+
+
 def _apply_restricted_bit(data: Any, include_restricted: bool = False) -> list[list[Any]]:
     """
     Filters data based on restricted status from the inventory.
@@ -167,10 +824,21 @@ def _apply_restricted_bit(data: Any, include_restricted: bool = False) -> list[l
     Returns:
         List of filtered availability records with restriction status applied.
     """
+    return list(_restricted_rows(data, include_restricted))
 
-    results = []
 
-    for segment in data:
+def _restricted_rows(data: Any, include_restricted: bool = False):
+    """
+    Lazy version of `_apply_restricted_bit`.
+
+    Args:
+        data: Cursor or list of availability documents from MongoDB.
+        include_restricted: If True, restricted data is included.
+
+    Yields:
+        Availability records with restriction status applied.
+    """
+    for segment in deadline.checked(data):
         sid = ".".join([segment["net"], segment["sta"], segment["loc"], segment["cha"]])
 
         if sid not in RESTRICTED_INVENTORY._known_seedIDs:
@@ -186,23 +854,95 @@ def _apply_restricted_bit(data: Any, include_restricted: bool = False) -> list[l
             if segment["restr"] in ["RESTRICTED", "PARTIAL"] and not include_restricted:
                 continue
 
-        results.append(
-            [
-                segment["net"],
-                segment["sta"],
-                segment["loc"] if segment["loc"] else "--",  # Convert empty location to '--'
-                segment["cha"],
-                segment["qlt"],
-                segment["srate"],
-                segment["ts"],
-                segment["te"],
-                segment["created"],
-                segment["restr"],
-                segment["count"],
-            ]
-        )
+        yield _segment_row(segment)
+
+
+def _split_compacted(data: Any):
+    """
+    Splits compacted spans of partially restricted streams at UTC midnights.
+
+    The view builder may merge contiguous daily segments into one span (see
+    `compactStream` in views/main.js). Restrictions are resolved per day, so a
+    span crossing a change of restriction is cut back into days to get the
+    same statuses, and last updates, as the daily segments it replaces.
+    Fusion joins the pieces again.
+
+    Args:
+        data: Cursor or list of availability documents from MongoDB.
+
+    Yields:
+        Availability documents.
+    """
+    for segment in data:
+        if (
+            segment["ts"].date() == segment["te"].date()
+            or ".".join([segment["net"], segment["sta"], segment["loc"], segment["cha"]])
+            not in RESTRICTED_INVENTORY._restricted_seedIDs
+            or _get_restricted_status(segment) != "PARTIAL"
+        ):
+            yield segment
+            continue
+
+        ts = segment["ts"]
+        while ts < segment["te"]:
+            midnight = ts.replace(hour=0, minute=0, second=0, microsecond=0)
+            te = min(midnight + timedelta(days=1), segment["te"])
+            piece = dict(segment, ts=ts, te=te)
+            if segment.get("updates"):
+                piece["created"] = _span_update(segment, ts, te)
+            yield piece
+            ts = te
+
+
+def _window_updates(data: Any, params: dict):
+    """
+    Gives compacted spans the last update of their days in the time window.
+
+    A span keeps the latest update of the segments it merges in `created`,
+    and the last update of each of its days in `updates` (see
+    `compactStream` in views/main.js). A window covering part of a span gets
+    the update of its own days, as with the daily segments the span
+    replaces. Windows are whole UTC days, see `crop_datetimes`.
+
+    Args:
+        data: Cursor or list of availability documents from MongoDB.
+        params: Dictionary of query parameters.
+
+    Yields:
+        Availability documents.
+    """
+    start, end = crop_datetimes(params)
+    for segment in data:
+        if segment.get("updates"):
+            segment["created"] = _span_update(
+                segment,
+                max(segment["ts"], start) if start is not None else segment["ts"],
+                min(segment["te"], end) if end is not None else segment["te"],
+            )
+        yield segment
 
-    return results
+
+def _span_update(segment: dict, ts: datetime, te: datetime) -> datetime:
+    """
+    Computes the last update of the days of a compacted span overlapping
+    [ts, te).
+
+    Args:
+        segment: Compacted span, with its per-day `updates`.
+        ts: Start of the part of the span.
+        te: End of the part of the span.
+
+    Returns:
+        Latest `created` of these days.
+    """
+    return max(
+        (
+            update["created"]
+            for update in segment["updates"]
+            if update["day"] < te and update["day"] + timedelta(days=1) > ts
+        ),
+        default=segment["created"],
+    )
 
 
 def _expand_wildcards(params: dict) -> dict:
@@ -218,6 +958,39 @@ def _expand_wildcards(params: dict) -> dict:
     Returns:
         Dictionary with expanded parameters (wildcards replaced by concrete lists).
     """
+    _cha = _matching_seed_ids(params)
+
+    # Replace original query parameters with ones filtered out from the cached inventory.
+    params["network"] = ",".join(set([e.split(".")[0] for e in _cha]))
+    params["station"] = (
+        "*"
+        if params["station"] == "*"
+        else ",".join(set([e.split(".")[1] for e in _cha]))
+    )
+    params["location"] = (
+        "*"
+        if params["location"] == "*"
+        else ",".join(set([e.split(".")[2] for e in _cha]))
+    )
+    params["channel"] = (
+        "*"
+        if params["channel"] == "*"
+        else ",".join(set([e.split(".")[3] for e in _cha]))
+    )
+
+    return params
+
+
+def _matching_seed_ids(params: dict) -> list[str]:
+    """
+    Lists the seed IDs of the cached inventory matching query parameters.
+
+    Args:
+        params: Dictionary of query parameters.
+
+    Returns:
+        List of seed IDs, possibly repeated if several codes match.
+    """
     global RESTRICTED_INVENTORY
 
     if not RESTRICTED_INVENTORY:
@@ -250,25 +1023,7 @@ def _expand_wildcards(params: dict) -> dict:
     for cha in params["channel"].split(","):
         _cha += [e for e in _loc if fnmatch(e.split(".")[3], cha)]
 
-    # Replace original query parameters with ones filtered out from the cached inventory.
-    params["network"] = ",".join(set([e.split(".")[0] for e in _cha]))
-    params["station"] = (
-        "*"
-        if params["station"] == "*"
-        else ",".join(set([e.split(".")[1] for e in _cha]))
-    )
-    params["location"] = (
-        "*"
-        if params["location"] == "*"
-        else ",".join(set([e.split(".")[2] for e in _cha]))
-    )
-    params["channel"] = (
-        "*"
-        if params["channel"] == "*"
-        else ",".join(set([e.split(".")[3] for e in _cha]))
-    )
-
-    return params
+    return _cha
 
 
 def _get_restricted_status(segment: dict) -> str | None:
@@ -299,33 +1054,423 @@ def _get_restricted_status(segment: dict) -> str | None:
         return None
 
 
-def collect_data(params: dict) -> list[list[Any]] | None:
+def _normalize_codes(codes: str) -> str:
+    """
+    Sorts and deduplicates a comma separated list of codes.
+
+    Args:
+        codes: Comma separated codes, e.g. "NL,BE,NL".
+
+    Returns:
+        Normalized codes, e.g. "BE,NL".
+    """
+    return ",".join(sorted(set(codes.split(","))))
+
+
+def _selection_key(params: dict) -> dict:
+    """
+    Builds the canonical description of the rows a selection needs.
+
+    Only the parameters that change the row set returned by `mongo_request`
+    are kept and code lists are normalized. The time window is cropped to
+    whole UTC days (see `crop_datetimes`), which is what MongoDB is queried
+    with anyway, so requests differing only in their sub-day start/end share
+    a cache entry.
+
+    Args:
+        params: Dictionary of query parameters.
+
+    Returns:
+        Dictionary that can be serialized deterministically.
+    """
+    start, end = crop_datetimes(params)
+    return {
+        "network": _normalize_codes(params["network"]),
+        "station": _normalize_codes(params["station"]),
+        "location": _normalize_codes(params["location"]),
+        "channel": _normalize_codes(params["channel"]),
+        "quality": _normalize_codes(params["quality"]),
+        "start": start.isoformat() if start else None,
+        "end": end.isoformat() if end else None,
+        "includerestricted": bool(params.get("includerestricted", False)),
+        "order": _sort_fields(params),
+        "fields": _optional_fields(params),
+    }
+
+
+def _cache_key(params: dict, kind: str = "rows") -> str:
+    """
+    Computes the Redis key of the row set of a single selection.
+
+    A content hash is used instead of the builtin `hash()`, which is salted
+    per process and therefore never matched across Gunicorn workers.
+
+    Args:
+        params: Dictionary of query parameters.
+        kind: "rows" for records, "table" for Arrow tables.
+
+    Returns:
+        Cache key string.
+    """
+    selection = json.dumps(_selection_key(params), sort_keys=True)
+    return f"{kind}:{hashlib.sha1(selection.encode('utf-8')).hexdigest()}"
+
+
+def _trim_to_window(data: list[list[Any]], params: dict) -> list[list[Any]]:
+    """
+    Drops rows lying entirely outside the requested time window.
+
+    Rows are fetched and cached for whole UTC days, so a row set may contain
+    segments ending before the requested start or beginning after the
+    requested end. Clamping of the remaining rows is done by `select_columns`.
+
+    Args:
+        data: List of data records.
+        params: Dictionary of query parameters.
+
+    Returns:
+        List of data records overlapping the requested window.
+    """
+    start, end = params["start"], params["end"]
+
+    if start is None and end is None:
+        return data
+
+    return [
+        row
+        for row in data
+        if (start is None or row[END] > start) and (end is None or row[START] < end)
+    ]
+
+
+def _iter_trim_to_window(data, params: dict):
+    """
+    Lazy version of `_trim_to_window`.
+
+    Args:
+        data: Iterable of data records.
+        params: Dictionary of query parameters.
+
+    Yields:
+        Data records overlapping the requested window.
+    """
+    start, end = params["start"], params["end"]
+    for row in data:
+        if (start is None or row[END] > start) and (end is None or row[START] < end):
+            yield row
+
+
+def collect_data(params: list[dict], lazy: bool = False) -> list[list[Any]] | None:
     """
     Orchestrates the data collection process with caching.
 
-    First checks Redis cache for the given parameters. If not found, executes
-    the MongoDB query, caches the result, and returns it.
+    Every selection (e.g. every line of a POST request) is cached on its own,
+    keyed by its normalized, day-aligned description, so reordered or
+    partially changed requests reuse the rows of known selections. All keys
+    are looked up in one round trip and only the missing selections are
+    queried from MongoDB. Selections without data are cached as well, but
+    only for `cache_negative_period` seconds. Rows outside the exact
+    requested window are dropped per line, lines sharing a key but not their
+    sub-day window each keeping their own rows, then the sorted partial
+    results are merged. The missing selections are estimated together
+    before any of them is read, see `_check_estimate`.
+
+    In lazy mode, missing selections are read from MongoDB only as far as
+    the caller consumes the records (see `mongo_stream`). They aren't cached,
+    since they may not be read entirely.
 
     Args:
         params: list of parameter dictionaries.
+        lazy: If True, an iterator is returned instead of a list.
 
     Returns:
-        List of data records or None.
+        List (or iterator) of data records or None.
     """
     rc = RedisClient(settings.cache_host, settings.cache_port)
 
-    CACHED_REQUEST_KEY = str(hash(str(params)))
+    (selections, windows) = _selections(params)
+    keys = list(selections)
+    rows = dict(zip(keys, rc.mget(keys)))
+
+    if lazy:
+        # Lines sharing a missing selection share its stream
+        streams = {
+            key: itertools.tee(mongo_stream(selections[key]), len(windows[key]))
+            for key in keys
+            if rows[key] is None
+        }
+        parts = [
+            _trim_to_window(rows[key], p)
+            if rows[key] is not None
+            else _iter_trim_to_window(streams[key][i], p)
+            for key in keys
+            for i, p in enumerate(windows[key])
+        ]
+        if len(parts) == 1:
+            return iter(parts[0])
+        return heapq.merge(*parts, key=_row_order(params[0]))
+
+    missing = [key for key in keys if rows[key] is None]
+    estimate = _check_estimate([selections[key] for key in missing]) if missing else None
+
+    fetched = {}
+    for key in missing:
+        qry, fetched[key] = mongo_request([selections[key]])
+        logging.debug(qry)
+    if fetched:
+        logging.debug(f"Collected {len(fetched)}/{len(keys)} selections from WFCatalog DB.")
+        if estimate is not None:
+            fetched_rows = sum(map(len, fetched.values()))
+            logging.info(f"Segments estimated: {estimate}, fetched: {fetched_rows}")
+        rc.set_many(
+            {k: v for k, v in fetched.items() if v}, settings.cache_resp_period
+        )
+        if settings.cache_negative_period > 0:
+            rc.set_many(
+                {k: v for k, v in fetched.items() if not v},
+                settings.cache_negative_period,
+            )
+        rows.update(fetched)
 
-    # Try to get cached response for given params
-    cached = rc.get(CACHED_REQUEST_KEY)
-    if cached:
-        return cached
+    parts = [_trim_to_window(rows[key], p) for key in keys for p in windows[key]]
+    if len(parts) == 1:
+        return parts[0]
+    return list(heapq.merge(*parts, key=_row_order(params[0])))
 
-    data = None
-    logging.debug("Start collecting data from WFCatalog DB...")
-    qry, data = mongo_request(params)
-    rc.set(CACHED_REQUEST_KEY, data, settings.cache_resp_period)
 
-    logging.debug(qry)
+def _selections(params: list[dict], kind: str = "rows") -> tuple[dict, dict]:
+    """
+    Groups the lines of a request by cache key.
 
-    return data
+    Keys are computed before `mongo_request`, which expands the wildcards in
+    place.
+
+    Args:
+        params: list of parameter dictionaries.
+        kind: Kind of cache key, see `_cache_key`.
+
+    Returns:
+        A tuple containing:
+        - selections (dict): The line fetched for each key.
+        - windows (dict): The lines of each key with distinct time windows,
+          identical lines are only kept once.
+    """
+    selections = {}
+    windows = {}
+    for p in params:
+        key = _cache_key(p, kind)
+        selections.setdefault(key, p)
+        lines = windows.setdefault(key, [])
+        if all((p["start"], p["end"]) != (q["start"], q["end"]) for q in lines):
+            lines.append(p)
+    return selections, windows
+
+
+def collect_table(params: list[dict]):
+    """
+    Collects the segments of a request as an Arrow table.
+
+    With `arrow_fetch` and pymongoarrow installed, segments are decoded by
+    pymongoarrow straight into columns, without a dict per document, to be
+    merged by `vectorized.fusion_table`. Tables are cached per selection like
+    the records of `collect_data`, under their own keys.
+
+    Selections of restricted streams, with PARTIAL segments when
+    restrictions are stamped, or showing the last update of compacted spans
+    cut by the time window, need per-segment processing: None is then
+    returned, as when the backend is disabled, and the caller falls back to
+    `collect_data`.
+
+    Args:
+        params: list of parameter dictionaries.
+
+    Returns:
+        Table of the segments, sorted as the records of `collect_data`, or None.
+    """
+    if pyarrow is None or not settings.arrow_fetch:
+        return None
+
+    rc = RedisClient(settings.cache_host, settings.cache_port)
+
+    (selections, windows) = _selections(params, "table")
+    keys = list(selections)
+    tables = dict(zip(keys, rc.mget(keys)))
+
+    missing = [key for key in keys if tables[key] is None]
+    estimate = _check_estimate([selections[key] for key in missing]) if missing else None
+
+    fetched = {}
+    for key in missing:
+        fetched[key] = _selection_table(selections[key], _sort_fields(params[0]))
+        if fetched[key] is None:
+            return None
+    if fetched:
+        logging.debug(f"Collected {len(fetched)}/{len(keys)} selections as columns.")
+        if estimate is not None:
+            fetched_rows = sum(table.num_rows for table in fetched.values())
+            logging.info(f"Segments estimated: {estimate}, fetched: {fetched_rows}")
+        rc.set_many(
+            {k: v for k, v in fetched.items() if v}, settings.cache_resp_period
+        )
+        if settings.cache_negative_period > 0:
+            rc.set_many(
+                {k: v for k, v in fetched.items() if not v},
+                settings.cache_negative_period,
+            )
+        tables.update(fetched)
+
+    parts = [_trim_table(tables[key], p) for key in keys for p in windows[key]]
+    if len(parts) == 1:
+        return parts[0]
+    return pyarrow.concat_tables(parts).sort_by(
+        [(field, "ascending") for field in _sort_fields(params[0])]
+    )
+
+
+def _selection_table(params: dict, fields: list[str]):
+    """
+    Queries the segments of a selection into an Arrow table.
+
+    Segments of unknown streams, or ending before they start, are dropped
+    as by `_apply_restricted_bit`.
+
+    Args:
+        params: Dictionary of query parameters, wildcards are expanded in place.
+        fields: Fields to sort the segments on, see `_sort_fields`.
+
+    Returns:
+        Table of segments, or None if restrictions or last updates must be
+        resolved per segment.
+    """
+    projection = _projection(params)
+    projection.pop("updates", None)
+    schema = Schema({field: ARROW_TYPES[field] for field in projection if field != "_id"})
+    qry = _selection_query(params)
+    if qry is None:
+        return schema.to_arrow().empty_table()
+    if not settings.restriction_stamped and _selects_restricted(params):
+        logging.debug("Selection of restricted streams, read as records.")
+        return None
+
+    db = get_db_client().get_database(settings.mongodb_name)
+
+    def read(qry):
+        if fields != SORT_FIELDS:
+            return aggregate_arrow_all(
+                db.availability,
+                [
+                    {"$match": qry},
+                    {"$sort": {field: 1 for field in fields}},
+                    {"$project": projection},
+                ],
+                schema=schema,
+                allowDiskUse=True,
+                **_time_limit("maxTimeMS"),
+            )
+        return find_arrow_all(
+            db.availability,
+            qry,
+            schema=schema,
+            projection=projection,
+            sort=[(field, 1) for field in fields],
+            **_time_limit(),
+        )
+
+    tables = _read_concurrently(read, _time_shards(qry, params))
+    if len(tables) == 1:
+        table = tables[0]
+    else:
+        table = pyarrow.concat_tables(tables).sort_by(
+            [(field, "ascending") for field in fields]
+        )
+
+    if "created" in projection and _cuts_spans(table, params):
+        logging.debug("Selection cutting compacted spans, read as records.")
+        return None
+
+    if settings.restriction_stamped:
+        if pc.any(pc.equal(table["restr"], "PARTIAL")).as_py():
+            logging.debug("Selection with partially restricted segments, read as records.")
+            return None
+        return table.filter(pc.less_equal(table["ts"], table["te"]))
+
+    sids = pc.binary_join_element_wise(
+        table["net"], table["sta"], table["loc"], table["cha"], "."
+    )
+    known = [
+        sid
+        for sid in pc.unique(sids).to_pylist()
+        if sid in RESTRICTED_INVENTORY._known_seedIDs
+    ]
+    return table.filter(
+        pc.and_(
+            pc.is_in(sids, value_set=pyarrow.array(known, pyarrow.string())),
+            pc.less_equal(table["ts"], table["te"]),
+        )
+    )
+
+
+def _cuts_spans(table, params: dict) -> bool:
+    """
+    Tells whether the time window covers only part of a compacted span, whose
+    last update then depends on the window, see `_window_updates`.
+
+    Args:
+        table: Table of segments.
+        params: Dictionary of query parameters.
+
+    Returns:
+        True if a segment longer than a day crosses the window.
+    """
+    start, end = crop_datetimes(params)
+    cuts = []
+    if start is not None:
+        cuts.append(pc.less(table["ts"], start))
+    if end is not None:
+        cuts.append(pc.greater(table["te"], end))
+    if not cuts:
+        return False
+    spans = pc.greater(pc.subtract(table["te"], table["ts"]), timedelta(days=1))
+    return any(pc.any(pc.and_(spans, cut)).as_py() for cut in cuts)
+
+
+def _selects_restricted(params: dict) -> bool:
+    """
+    Tells whether an expanded selection matches a restricted stream.
+
+    Args:
+        params: Dictionary of query parameters, see `_expand_wildcards`.
+
+    Returns:
+        True if a restricted seed ID matches the codes of the selection.
+    """
+    patterns = [
+        params[code].split(",") for code in ("network", "station", "location", "channel")
+    ]
+    patterns[2] = ["" if loc == "--" else loc for loc in patterns[2]]
+    return any(
+        all(
+            any(fnmatch(code, pattern) for pattern in codes)
+            for code, codes in zip(sid.split("."), patterns)
+        )
+        for sid in RESTRICTED_INVENTORY._restricted_seedIDs
+    )
+
+
+def _trim_table(table, params: dict):
+    """
+    Arrow version of `_trim_to_window`.
+
+    Args:
+        table: Table of segments.
+        params: Dictionary of query parameters.
+
+    Returns:
+        Table of the segments overlapping the requested window.
+    """
+    start, end = params["start"], params["end"]
+    if start is not None:
+        table = table.filter(pc.greater(table["te"], start))
+    if end is not None:
+        table = table.filter(pc.less(table["ts"], end))
+    return table
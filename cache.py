@@ -7,8 +7,9 @@ from obspy.core.inventory import Channel, Network
 from obspy.core.inventory.inventory import Inventory
 from requests import HTTPError
 
-from apps.restriction import Epoch, Restriction
+from apps.restriction import Epoch, Restriction, changed_seed_ids
 from apps.redis_client import RedisClient
+from apps.settings import settings
 from config import Config
 
 logging.basicConfig(
@@ -121,9 +122,24 @@ class Cache:
 
         # Store inventory in shared memcache instance
         rc = RedisClient(self._config.CACHE_HOST, self._config.CACHE_PORT)
+        previous = rc.get(self._config.CACHE_INVENTORY_KEY) or {}
         rc.set(self._config.CACHE_INVENTORY_KEY, self._inv)
         logger.info(f"Completed caching inventory from FDSNWS-Station")
 
+        if settings.restriction_stamped:
+            self.stamp_restrictions(changed_seed_ids(previous, self._inv))
+
+    def stamp_restrictions(self, seed_ids: set):
+        # Imported here, the view builder is only needed with RESTRICTION_STAMPED
+        from apps import view_builder
+
+        logger.info(f"Stamping restrictions of {len(seed_ids)} changed streams...")
+        streams = sorted(tuple(seed_id.split(".")) for seed_id in seed_ids)
+        view_builder.stamp_restrictions(
+            view_builder.get_db(), view_builder.load_inventory(), streams
+        )
+        logger.info(f"Completed stamping restrictions")
+
 
 if __name__ == "__main__":
     cache = Cache()
@@ -0,0 +1,44 @@
+"""
+Gunicorn configuration of the ws-availability API.
+
+Loaded by default by `gunicorn start:app` run from the repository root;
+command line options override it. See README.md "Gunicorn Configuration".
+"""
+import os
+
+from apps.globals import TIMEOUT
+from apps.settings import settings
+
+
+def default_workers() -> int:
+    """One worker per CPU available to the process, at most 8."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    return max(1, min(cpus, 8))
+
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:9001")
+
+# Processes for the CPU-bound merging and rendering, threads for the requests
+# waiting on MongoDB or Redis (REQUEST_THREADS, sharing the worker's pools).
+workers = int(os.environ.get("WEB_CONCURRENCY", default_workers()))
+worker_class = "gthread"
+threads = settings.request_threads
+timeout = TIMEOUT
+
+# Import the application once in the master, workers share its pages. The
+# connections are opened after the fork, in each worker (see `post_fork`).
+preload_app = True
+
+# Recycle workers to bound memory growth, at different times
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = max_requests // 10
+
+
+def post_fork(server, worker):
+    """Warms up each new worker before it accepts requests."""
+    from apps.warmup import warm_worker
+
+    warm_worker()
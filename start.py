@@ -5,7 +5,9 @@ import sentry_sdk
 from flask import Flask, make_response, render_template
 
 from apps.globals import VERSION
+from apps import jobs
 from apps.root import output
+from apps.settings import settings
 from config import Config
 
 
@@ -102,6 +104,25 @@ def query():
     return output()
 
 
+if settings.jobs:
+
+    @app.route("/jobs/extent", methods=["GET", "POST"])
+    def jobs_extent():
+        return jobs.submit()
+
+    @app.route("/jobs/query", methods=["GET", "POST"])
+    def jobs_query():
+        return jobs.submit()
+
+    @app.route("/jobs/<job_id>")
+    def jobs_status(job_id):
+        return jobs.status(job_id)
+
+    @app.route("/jobs/<job_id>/result")
+    def jobs_result(job_id):
+        return jobs.result(job_id)
+
+
 @app.route("/application.wadl")
 def wadl():
     template = render_template("wadl.xml")
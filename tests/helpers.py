@@ -0,0 +1,32 @@
+"""
+Shared helpers of the tests.
+"""
+
+from apps.globals import MAX_DATA_ROWS
+
+
+def make_params(**kwargs):
+    """
+    Parameters of a validated request, `/query?net=NL&sta=HGN&cha=BHZ` by
+    default (see `apps.models`), updated with `kwargs`.
+    """
+    params = {
+        "network": "NL",
+        "station": "HGN",
+        "location": "*",
+        "channel": "BHZ",
+        "quality": "*",
+        "start": None,
+        "end": None,
+        "merge": [],
+        "mergegaps": None,
+        "extent": False,
+        "showlastupdate": False,
+        "includerestricted": False,
+        "format": "text",
+        "nodata": "204",
+        "orderby": None,
+        "limit": MAX_DATA_ROWS,
+    }
+    params.update(kwargs)
+    return params
@@ -0,0 +1,111 @@
+"""
+Benchmark of the decoding of availability segments into records.
+
+Documents are encoded as MongoDB sends them (one BSON buffer per batch) for
+several projections, then decoded and converted into records the way the
+cursor and `_segment_row` do. No MongoDB is needed.
+
+With pymongoarrow installed, decoding into Arrow columns (`collect_table`)
+is measured as well, and the fusion of both for a daily segments request.
+
+Usage:
+    PYTHONPATH=. python tests/performance/bench_decode.py [documents]
+"""
+
+import sys
+import time
+from datetime import datetime, timedelta
+
+import bson
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+
+from apps import data_access_layer as dal
+from apps import vectorized
+from apps.wfcatalog_client import ARROW_TYPES, NO_UPDATE, SORT_FIELDS, pyarrow
+from apps.wfcatalog_client import _projection, _segment_row
+
+BATCH = 20000
+
+
+def make_documents(count: int, fields: list[str]) -> list[bytes]:
+    """BSON batches of daily segments with `fields`, in index order: streams
+    of 10 years of days, with a gap every 10 days"""
+    t0 = datetime(2000, 1, 1)
+    docs = []
+    for i in range(count):
+        (stream, day) = divmod(i, 3650)
+        ts = t0 + timedelta(days=day + day // 9)
+        doc = {
+            "net": "NL", "sta": f"S{stream // 3:03d}", "loc": "",
+            "cha": ("BHE", "BHN", "BHZ")[stream % 3], "qlt": "D", "srate": 40.0,
+            "ts": ts, "te": ts + timedelta(days=1), "created": ts + timedelta(days=2),
+            "count": 1, "restr": "OPEN",
+        }
+        docs.append(bson.encode({f: doc[f] for f in fields}))
+    return [b"".join(docs[i:i + BATCH]) for i in range(0, count, BATCH)]
+
+
+def bench(name: str, batches: list[bytes], codec_options: CodecOptions, count: int):
+    tic = time.perf_counter()
+    for batch in batches:
+        for doc in bson.decode_all(batch, codec_options):
+            _segment_row(doc)
+    elapsed = time.perf_counter() - tic
+    print(f"{name:<40} {elapsed * 1000000 / count:8.2f} s per million documents")
+
+
+def bench_arrow(name: str, batches: list[bytes], fields: list[str], count: int):
+    from pymongoarrow.api import Schema
+    from pymongoarrow.context import PyMongoArrowContext
+
+    schema = Schema({f: ARROW_TYPES[f] for f in fields})
+    tic = time.perf_counter()
+    tables = []
+    for batch in batches:
+        context = PyMongoArrowContext(schema)
+        context.process_bson_stream(batch)
+        tables.append(context.finish())
+    table = pyarrow.concat_tables(tables)
+    elapsed = time.perf_counter() - tic
+    print(f"{name:<40} {elapsed * 1000000 / count:8.2f} s per million documents")
+    return table
+
+
+def bench_fusion(batches: list[bytes], table, count: int):
+    params = {"extent": False, "mergegaps": None}
+    indexes = [0, 1, 2, 3, 4, 5]
+
+    tic = time.perf_counter()
+    rows = [_segment_row(doc) for batch in batches for doc in bson.decode_all(batch)]
+    dal.fusion(params, rows, indexes)
+    elapsed = time.perf_counter() - tic
+    print(f"{'records + fusion':<40} {elapsed * 1000000 / count:8.2f} s per million documents")
+
+    tic = time.perf_counter()
+    vectorized.fusion_table(params, table, indexes, dal._python_fusion, NO_UPDATE)
+    elapsed = time.perf_counter() - tic
+    print(f"{'fusion_table (after Arrow decoding)':<40} {elapsed * 1000000 / count:8.2f} s per million documents")
+
+
+def main(count: int = 1000000):
+    dicts = CodecOptions()
+    raw = CodecOptions(document_class=RawBSONDocument)
+    everything = SORT_FIELDS + ["created", "count", "restr"]
+    default = [f for f, v in _projection({}).items() if v]
+    extent = [f for f, v in _projection({"extent": True, "showlastupdate": True}).items() if v]
+
+    print(f"{count} documents")
+    bench("before: all fields", make_documents(count, everything), dicts, count)
+    bench("after: query", make_documents(count, default), dicts, count)
+    bench("after: extent&showlastupdate", make_documents(count, extent), dicts, count)
+    bench("RawBSONDocument: query", make_documents(count, default), raw, count)
+
+    if pyarrow is not None:
+        batches = make_documents(count, default)
+        table = bench_arrow("Arrow: query", batches, default, count)
+        bench_fusion(batches, table, count)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
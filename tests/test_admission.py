@@ -0,0 +1,123 @@
+"""
+Tests for the admission control of concurrent requests (`apps.admission`).
+
+The Redis scripts are replaced by mocks, their Lua isn't run.
+"""
+
+import unittest
+import sys
+import os
+from unittest.mock import MagicMock, patch
+
+# Ensure we can import modules from parent directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import redis
+from flask import Flask
+
+from apps import admission, root
+
+
+class AdmissionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.acquire = MagicMock(return_value=0)
+        self.release = MagicMock(return_value=0)
+        patchers = [
+            patch.object(admission, "SCRIPTS", (self.acquire, self.release)),
+            patch.object(admission.settings, "admission_max_requests", 8),
+            patch.object(admission.settings, "admission_max_per_client", 2),
+            patch.object(admission.settings, "admission_max_expensive", 3),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class TestAdmission(AdmissionTestCase):
+    def test_disabled_without_caps(self):
+        with patch.object(admission.settings, "admission_max_requests", 0):
+            with patch.object(admission.settings, "admission_max_per_client", 0):
+                with patch.object(admission.settings, "admission_max_expensive", 0):
+                    with admission.admission("10.0.0.1", True) as admitted:
+                        self.assertTrue(admitted)
+
+        self.acquire.assert_not_called()
+
+    def test_slots_of_a_cheap_request(self):
+        with admission.admission("10.0.0.1", False) as admitted:
+            self.assertTrue(admitted)
+            self.release.assert_not_called()
+
+        (keys, args) = (self.acquire.call_args[1]["keys"], self.acquire.call_args[1]["args"])
+        self.assertEqual(keys, ["admission:all", "admission:client:10.0.0.1"])
+        self.assertEqual(args[3:], [8, 2])
+        self.assertGreater(args[1], args[0])
+        self.release.assert_called_once_with(keys=keys, args=[args[2]])
+
+    def test_expensive_lane(self):
+        with admission.admission("10.0.0.1", True):
+            pass
+
+        self.assertEqual(self.acquire.call_args[1]["keys"][-1], "admission:expensive")
+        self.assertEqual(self.acquire.call_args[1]["args"][-1], 3)
+
+    def test_full_lane_turns_down(self):
+        self.acquire.return_value = 2
+
+        with admission.admission("10.0.0.1", False) as admitted:
+            self.assertFalse(admitted)
+
+        self.release.assert_not_called()
+
+    def test_slots_are_released_on_error(self):
+        with self.assertRaises(ValueError):
+            with admission.admission("10.0.0.1", False):
+                raise ValueError()
+
+        self.release.assert_called_once()
+
+    def test_admitted_without_redis(self):
+        self.acquire.side_effect = redis.ConnectionError("down")
+
+        with admission.admission("10.0.0.1", True) as admitted:
+            self.assertTrue(admitted)
+
+        self.release.assert_not_called()
+
+    @patch("apps.admission.estimate_rows")
+    def test_expensive_requests_are_estimated(self, mock_estimate):
+        mock_estimate.return_value = admission.settings.admission_expensive_rows + 1
+        self.assertTrue(admission.is_expensive([{}]))
+
+        mock_estimate.return_value = 10
+        self.assertFalse(admission.is_expensive([{}]))
+
+        with patch.object(admission.settings, "admission_max_expensive", 0):
+            mock_estimate.reset_mock()
+            self.assertFalse(admission.is_expensive([{}]))
+            mock_estimate.assert_not_called()
+
+
+class TestTurnedDownResponse(AdmissionTestCase):
+    @patch("apps.root.get_output")
+    @patch("apps.admission.estimate_rows")
+    def test_503_with_retry_after(self, mock_estimate, mock_output):
+        mock_estimate.return_value = 10
+        self.acquire.return_value = 1
+        app = Flask(__name__)
+
+        with app.test_request_context(
+            "/query?net=NL", headers={"X-Forwarded-For": "192.0.2.7, 10.0.0.1"}
+        ):
+            with patch.object(admission.settings, "admission_retry_after", 30):
+                response = root.output()
+
+        mock_output.assert_not_called()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "30")
+        # The first address is set by the client, only the proxy's is used
+        self.assertIn("admission:client:10.0.0.1", self.acquire.call_args[1]["keys"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,232 @@
+"""
+Tests for fetching segments into Arrow columns (`collect_table`) and their
+fusion (`vectorized.fusion_table`).
+
+Skipped if pymongoarrow isn't installed. MongoDB is replaced by BSON batches
+decoded by pymongoarrow itself.
+"""
+
+import unittest
+import sys
+import os
+import random
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+# Ensure we can import modules from parent directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bson
+from bson.codec_options import CodecOptions
+from flask import Flask
+
+from apps import data_access_layer as dal
+from apps import vectorized, wfcatalog_client
+import helpers
+
+
+def make_segments(seed, streams=3, segments=100):
+    """Availability documents sorted as MongoDB returns them"""
+    rnd = random.Random(seed)
+    docs = []
+    for sta in ["HGN", "DBN", "WIT"][:streams]:
+        for loc in ("", "02"):
+            t = datetime(2023, 1, 1)
+            for _ in range(segments):
+                t += timedelta(seconds=rnd.choice([0, 0, 0.02, 600, 86400]))
+                te = t + timedelta(seconds=rnd.choice([0, 10, 3600, 86400]))
+                created = datetime(2023, 2, 1) + timedelta(minutes=rnd.randrange(1000))
+                docs.append({
+                    "net": "NL", "sta": sta, "loc": loc, "cha": "BHZ",
+                    "qlt": rnd.choice(["D", "M"]), "srate": rnd.choice([20.0, 40.0]),
+                    "ts": t, "te": te, "created": created, "restr": "OPEN",
+                })
+                t = max(t, te - timedelta(seconds=60))
+    docs.sort(key=lambda d: [d[f] for f in wfcatalog_client.SORT_FIELDS])
+    return docs
+
+
+def make_params(**kwargs):
+    defaults = {"station": "*", "showlastupdate": True}
+    return helpers.make_params(**{**defaults, **kwargs})
+
+
+@unittest.skipUnless(wfcatalog_client.pyarrow is not None, "pymongoarrow is not installed")
+class TestCollectTable(unittest.TestCase):
+    def setUp(self):
+        wfcatalog_client.DB_CLIENT = None
+        self.mongo_patcher = patch("apps.wfcatalog_client.MongoClient")
+        mock_mongo_cls = self.mongo_patcher.start()
+        self.mock_collection = (
+            mock_mongo_cls.return_value.get_database.return_value.availability
+        )
+        self.mock_collection.codec_options = CodecOptions()
+        self.segments = make_segments(1)
+        self.set_segments(self.segments)
+
+        self.rc_patcher = patch("apps.wfcatalog_client.RedisClient")
+        self.mock_rc = self.rc_patcher.start().return_value
+        self.mock_rc.mget.side_effect = lambda keys: [None] * len(keys)
+
+        self.ri_patcher = patch("apps.wfcatalog_client.RESTRICTED_INVENTORY")
+        self.mock_ri = self.ri_patcher.start()
+        sids = {f"NL.{d['sta']}.{d['loc']}.BHZ" for d in self.segments}
+        self.mock_ri._inv = {sid: [] for sid in sids}
+        self.mock_ri._known_seedIDs = sids
+        self.mock_ri._restricted_seedIDs = set()
+
+        self.settings_patcher = patch.object(wfcatalog_client.settings, "arrow_fetch", True)
+        self.settings_patcher.start()
+
+    def tearDown(self):
+        self.mongo_patcher.stop()
+        self.rc_patcher.stop()
+        self.ri_patcher.stop()
+        self.settings_patcher.stop()
+        wfcatalog_client.DB_CLIENT = None
+
+    def set_segments(self, segments):
+        def encode(docs, projection):
+            docs = [{f: d[f] for f in projection if f != "_id"} for d in docs]
+            return [b"".join(bson.encode(d) for d in docs)]
+
+        def find(qry, projection=None, sort=None):
+            return encode(segments, projection)
+
+        def aggregate(pipeline, allowDiskUse=False):
+            order = list(pipeline[1]["$sort"])
+            docs = sorted(segments, key=lambda d: [d[f] for f in order])
+            return encode(docs, pipeline[2]["$project"])
+
+        self.mock_collection.find_raw_batches.side_effect = find
+        self.mock_collection.aggregate_raw_batches.side_effect = aggregate
+
+    def segment_answer(self, params):
+        """Records of the projected segments merged by the Python fusion"""
+        projection = wfcatalog_client._projection(params)
+        rows = [
+            wfcatalog_client._segment_row({f: d[f] for f in projection if f in d})
+            for d in self.segments
+        ]
+        rows = wfcatalog_client._trim_to_window(rows, params)
+        return dal.fusion(params, rows, dal.get_indexes(params))
+
+    def assertSameAnswer(self, params):
+        indexes = dal.get_indexes(params)
+        table = wfcatalog_client.collect_table([dict(params)])
+        self.assertIsNotNone(table)
+        merged = vectorized.fusion_table(
+            params, table, indexes, dal._python_fusion, wfcatalog_client.NO_UPDATE
+        )
+        self.assertEqual(merged, self.segment_answer(params))
+
+    def test_same_answer_as_records(self):
+        for mergegaps in (None, 3600.0):
+            for extent in (False, True):
+                with self.subTest(mergegaps=mergegaps, extent=extent):
+                    self.assertSameAnswer(make_params(mergegaps=mergegaps, extent=extent))
+
+    def test_same_answer_with_merged_qualities(self):
+        params = make_params(merge=["quality", "samplerate"])
+        self.segments.sort(
+            key=lambda d: [d[f] for f in wfcatalog_client._sort_fields(params)]
+        )
+        self.assertSameAnswer(params)
+        self.mock_collection.find_raw_batches.assert_not_called()
+
+    def test_same_answer_within_window(self):
+        self.assertSameAnswer(
+            make_params(start=datetime(2023, 1, 3, 12), end=datetime(2023, 2, 1))
+        )
+
+    def test_created_is_only_fetched_when_needed(self):
+        table = wfcatalog_client.collect_table([make_params(showlastupdate=False)])
+
+        self.assertNotIn("created", table.column_names)
+
+    def test_windows_cutting_compacted_spans_fall_back(self):
+        span = dict(
+            self.segments[0], ts=datetime(2023, 1, 1), te=datetime(2023, 1, 4),
+            updates=[{"day": datetime(2023, 1, day), "created": datetime(2023, 2, day)} for day in (1, 2, 3)],
+        )
+        self.set_segments([span])
+
+        self.assertIsNone(
+            wfcatalog_client.collect_table([make_params(start=datetime(2023, 1, 2, 6))])
+        )
+        self.assertIsNotNone(wfcatalog_client.collect_table([make_params()]))
+        self.assertIsNotNone(
+            wfcatalog_client.collect_table(
+                [make_params(start=datetime(2023, 1, 2, 6), showlastupdate=False)]
+            )
+        )
+
+    def test_unknown_streams_are_dropped(self):
+        self.mock_ri._known_seedIDs = {"NL.HGN..BHZ"}
+
+        table = wfcatalog_client.collect_table([make_params()])
+
+        self.assertEqual(set(table["sta"].to_pylist()), {"HGN"})
+        self.assertEqual(set(table["loc"].to_pylist()), {""})
+
+    def test_restricted_streams_fall_back(self):
+        self.mock_ri._restricted_seedIDs = {"NL.DBN.02.BHZ"}
+
+        self.assertIsNone(wfcatalog_client.collect_table([make_params()]))
+        self.mock_collection.find_raw_batches.assert_not_called()
+        self.assertIsNotNone(wfcatalog_client.collect_table([make_params(station="HGN")]))
+
+    def test_selections_are_merged_in_order(self):
+        params = [make_params(station="WIT"), make_params(station="DBN")]
+
+        table = wfcatalog_client.collect_table(params)
+
+        self.assertEqual(table["sta"].to_pylist()[0], "DBN")
+        self.assertEqual(table["sta"].to_pylist()[-1], "WIT")
+
+    def test_disabled_by_default(self):
+        with patch.object(wfcatalog_client.settings, "arrow_fetch", False):
+            self.assertIsNone(wfcatalog_client.collect_table([make_params()]))
+
+
+@unittest.skipUnless(wfcatalog_client.pyarrow is not None, "pymongoarrow is not installed")
+class TestGetOutputTable(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app_context = self.app.test_request_context("/query?net=NL")
+        self.app_context.push()
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    @patch("apps.data_access_layer.collect_data")
+    @patch("apps.data_access_layer.collect_table")
+    def test_columns_are_merged_without_records(self, mock_table, mock_data):
+        params = make_params()
+        mock_table.return_value = wfcatalog_client.pyarrow.Table.from_pylist(
+            make_segments(2, streams=1, segments=3)
+        )
+
+        response = dal.get_output([params])
+
+        mock_data.assert_not_called()
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 7)
+        self.assertEqual(lines[1].split()[:4], ["NL", "HGN", "--", "BHZ"])
+
+    @patch("apps.data_access_layer.vectorized.fusion_table")
+    @patch("apps.data_access_layer.collect_table")
+    def test_too_many_segments_are_not_merged(self, mock_table, mock_fusion):
+        mock_table.return_value = wfcatalog_client.pyarrow.Table.from_pylist(
+            make_segments(2, streams=1, segments=3)
+        )
+
+        with patch("apps.data_access_layer.MAX_DATA_ROWS", 5):
+            response = dal.get_output([make_params()])
+
+        self.assertEqual(response.status_code, 413)
+        mock_fusion.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,212 @@
+"""
+Tests for the row-level cache used by `collect_data`.
+"""
+
+import unittest
+import sys
+import os
+from datetime import datetime
+from unittest.mock import patch
+
+# Ensure we can import modules from parent directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apps import wfcatalog_client
+from helpers import make_params
+
+
+def make_row(ts, te):
+    return ["NL", "HGN", "--", "BHZ", "D", 40.0, ts, te, ts, "OPEN", 1]
+
+
+class TestCacheKey(unittest.TestCase):
+    def test_sub_day_windows_share_key(self):
+        """Start/end within the same UTC days map to the same cache entry"""
+        p1 = make_params(start=datetime(2023, 1, 1, 6), end=datetime(2023, 1, 2, 6))
+        p2 = make_params(start=datetime(2023, 1, 1, 7), end=datetime(2023, 1, 2, 23))
+
+        self.assertEqual(
+            wfcatalog_client._cache_key(p1), wfcatalog_client._cache_key(p2)
+        )
+
+    def test_different_days_differ(self):
+        p1 = make_params(start=datetime(2023, 1, 1, 6))
+        p2 = make_params(start=datetime(2023, 1, 2, 6))
+
+        self.assertNotEqual(
+            wfcatalog_client._cache_key(p1), wfcatalog_client._cache_key(p2)
+        )
+
+    def test_output_options_are_ignored(self):
+        """Options applied after fetching do not split the cache"""
+        p1 = make_params(format="text")
+        p2 = make_params(format="json", mergegaps=60.0, limit=10)
+
+        self.assertEqual(
+            wfcatalog_client._cache_key(p1), wfcatalog_client._cache_key(p2)
+        )
+
+    def test_merge_order_is_part_of_key(self):
+        """Merged qualities/sample rates are ordered differently by MongoDB"""
+        p1 = make_params()
+        p2 = make_params(merge=["quality"])
+
+        self.assertNotEqual(
+            wfcatalog_client._cache_key(p1), wfcatalog_client._cache_key(p2)
+        )
+
+    def test_fetched_fields_are_part_of_key(self):
+        """Rows fetched without `created` can't be shown with their last update"""
+        p1 = make_params()
+        p2 = make_params(showlastupdate=True)
+
+        self.assertNotEqual(
+            wfcatalog_client._cache_key(p1), wfcatalog_client._cache_key(p2)
+        )
+
+    def test_code_lists_are_normalized(self):
+        p1 = make_params(network="NL,BE", channel="BHZ,BHN,BHZ")
+        p2 = make_params(network="BE,NL", channel="BHN,BHZ")
+
+        self.assertEqual(
+            wfcatalog_client._cache_key(p1), wfcatalog_client._cache_key(p2)
+        )
+
+    def test_includerestricted_is_part_of_key(self):
+        p1 = make_params(includerestricted=False)
+        p2 = make_params(includerestricted=True)
+
+        self.assertNotEqual(
+            wfcatalog_client._cache_key(p1), wfcatalog_client._cache_key(p2)
+        )
+
+
+class TestCollectData(unittest.TestCase):
+    def setUp(self):
+        self.day = [
+            make_row(datetime(2023, 1, 1, 0), datetime(2023, 1, 1, 3)),
+            make_row(datetime(2023, 1, 1, 5), datetime(2023, 1, 1, 9)),
+            make_row(datetime(2023, 1, 1, 20), datetime(2023, 1, 2, 0)),
+        ]
+        self.rc_patcher = patch("apps.wfcatalog_client.RedisClient")
+        self.mock_rc = self.rc_patcher.start().return_value
+        self.mongo_patcher = patch("apps.wfcatalog_client.mongo_request")
+        self.mock_mongo = self.mongo_patcher.start()
+
+    def tearDown(self):
+        self.rc_patcher.stop()
+        self.mongo_patcher.stop()
+
+    def test_rows_outside_window_are_dropped(self):
+        self.mock_rc.mget.return_value = [None]
+        self.mock_mongo.return_value = ([], self.day)
+
+        params = make_params(
+            start=datetime(2023, 1, 1, 6), end=datetime(2023, 1, 1, 12)
+        )
+        data = wfcatalog_client.collect_data([params])
+
+        self.assertEqual(data, [self.day[1]])
+        # The whole day is cached, not the trimmed rows
+        cached = self.mock_rc.set_many.call_args_list[0][0][0]
+        self.assertEqual(list(cached.values()), [self.day])
+
+    def test_cached_day_is_trimmed_per_request(self):
+        self.mock_rc.mget.return_value = [self.day]
+
+        params = make_params(start=datetime(2023, 1, 1, 21))
+        data = wfcatalog_client.collect_data([params])
+
+        self.mock_mongo.assert_not_called()
+        self.mock_rc.set_many.assert_not_called()
+        self.assertEqual(data, [self.day[2]])
+
+    def test_only_missing_selections_are_queried(self):
+        """Each POST line is cached on its own and merged in order"""
+        be = make_params(network="BE")
+        nl = make_params(network="NL")
+        be_rows = [["BE"] + make_row(datetime(2023, 1, 1), datetime(2023, 1, 2))[1:]]
+        self.mock_rc.mget.return_value = [None, self.day]
+        self.mock_mongo.return_value = ([], be_rows)
+
+        data = wfcatalog_client.collect_data([be, nl])
+
+        self.mock_mongo.assert_called_once_with([be])
+        cached = self.mock_rc.set_many.call_args_list[0][0][0]
+        self.assertEqual(list(cached), [wfcatalog_client._cache_key(be)])
+        self.assertEqual(data, be_rows + self.day)
+
+    def test_duplicate_selections_are_collected_once(self):
+        self.mock_rc.mget.return_value = [self.day]
+
+        data = wfcatalog_client.collect_data([make_params(), make_params()])
+
+        self.assertEqual(len(self.mock_rc.mget.call_args[0][0]), 1)
+        self.assertEqual(data, self.day)
+
+    def test_lines_of_the_same_day_keep_their_window(self):
+        """POST lines sharing a day but not their hours share one fetch"""
+        self.mock_rc.mget.return_value = [None]
+        self.mock_mongo.return_value = ([], self.day)
+        morning = make_params(start=datetime(2023, 1, 1), end=datetime(2023, 1, 1, 4))
+        evening = make_params(start=datetime(2023, 1, 1, 21), end=datetime(2023, 1, 1, 23))
+
+        data = wfcatalog_client.collect_data([morning, evening])
+
+        self.mock_mongo.assert_called_once_with([morning])
+        self.assertEqual(len(self.mock_rc.mget.call_args[0][0]), 1)
+        self.assertEqual(data, [self.day[0], self.day[2]])
+
+    @patch("apps.wfcatalog_client.mongo_stream")
+    def test_lazy_lines_of_the_same_day_share_a_stream(self, mock_stream):
+        self.mock_rc.mget.return_value = [None]
+        mock_stream.return_value = iter(self.day)
+        morning = make_params(start=datetime(2023, 1, 1), end=datetime(2023, 1, 1, 4))
+        evening = make_params(start=datetime(2023, 1, 1, 21), end=datetime(2023, 1, 1, 23))
+
+        data = wfcatalog_client.collect_data([morning, evening], lazy=True)
+
+        self.assertEqual(list(data), [self.day[0], self.day[2]])
+        mock_stream.assert_called_once_with(morning)
+
+    def test_empty_selection_is_cached_shortly(self):
+        """Selections without data get the negative cache period"""
+        self.mock_rc.mget.return_value = [None]
+        self.mock_mongo.return_value = ([], [])
+
+        with patch.object(wfcatalog_client.settings, "cache_negative_period", 30):
+            data = wfcatalog_client.collect_data([make_params()])
+
+        self.assertEqual(data, [])
+        (empty, period) = self.mock_rc.set_many.call_args_list[1][0]
+        self.assertEqual(list(empty.values()), [[]])
+        self.assertEqual(period, 30)
+
+    def test_cached_empty_selection_is_a_hit(self):
+        self.mock_rc.mget.return_value = [[]]
+
+        data = wfcatalog_client.collect_data([make_params()])
+
+        self.mock_mongo.assert_not_called()
+        self.assertEqual(data, [])
+
+
+    @patch("apps.wfcatalog_client.mongo_stream")
+    def test_lazy_selections_are_streamed_and_not_cached(self, mock_stream):
+        be = make_params(network="BE")
+        nl = make_params(network="NL")
+        be_rows = [["BE"] + make_row(datetime(2023, 1, 1), datetime(2023, 1, 2))[1:]]
+        self.mock_rc.mget.return_value = [None, self.day]
+        mock_stream.return_value = iter(be_rows)
+
+        data = wfcatalog_client.collect_data([be, nl], lazy=True)
+
+        self.assertNotIsInstance(data, list)
+        self.assertEqual(list(data), be_rows + self.day)
+        mock_stream.assert_called_once_with(be)
+        self.mock_mongo.assert_not_called()
+        self.mock_rc.set_many.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,207 @@
+"""
+Tests for answering requests from the day coverage in `availability_coverage`.
+
+Answers are compared with the fusion of the segments the coverage is built
+from.
+"""
+
+import unittest
+import sys
+import os
+from datetime import datetime
+from unittest.mock import patch
+
+# Ensure we can import modules from parent directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apps import coverage, wfcatalog_client
+from apps.data_access_layer import fusion
+import helpers
+
+SEGMENTS = [
+    # Gapless days, the first and last ones crossing the year boundary
+    (datetime(2022, 12, 30), datetime(2022, 12, 31, 12)),
+    (datetime(2022, 12, 31, 12), datetime(2023, 1, 3)),
+    # Gappy day, the gaps are shorter than a day
+    (datetime(2023, 1, 3, 0, 0, 0, 25000), datetime(2023, 1, 3, 6)),
+    (datetime(2023, 1, 3, 8), datetime(2023, 1, 3, 10)),
+    # Gap of more than a day
+    (datetime(2023, 1, 5, 1), datetime(2023, 1, 6)),
+    (datetime(2023, 1, 6), datetime(2023, 1, 6, 23)),
+    # Gap of more than two days
+    (datetime(2023, 1, 9, 23), datetime(2023, 1, 10)),
+]
+
+
+def make_segment(ts, te):
+    return {
+        "net": "NL", "sta": "HGN", "loc": "", "cha": "BHZ", "qlt": "D", "srate": 40.0,
+        "ts": ts, "te": te, "created": te.replace(microsecond=0), "count": 1, "restr": "OPEN",
+    }
+
+
+def make_docs(segments):
+    return [
+        dict(net="NL", sta="HGN", loc="", cha="BHZ", qlt="D", srate=40.0, year=year, **fields)
+        for year, fields in coverage.encode([make_segment(*s) for s in segments], 40.0).items()
+    ]
+
+
+def make_params(**kwargs):
+    defaults = {"channel": "*"}
+    return helpers.make_params(**{**defaults, **kwargs})
+
+
+def segment_answer(params, segments):
+    """What fusion makes of the segments, after the window trim of collect_data"""
+    rows = [
+        ["NL", "HGN", "--", "BHZ", "D", 40.0, ts, te, te.replace(microsecond=0), "OPEN", 1]
+        for ts, te in segments
+        if (params["start"] is None or te > params["start"])
+        and (params["end"] is None or ts < params["end"])
+    ]
+    return fusion(params, rows, [0, 1, 2, 3, 4, 5])
+
+
+def clip(params, rows):
+    """Window cropping of select_columns"""
+    return [
+        r[:6]
+        + [max(r[6], params["start"] or r[6]), min(r[7], params["end"] or r[7])]
+        + r[8:]
+        for r in rows
+    ]
+
+
+class TestEncoding(unittest.TestCase):
+    def test_year_documents(self):
+        docs = {d["year"]: d for d in make_docs(SEGMENTS)}
+
+        self.assertEqual(sorted(docs), [2022, 2023])
+        self.assertEqual(len(docs[2022]["days"]), 46)
+        self.assertEqual(docs[2022]["gappy"], [])
+        self.assertEqual([g[0] for g in docs[2023]["gappy"]], [3, 5, 6, 9])
+        (_, fraction, first, last, spans) = docs[2023]["gappy"][0]
+        self.assertEqual((first, last, spans), (25000, 10 * 3600 * 1000000, 2))
+        self.assertAlmostEqual(fraction, 8 / 24, places=3)
+
+    def test_decode(self):
+        docs = make_docs(SEGMENTS)
+        days = coverage.decode(docs[1])
+
+        self.assertEqual(len(days), 6)
+        self.assertEqual(days[0][:3], (datetime(2023, 1, 1), datetime(2023, 1, 2), 1))
+        self.assertEqual(days[-1][:2], (datetime(2023, 1, 9, 23), datetime(2023, 1, 10)))
+
+    def test_compacted_span_keeps_the_update_of_each_day(self):
+        span = dict(
+            make_segment(datetime(2023, 1, 1), datetime(2023, 1, 3)),
+            created=datetime(2023, 1, 5),
+            updates=[
+                {"day": datetime(2023, 1, 1), "created": datetime(2023, 1, 2)},
+                {"day": datetime(2023, 1, 2), "created": datetime(2023, 1, 5)},
+            ],
+        )
+        doc = dict(year=2023, **coverage.encode([span], 40.0)[2023])
+
+        days = coverage.decode(doc)
+        self.assertEqual([d[3] for d in days], [datetime(2023, 1, 2), datetime(2023, 1, 5)])
+
+    def test_full_days_are_merged(self):
+        items = coverage.spans(make_docs(SEGMENTS))
+
+        self.assertEqual(items[0][:2], [datetime(2022, 12, 30), datetime(2023, 1, 3)])
+        self.assertEqual(items[0][3], datetime(2023, 1, 3))
+
+
+class TestCollectCoverage(unittest.TestCase):
+    def setUp(self):
+        wfcatalog_client.DB_CLIENT = None
+        self.mongo_patcher = patch("apps.wfcatalog_client.MongoClient")
+        mock_mongo_cls = self.mongo_patcher.start()
+        self.mock_collection = (
+            mock_mongo_cls.return_value.get_database.return_value.availability_coverage
+        )
+        self.mock_collection.find.return_value = make_docs(SEGMENTS)
+
+        self.ri_patcher = patch("apps.wfcatalog_client.RESTRICTED_INVENTORY")
+        self.mock_ri = self.ri_patcher.start()
+        self.mock_ri._inv = {"NL.HGN..BHZ": []}
+        self.mock_ri._known_seedIDs = {"NL.HGN..BHZ"}
+        self.mock_ri._restricted_seedIDs = set()
+
+        self.settings_patcher = patch.object(
+            wfcatalog_client.settings, "coverage_collection", True
+        )
+        self.settings_patcher.start()
+
+    def tearDown(self):
+        self.mongo_patcher.stop()
+        self.ri_patcher.stop()
+        self.settings_patcher.stop()
+        wfcatalog_client.DB_CLIENT = None
+
+    def assertSameAnswer(self, params):
+        rows = wfcatalog_client.collect_coverage([params])
+        self.assertIsNotNone(rows)
+        if not params["extent"]:
+            rows = fusion(params, rows, [0, 1, 2, 3, 4, 5])
+        self.assertEqual(
+            clip(params, rows), clip(params, segment_answer(params, SEGMENTS))
+        )
+
+    def test_query_merging_day_gaps(self):
+        self.assertSameAnswer(make_params(mergegaps=86400.0))
+
+    def test_query_merging_two_day_gaps(self):
+        self.assertSameAnswer(make_params(mergegaps=2 * 86400.0))
+
+    def test_query_with_midnight_window(self):
+        self.assertSameAnswer(
+            make_params(
+                mergegaps=86400.0, start=datetime(2023, 1, 1), end=datetime(2023, 1, 6)
+            )
+        )
+        qry = self.mock_collection.find.call_args[0][0]
+        self.assertEqual(qry["year"], {"$gte": 2023, "$lte": 2023})
+
+    def test_extent(self):
+        self.assertSameAnswer(make_params(extent=True))
+
+    def test_extent_merging_day_gaps(self):
+        self.assertSameAnswer(make_params(extent=True, mergegaps=86400.0))
+
+    def test_extent_with_midnight_window(self):
+        self.assertSameAnswer(make_params(extent=True, start=datetime(2023, 1, 3)))
+
+    def test_fine_requests_fall_back(self):
+        self.assertIsNone(wfcatalog_client.collect_coverage([make_params()]))
+        self.assertIsNone(
+            wfcatalog_client.collect_coverage([make_params(mergegaps=3600.0)])
+        )
+        self.assertIsNone(
+            wfcatalog_client.collect_coverage(
+                [make_params(extent=True, start=datetime(2023, 1, 3, 6))]
+            )
+        )
+        self.assertIsNone(
+            wfcatalog_client.collect_coverage(
+                [make_params(extent=True, merge=["samplerate"])]
+            )
+        )
+        self.mock_collection.find.assert_not_called()
+
+    def test_restricted_stream_falls_back(self):
+        self.mock_ri._restricted_seedIDs = {"NL.HGN..BHZ"}
+
+        self.assertIsNone(wfcatalog_client.collect_coverage([make_params(extent=True)]))
+
+    def test_disabled_by_default(self):
+        with patch.object(wfcatalog_client.settings, "coverage_collection", False):
+            self.assertIsNone(
+                wfcatalog_client.collect_coverage([make_params(extent=True)])
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
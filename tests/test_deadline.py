@@ -0,0 +1,176 @@
+"""
+Tests for the request deadline (`apps.deadline`): MongoDB `maxTimeMS`,
+cooperative checks and the 408 response.
+"""
+
+import unittest
+import sys
+import os
+import time
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+# Ensure we can import modules from parent directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from pymongo.errors import ExecutionTimeout
+
+from apps import data_access_layer as dal
+from apps import deadline, root, wfcatalog_client
+import helpers
+
+
+def make_params(**kwargs):
+    defaults = {
+        "quality": "D",
+        "start": datetime(2020, 1, 1),
+        "end": datetime(2023, 1, 1),
+    }
+    return helpers.make_params(**{**defaults, **kwargs})
+
+
+def make_rows(count):
+    t0 = datetime(2020, 1, 1)
+    return [
+        ["NL", "HGN", "--", "BHZ", "D", 40.0, t0 + timedelta(days=2 * i),
+         t0 + timedelta(days=2 * i + 1), t0, "OPEN", 1]
+        for i in range(count)
+    ]
+
+
+class TestDeadline(unittest.TestCase):
+    def test_no_deadline(self):
+        data = [1, 2, 3]
+        self.assertIsNone(deadline.remaining())
+        self.assertIsNone(deadline.max_time_ms())
+        self.assertIs(deadline.checked(data), data)
+        deadline.check()
+
+    def test_time_left(self):
+        with deadline.deadline(10):
+            self.assertEqual(deadline.timeout(), 10)
+            self.assertGreater(deadline.max_time_ms(), 9000)
+            self.assertLessEqual(deadline.max_time_ms(), 10000)
+        self.assertIsNone(deadline.timeout())
+
+    def test_expired(self):
+        with deadline.deadline(0.001):
+            time.sleep(0.01)
+            self.assertRaises(deadline.DeadlineExceeded, deadline.check)
+            self.assertRaises(deadline.DeadlineExceeded, deadline.max_time_ms)
+            rows = deadline.checked(range(3 * deadline.CHECK_EVERY))
+            self.assertRaises(deadline.DeadlineExceeded, list, rows)
+
+    def test_zero_is_no_deadline(self):
+        with deadline.deadline(0):
+            self.assertIsNone(deadline.remaining())
+
+
+class TestMaxTimeMS(unittest.TestCase):
+    def setUp(self):
+        wfcatalog_client.DB_CLIENT = None
+        wfcatalog_client.SHARD_EXECUTOR = None
+        self.mongo_patcher = patch("apps.wfcatalog_client.MongoClient")
+        self.mock_collection = (
+            self.mongo_patcher.start().return_value.get_database.return_value.availability
+        )
+        self.mock_collection.find.return_value = []
+        self.mock_collection.aggregate.return_value = []
+
+        self.ri_patcher = patch("apps.wfcatalog_client.RESTRICTED_INVENTORY")
+        self.mock_ri = self.ri_patcher.start()
+        self.mock_ri._inv = {"NL.HGN..BHZ": []}
+        self.mock_ri._known_seedIDs = {"NL.HGN..BHZ"}
+        self.mock_ri._restricted_seedIDs = set()
+
+    def tearDown(self):
+        self.mongo_patcher.stop()
+        self.ri_patcher.stop()
+        if wfcatalog_client.SHARD_EXECUTOR is not None:
+            wfcatalog_client.SHARD_EXECUTOR.shutdown()
+        wfcatalog_client.SHARD_EXECUTOR = None
+        wfcatalog_client.DB_CLIENT = None
+
+    def test_queries_get_the_time_left(self):
+        with deadline.deadline(30):
+            wfcatalog_client.mongo_request([make_params()])
+            wfcatalog_client.mongo_request([make_params(merge=["quality"])])
+
+        self.assertGreater(self.mock_collection.find.call_args[1]["max_time_ms"], 29000)
+        self.assertGreater(self.mock_collection.aggregate.call_args[1]["maxTimeMS"], 29000)
+
+    def test_no_limit_without_deadline(self):
+        wfcatalog_client.mongo_request([make_params()])
+
+        self.assertNotIn("max_time_ms", self.mock_collection.find.call_args[1])
+
+    def test_time_shards_get_the_deadline(self):
+        with patch.object(wfcatalog_client.settings, "query_shard_workers", 2):
+            with deadline.deadline(30):
+                wfcatalog_client.mongo_request([make_params()])
+
+        self.assertEqual(self.mock_collection.find.call_count, 4)
+        for call in self.mock_collection.find.call_args_list:
+            self.assertIn("max_time_ms", call[1])
+
+
+class TestTimeoutResponse(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app_context = self.app.test_request_context("/query?net=NL")
+        self.app_context.push()
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    @patch("apps.data_access_layer.collect_data")
+    def test_mongodb_timeout_is_408(self, mock_collect):
+        mock_collect.side_effect = ExecutionTimeout("operation exceeded time limit")
+
+        with deadline.deadline(60):
+            response = dal.get_output([make_params()])
+
+        self.assertEqual(response.status_code, 408)
+        self.assertIn("timeout (60 seconds)", response.get_data(as_text=True))
+
+    @patch("apps.data_access_layer.collect_data")
+    def test_fusion_stops_at_deadline(self, mock_collect):
+        mock_collect.return_value = make_rows(100)
+
+        with patch.object(dal.settings, "fusion_engine", "python"):
+            with deadline.deadline(0.001):
+                time.sleep(0.01)
+                response = dal.get_output([make_params()])
+
+        self.assertEqual(response.status_code, 408)
+
+    @patch("apps.data_access_layer.collect_data")
+    def test_within_deadline(self, mock_collect):
+        mock_collect.return_value = make_rows(100)
+
+        with deadline.deadline(60):
+            response = dal.get_output([make_params()])
+
+        self.assertEqual(response.status_code, 200)
+
+
+class TestEndpointTimeout(unittest.TestCase):
+    def request_timeout(self, path):
+        app = Flask(__name__)
+        timeouts = []
+        with app.test_request_context(path):
+            with patch("apps.root.get_output") as mock_output:
+                mock_output.side_effect = lambda params: timeouts.append(deadline.timeout()) or "ok"
+                with patch.object(root.settings, "query_timeout", 120):
+                    with patch.object(root.settings, "extent_timeout", 30):
+                        self.assertEqual(root.output(), "ok")
+        return timeouts[0]
+
+    def test_timeout_per_endpoint(self):
+        self.assertEqual(self.request_timeout("/query?net=NL"), 120)
+        self.assertEqual(self.request_timeout("/extent?net=NL"), 30)
+
+
+if __name__ == "__main__":
+    unittest.main()
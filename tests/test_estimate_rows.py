@@ -0,0 +1,154 @@
+"""
+Tests for the pre-flight estimate of the segments of a request
+(`estimate_rows`) and the rejection of oversized requests.
+"""
+
+import unittest
+import sys
+import os
+from datetime import date, datetime, timedelta
+from unittest.mock import patch
+
+# Ensure we can import modules from parent directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from apps import data_access_layer as dal
+from apps import wfcatalog_client
+from apps.restriction import Epoch
+import helpers
+
+
+def make_params(**kwargs):
+    defaults = {
+        "station": "*",
+        "start": datetime(2020, 1, 1),
+        "end": datetime(2020, 1, 10, 12),
+    }
+    return helpers.make_params(**{**defaults, **kwargs})
+
+
+def make_inventory():
+    epochs = {
+        ("HGN", ""): [(date(2010, 1, 1), date(2015, 1, 1)), (date(2015, 1, 1), None)],
+        ("DBN", "02"): [(date(2020, 1, 5), date(2020, 1, 8))],
+        ("WIT", ""): [(None, None)],
+    }
+    inventory = {}
+    for (sta, loc), periods in epochs.items():
+        for start, end in periods:
+            epoch = Epoch("NL", sta, loc, "BHZ", start, end)
+            inventory.setdefault(epoch.seed_id, []).append(epoch)
+    return inventory
+
+
+class TestEstimateRows(unittest.TestCase):
+    def setUp(self):
+        self.ri_patcher = patch("apps.wfcatalog_client.RESTRICTED_INVENTORY")
+        self.mock_ri = self.ri_patcher.start()
+        self.mock_ri._inv = make_inventory()
+        self.mock_ri._known_seedIDs = set(self.mock_ri._inv)
+        self.mock_ri._restricted_seedIDs = set()
+
+    def tearDown(self):
+        self.ri_patcher.stop()
+
+    def test_days_of_operation_within_window(self):
+        # HGN: 10 days, DBN: 3 days, WIT: 10 days (no start date)
+        self.assertEqual(wfcatalog_client.estimate_rows([make_params()]), 23)
+
+    def test_rows_per_day(self):
+        with patch.object(wfcatalog_client.settings, "estimate_rows_per_day", 2.5):
+            self.assertEqual(wfcatalog_client.estimate_rows([make_params(station="HGN")]), 25)
+
+    def test_open_window(self):
+        params = make_params(start=None, end=None, station="HGN,DBN")
+        days = (date.today() - date(2010, 1, 1)).days + 3
+
+        # Streams without a start date are left out
+        self.assertEqual(wfcatalog_client.estimate_rows([params]), days)
+
+    def test_selections_add_up(self):
+        params = [make_params(station="HGN"), make_params(station="HGN", location="--")]
+
+        self.assertEqual(wfcatalog_client.estimate_rows(params), 20)
+
+    @patch("apps.wfcatalog_client.RedisClient")
+    def test_request_is_rejected_before_fetching(self, mock_rc):
+        mock_rc.return_value.mget.return_value = [None]
+        with patch("apps.wfcatalog_client.get_db_client") as mock_client:
+            with patch.object(wfcatalog_client.settings, "max_estimated_rows", 20):
+                with self.assertRaises(wfcatalog_client.TooManyRows):
+                    wfcatalog_client.collect_data([make_params()])
+
+        mock_client.assert_not_called()
+
+    @patch("apps.wfcatalog_client.RedisClient")
+    def test_lines_are_estimated_together(self, mock_rc):
+        # Each line (10 segments) is under the cap, the request (20) isn't
+        mock_rc.return_value.mget.return_value = [None, None]
+        params = [make_params(station="HGN"), make_params(station="WIT")]
+        with patch("apps.wfcatalog_client.get_db_client") as mock_client:
+            with patch.object(wfcatalog_client.settings, "max_estimated_rows", 15):
+                with self.assertRaises(wfcatalog_client.TooManyRows):
+                    wfcatalog_client.collect_data(params)
+
+        mock_client.assert_not_called()
+
+    @patch("apps.wfcatalog_client.RedisClient")
+    def test_cached_lines_are_not_estimated(self, mock_rc):
+        mock_rc.return_value.mget.return_value = [[], None]
+        params = [make_params(station="HGN"), make_params(station="WIT")]
+        with patch("apps.wfcatalog_client.mongo_request", return_value=([], [])):
+            with patch.object(wfcatalog_client.settings, "max_estimated_rows", 15):
+                self.assertEqual(wfcatalog_client.collect_data(params), [])
+
+    @patch("apps.wfcatalog_client.RedisClient")
+    def test_estimate_and_actual_are_logged(self, mock_rc):
+        mock_rc.return_value.mget.return_value = [None]
+        with patch("apps.wfcatalog_client.get_db_client") as mock_client:
+            collection = mock_client.return_value.get_database.return_value.availability
+            collection.find.return_value = [
+                {"net": "NL", "sta": "HGN", "loc": "", "cha": "BHZ", "qlt": "D", "srate": 40.0,
+                 "ts": datetime(2020, 1, 1) + timedelta(days=d),
+                 "te": datetime(2020, 1, 2) + timedelta(days=d)}
+                for d in range(9)
+            ]
+            with patch.object(wfcatalog_client.settings, "max_estimated_rows", 100):
+                with self.assertLogs(level="INFO") as logs:
+                    data = wfcatalog_client.collect_data([make_params(station="HGN")])
+
+        self.assertEqual(len(data), 9)
+        self.assertIn("Segments estimated: 10, fetched: 9", "\n".join(logs.output))
+
+    def test_jobs_use_their_own_limit(self):
+        with patch.object(wfcatalog_client.settings, "max_estimated_rows", 20):
+            self.assertIsNone(wfcatalog_client._check_estimate([make_params(max_rows=0)]))
+            self.assertEqual(wfcatalog_client._check_estimate([make_params(max_rows=100)]), 23)
+
+    def test_disabled_by_default(self):
+        with patch("apps.wfcatalog_client.estimate_rows") as mock_estimate:
+            self.assertIsNone(wfcatalog_client._check_estimate([make_params()]))
+        mock_estimate.assert_not_called()
+
+
+class TestGetOutputEstimate(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app_context = self.app.test_request_context("/query?net=NL")
+        self.app_context.push()
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    @patch("apps.data_access_layer.collect_data")
+    def test_oversized_request_is_413(self, mock_collect):
+        mock_collect.side_effect = wfcatalog_client.TooManyRows("too large")
+        response = dal.get_output([make_params()])
+
+        self.assertEqual(response.status_code, 413)
+
+
+if __name__ == "__main__":
+    unittest.main()
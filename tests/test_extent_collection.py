@@ -0,0 +1,107 @@
+"""
+Tests for answering /extent from the precomputed `availability_extent` collection.
+"""
+
+import unittest
+import sys
+import os
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+# Ensure we can import modules from parent directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apps import wfcatalog_client
+import helpers
+
+
+def make_params(**kwargs):
+    defaults = {"channel": "*"}
+    return helpers.make_params(**{**defaults, **kwargs})
+
+
+def make_extent(cha="BHZ", earliest=datetime(2020, 1, 1), latest=datetime(2021, 1, 1)):
+    return {
+        "net": "NL", "sta": "HGN", "loc": "", "cha": cha, "qlt": "D", "srate": 40.0,
+        "earliest": earliest, "latest": latest, "updated": latest,
+        "timespans": 3, "restr": "OPEN",
+    }
+
+
+class TestCollectExtents(unittest.TestCase):
+    def setUp(self):
+        wfcatalog_client.DB_CLIENT = None
+        self.mongo_patcher = patch("apps.wfcatalog_client.MongoClient")
+        mock_mongo_cls = self.mongo_patcher.start()
+        self.mock_collection = (
+            mock_mongo_cls.return_value.get_database.return_value.availability_extent
+        )
+
+        self.mock_ri = MagicMock()
+        self.mock_ri._inv = {"NL.HGN..BHZ": [], "NL.HGN..BHN": []}
+        self.mock_ri._known_seedIDs = {"NL.HGN..BHZ", "NL.HGN..BHN"}
+        self.mock_ri._restricted_seedIDs = set()
+        self.ri_patcher = patch("apps.wfcatalog_client.RESTRICTED_INVENTORY", self.mock_ri)
+        self.ri_patcher.start()
+
+        self.settings_patcher = patch.object(
+            wfcatalog_client.settings, "extent_collection", True
+        )
+        self.settings_patcher.start()
+
+    def tearDown(self):
+        self.mongo_patcher.stop()
+        self.ri_patcher.stop()
+        self.settings_patcher.stop()
+        wfcatalog_client.DB_CLIENT = None
+
+    def test_extents_are_returned_as_rows(self):
+        self.mock_collection.find.return_value = [make_extent("BHZ"), make_extent("BHN")]
+
+        rows = wfcatalog_client.collect_extents([make_params()])
+
+        self.assertEqual([r[3] for r in rows], ["BHN", "BHZ"])
+        self.assertEqual(rows[0][2], "--")
+        self.assertEqual(rows[0][10], 3)
+        qry = self.mock_collection.find.call_args[0][0]
+        self.assertEqual(qry["net"], {"$in": ["NL"]})
+
+    def test_disabled_by_default(self):
+        with patch.object(wfcatalog_client.settings, "extent_collection", False):
+            self.assertIsNone(wfcatalog_client.collect_extents([make_params()]))
+        self.mock_collection.find.assert_not_called()
+
+    def test_window_cutting_an_extent_falls_back(self):
+        self.mock_collection.find.return_value = [make_extent()]
+
+        params = make_params(start=datetime(2020, 6, 1))
+        self.assertIsNone(wfcatalog_client.collect_extents([params]))
+        qry = self.mock_collection.find.call_args[0][0]
+        self.assertEqual(qry["latest"], {"$gt": datetime(2020, 6, 1)})
+
+    def test_window_containing_the_extent(self):
+        self.mock_collection.find.return_value = [make_extent()]
+
+        params = make_params(start=datetime(2019, 1, 1), end=datetime(2022, 1, 1))
+        self.assertEqual(len(wfcatalog_client.collect_extents([params])), 1)
+
+    def test_restricted_stream_falls_back(self):
+        self.mock_ri._restricted_seedIDs = {"NL.HGN..BHZ"}
+        self.mock_collection.find.return_value = [make_extent()]
+
+        self.assertIsNone(wfcatalog_client.collect_extents([make_params()]))
+
+    def test_merge_falls_back(self):
+        params = make_params(merge=["quality"])
+        self.assertIsNone(wfcatalog_client.collect_extents([params]))
+
+    def test_parameters_are_not_expanded_in_place(self):
+        self.mock_collection.find.return_value = []
+        params = make_params(channel="BH?")
+
+        self.assertEqual(wfcatalog_client.collect_extents([params]), [])
+        self.assertEqual(params["channel"], "BH?")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,269 @@
+"""
+Tests for the asynchronous job API (`apps.jobs`).
+
+Redis is replaced by an in-memory store, results are written to a
+temporary directory.
+"""
+
+import unittest
+import sys
+import os
+import tempfile
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+# Ensure we can import modules from parent directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, make_response
+
+from apps import deadline, jobs
+
+
+class MemoryRedis:
+    def __init__(self):
+        self.store = {}
+        self.queues = {}
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def set(self, key, obj, expiration=0):
+        self.store[key] = obj
+
+    def push(self, key, obj):
+        self.queues.setdefault(key, []).insert(0, obj)
+
+    def move(self, source, destination, timeout=0):
+        queue = self.queues.get(source)
+        if not queue:
+            return None
+        obj = queue.pop()
+        self.push(destination, obj)
+        return obj
+
+    def remove(self, key, obj):
+        queue = self.queues.get(key, [])
+        if obj not in queue:
+            return 0
+        queue.remove(obj)
+        return 1
+
+    def items(self, key):
+        return list(self.queues.get(key, []))
+
+
+class JobsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.redis = MemoryRedis()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        patchers = [
+            patch("apps.jobs._redis", return_value=self.redis),
+            patch.object(jobs.settings, "jobs_dir", self.tmp.name),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.app = Flask(__name__)
+
+    def submit(self, path):
+        with self.app.test_request_context(path):
+            return jobs.submit()
+
+    def queued_job(self):
+        job_id = self.redis.queues[jobs.KEY_QUEUE][-1]
+        return self.redis.get(jobs.KEY_JOB + job_id)
+
+
+class TestSubmit(JobsTestCase):
+    def test_job_is_queued(self):
+        response = self.submit("/jobs/query?net=NL&start=2020-01-01&format=json")
+
+        self.assertEqual(response.status_code, 202)
+        info = response.get_json()
+        self.assertEqual(info["status"], "queued")
+        self.assertEqual(response.headers["Location"], f"http://localhost/jobs/{info['id']}")
+        self.assertNotIn("result_url", info)
+
+        job = self.queued_job()
+        self.assertEqual(job["id"], info["id"])
+        self.assertTrue(job["path"].startswith("/query?net=NL"))
+        self.assertEqual(job["params"][0]["network"], "NL")
+        self.assertEqual(job["params"][0]["start"], datetime(2020, 1, 1))
+        self.assertFalse(job["params"][0]["extent"])
+
+    def test_extent_job(self):
+        self.submit("/jobs/extent?net=NL")
+
+        self.assertTrue(self.queued_job()["params"][0]["extent"])
+
+    def test_invalid_request_is_not_queued(self):
+        response = self.submit("/jobs/query?net=NL&foo=bar")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn(jobs.KEY_QUEUE, self.redis.queues)
+
+
+class TestRunJob(JobsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.submit("/jobs/query?net=NL&format=geocsv")
+        self.job_id = self.queued_job()["id"]
+
+    def fetch(self, view, job_id=None):
+        with self.app.test_request_context(f"/jobs/{job_id or self.job_id}"):
+            response = view(job_id or self.job_id)
+            response.direct_passthrough = False
+            return response
+
+    @patch("apps.jobs.get_output")
+    def test_result_of_a_done_job(self, mock_output):
+        timeouts = []
+
+        def output(params):
+            timeouts.append(deadline.timeout())
+            response = make_response("net|sta\nNL|HGN\n", {"Content-Disposition": "attachment"})
+            response.headers["Content-type"] = "text/csv"
+            return response
+
+        mock_output.side_effect = output
+        with patch.object(jobs.settings, "jobs_timeout", 1800):
+            jobs.work(max_jobs=1)
+
+        self.assertEqual(timeouts, [1800])
+        info = self.fetch(jobs.status).get_json()
+        self.assertEqual(info["status"], "done")
+        self.assertEqual(info["code"], 200)
+        self.assertIn("result_url", info)
+
+        response = self.fetch(jobs.result)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_data(as_text=True), "net|sta\nNL|HGN\n")
+        self.assertEqual(response.headers["Content-Type"], "text/csv")
+        self.assertEqual(response.headers["Content-Disposition"], "attachment")
+
+    @patch("apps.jobs.get_output")
+    def test_error_response_is_kept(self, mock_output):
+        mock_output.side_effect = lambda params: make_response("Error 413", 413)
+
+        jobs.run_job(self.job_id)
+
+        self.assertEqual(self.fetch(jobs.result).status_code, 413)
+
+    @patch("apps.jobs.get_output")
+    def test_failed_job(self, mock_output):
+        mock_output.side_effect = RuntimeError("boom")
+
+        job = jobs.run_job(self.job_id)
+
+        self.assertEqual(job["status"], "failed")
+        self.assertEqual(self.fetch(jobs.result).status_code, 500)
+
+    @patch("apps.data_access_layer.collect_data")
+    def test_job_over_the_row_limit_returns_data(self, mock_data):
+        mock_data.return_value = [
+            ["NL", "HGN", "--", "BHZ", "D", 40.0, datetime(2023, 1, 2 * day),
+             datetime(2023, 1, 2 * day + 1), datetime(2023, 2, 1), "OPEN", 1]
+            for day in range(1, 6)
+        ]
+
+        with patch("apps.data_access_layer.MAX_DATA_ROWS", 3):
+            job = jobs.run_job(self.job_id)
+
+        self.assertEqual((job["status"], job["code"]), ("done", 200))
+        lines = self.fetch(jobs.result).get_data(as_text=True).splitlines()
+        self.assertEqual(len([line for line in lines if line.startswith("NL|")]), 5)
+
+    def test_job_params(self):
+        params = self.queued_job()["params"]
+        self.assertEqual(jobs.job_params(params)[0]["max_rows"], 0)
+        self.assertEqual(jobs.job_params(params)[0]["limit"], sys.maxsize)
+
+        params[0]["limit"] = 10
+        with patch.object(jobs.settings, "jobs_max_rows", 10_000_000):
+            self.assertEqual(jobs.job_params(params)[0]["max_rows"], 10_000_000)
+            self.assertEqual(jobs.job_params(params)[0]["limit"], 10)
+
+    def test_pending_job(self):
+        response = self.fetch(jobs.result)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertIn("queued", response.get_data(as_text=True))
+
+    def test_unknown_job(self):
+        self.assertEqual(self.fetch(jobs.status, "0" * 32).status_code, 404)
+        self.assertEqual(self.fetch(jobs.result, "../../etc/passwd").status_code, 404)
+
+    @patch("apps.jobs.get_output")
+    def test_finished_job_leaves_the_processing_list(self, mock_output):
+        mock_output.side_effect = RuntimeError("boom")
+
+        jobs.work(max_jobs=1)
+
+        self.assertEqual(self.redis.items(jobs.KEY_QUEUE), [])
+        self.assertEqual(self.redis.items(jobs.KEY_PROCESSING), [])
+
+    @patch("apps.jobs.clean_results")
+    @patch("apps.jobs.run_job")
+    def test_cleanup_runs_while_the_queue_is_busy(self, mock_run, mock_clean):
+        self.submit("/jobs/query?net=NL")
+
+        with patch.object(jobs, "CLEAN_INTERVAL", 0):
+            jobs.work(max_jobs=2)
+
+        self.assertEqual(mock_run.call_count, 2)
+        self.assertEqual(mock_clean.call_count, 2)
+
+
+class TestRecoverJobs(JobsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.submit("/jobs/query?net=NL")
+        self.job = self.queued_job()
+        self.redis.move(jobs.KEY_QUEUE, jobs.KEY_PROCESSING)
+
+    def start(self, seconds_ago):
+        started = datetime.utcnow() - timedelta(seconds=seconds_ago)
+        self.job.update(status="running", started=started.strftime(jobs.TIME_FORMAT))
+        jobs.save_job(self.job)
+
+    def test_lost_job_is_failed(self):
+        self.start(jobs.STALE_MARGIN + 120)
+
+        with patch.object(jobs.settings, "jobs_timeout", 60):
+            self.assertEqual(jobs.recover_jobs(), 1)
+
+        self.assertEqual(jobs.get_job(self.job["id"])["status"], "failed")
+        self.assertEqual(self.redis.items(jobs.KEY_PROCESSING), [])
+
+    def test_running_job_is_kept(self):
+        self.start(30)
+
+        with patch.object(jobs.settings, "jobs_timeout", 60):
+            self.assertEqual(jobs.recover_jobs(), 0)
+
+        self.assertEqual(jobs.get_job(self.job["id"])["status"], "running")
+        self.assertEqual(self.redis.items(jobs.KEY_PROCESSING), [self.job["id"]])
+
+    def test_finished_job_is_dropped(self):
+        self.job["status"] = "done"
+        jobs.save_job(self.job)
+
+        self.assertEqual(jobs.recover_jobs(), 0)
+        self.assertEqual(self.redis.items(jobs.KEY_PROCESSING), [])
+
+
+class TestCleanResults(JobsTestCase):
+    def test_expired_results_are_deleted(self):
+        for name in ("old", "new"):
+            with open(os.path.join(self.tmp.name, name), "w") as f:
+                f.write(name)
+        os.utime(os.path.join(self.tmp.name, "old"), (0, 0))
+
+        self.assertEqual(jobs.clean_results(), 1)
+        self.assertEqual(os.listdir(self.tmp.name), ["new"])
+
+
+if __name__ == "__main__":
+    unittest.main()
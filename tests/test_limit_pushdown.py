@@ -0,0 +1,155 @@
+"""
+Tests for reading only the rows needed by `limit` with the default order.
+"""
+
+import unittest
+import sys
+import os
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+# Ensure we can import modules from parent directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from apps import data_access_layer as dal
+from helpers import make_params
+
+
+def make_rows(days, consumed):
+    """Daily rows with a gap every other day, counting the rows read"""
+    t0 = datetime(2023, 1, 1)
+    for day in range(days):
+        consumed.append(day)
+        ts = t0 + timedelta(days=2 * day)
+        yield ["NL", "HGN", "--", "BHZ", "D", 40.0, ts, ts + timedelta(days=1), ts, "OPEN", 1]
+
+
+# Merged rows only come in the default order with these merged as well
+IN_ORDER = ["quality", "samplerate"]
+
+
+class TestIterFusion(unittest.TestCase):
+    def test_same_result_as_fusion(self):
+        params = make_params()
+        indexes = dal.get_indexes(params)
+
+        self.assertEqual(
+            list(dal.iter_fusion(params, make_rows(5, []), indexes)),
+            dal.fusion(params, list(make_rows(5, [])), indexes),
+        )
+
+    def test_rows_are_read_until_the_limit_is_complete(self):
+        consumed = []
+        params = make_params()
+        merged = dal.iter_fusion(params, make_rows(1000, consumed), dal.get_indexes(params))
+
+        first = [next(merged), next(merged)]
+
+        self.assertEqual(first[1][6], datetime(2023, 1, 3))
+        # The second merged row is known to be complete at the third row
+        self.assertEqual(len(consumed), 3)
+
+
+class TestGetOutputLimit(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app_context = self.app.test_request_context("/query?net=NL&limit=2")
+        self.app_context.push()
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    @patch("apps.data_access_layer.collect_data")
+    def test_limit_reads_lazily(self, mock_collect):
+        consumed = []
+        mock_collect.return_value = make_rows(1000, consumed)
+
+        response = dal.get_output([make_params(limit=2, merge=IN_ORDER)])
+
+        mock_collect.assert_called_once()
+        self.assertTrue(mock_collect.call_args[1]["lazy"])
+        self.assertEqual(len(response.get_data(as_text=True).splitlines()), 3)
+        self.assertEqual(len(consumed), 3)
+
+    @patch("apps.data_access_layer.collect_data")
+    def test_missing_orderby_is_the_default_order(self, mock_collect):
+        consumed = []
+        mock_collect.return_value = make_rows(1000, consumed)
+
+        response = dal.get_output([make_params(limit=2, merge=IN_ORDER, orderby=None)])
+
+        self.assertTrue(mock_collect.call_args[1]["lazy"])
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertIn("2023-01-03", lines[2])
+        self.assertEqual(len(consumed), 3)
+
+    @patch("apps.data_access_layer.collect_data")
+    def test_other_orders_read_everything(self, mock_collect):
+        consumed = []
+        mock_collect.return_value = list(make_rows(10, consumed))
+
+        response = dal.get_output([make_params(limit=2, orderby="latestupdate_desc")])
+
+        self.assertNotIn("lazy", mock_collect.call_args[1])
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 3)
+        # The limit applies to the requested order
+        self.assertIn("2023-01-19", lines[1])
+        self.assertIn("2023-01-17", lines[2])
+
+    def interleaved_qualities(self):
+        """Merged rows of one channel, D on days 1 and 3, M on day 2"""
+        return [
+            ["NL", "HGN", "--", "BHZ", qlt, 40.0, datetime(2023, 1, day),
+             datetime(2023, 1, day, 12), datetime(2023, 2, 1), "OPEN", 1]
+            for qlt, day in (("D", 1), ("D", 3), ("M", 2))
+        ]
+
+    @patch("apps.data_access_layer.collect_data")
+    def test_interleaved_qualities_are_sorted_on_time(self, mock_collect):
+        for limit in (dal.MAX_DATA_ROWS, 2):
+            mock_collect.return_value = self.interleaved_qualities()
+
+            response = dal.get_output([make_params(limit=limit)])
+
+            self.assertNotIn("lazy", mock_collect.call_args[1])
+            lines = response.get_data(as_text=True).splitlines()[1:]
+            self.assertEqual(
+                [(line.split()[4], line.split()[6][:10]) for line in lines],
+                [("D", "2023-01-01"), ("M", "2023-01-02"), ("D", "2023-01-03")][:limit],
+            )
+
+    @patch("apps.data_access_layer.collect_data")
+    def test_no_data(self, mock_collect):
+        mock_collect.return_value = iter([])
+
+        response = dal.get_output([make_params(limit=2, merge=IN_ORDER)])
+
+        self.assertEqual(response.status_code, 204)
+
+
+class TestTopRecords(unittest.TestCase):
+    def setUp(self):
+        self.rows = list(make_rows(20, []))
+        for i, row in enumerate(self.rows):
+            row[8] = datetime(2023, 3, 1) + timedelta(hours=(7 * i) % 20)
+            row[10] = i % 3
+
+    def test_same_as_sort_and_slice(self):
+        for orderby in ("latestupdate", "latestupdate_desc", "timespancount", "timespancount_desc"):
+            params = make_params(orderby=orderby, extent=True)
+            expected = list(self.rows)
+            dal.sort_records(params, expected)
+
+            self.assertEqual(dal.top_records(params, iter(self.rows), 5), expected[:5], orderby)
+
+    def test_fewer_rows_than_limit(self):
+        params = make_params(orderby="latestupdate")
+        self.assertEqual(len(dal.top_records(params, iter(self.rows), 50)), 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,6 @@
 from unittest import TestCase, mock
 from datetime import date
-from restriction import Restriction, RestrictionInventory, Epoch
+from restriction import Restriction, RestrictionInventory, Epoch, changed_seed_ids
 
 
 class TestInventoryLoad(TestCase):
@@ -103,3 +103,35 @@ class TestIsRestricted(TestCase):
             ).value
             == Restriction.PARTIAL.value,
         )
+
+
+class TestChangedSeedIDs(TestCase):
+    def make_inventory(self, restriction):
+        epoch = Epoch("NL", "HGN", "", "BHZ", date(2000, 1, 1), None)
+        epoch.restriction = restriction
+        return {"NL.HGN..BHZ": [epoch]}
+
+    def test_same_inventory(self):
+        self.assertEqual(
+            changed_seed_ids(
+                self.make_inventory(Restriction.OPEN), self.make_inventory(Restriction.OPEN)
+            ),
+            set(),
+        )
+
+    def test_changed_restriction(self):
+        self.assertEqual(
+            changed_seed_ids(
+                self.make_inventory(Restriction.OPEN),
+                self.make_inventory(Restriction.RESTRICTED),
+            ),
+            {"NL.HGN..BHZ"},
+        )
+
+    def test_added_and_removed(self):
+        self.assertEqual(
+            changed_seed_ids({}, self.make_inventory(Restriction.OPEN)), {"NL.HGN..BHZ"}
+        )
+        self.assertEqual(
+            changed_seed_ids(self.make_inventory(Restriction.OPEN), {}), {"NL.HGN..BHZ"}
+        )
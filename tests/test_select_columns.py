@@ -0,0 +1,71 @@
+"""
+Tests for the column selection and timestamp formatting of the output.
+"""
+
+import unittest
+import sys
+import os
+from datetime import datetime, timedelta
+
+# Ensure we can import modules from parent directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apps import data_access_layer as dal
+from apps.utils import TIMESTAMP_MEMO_SIZE, timestamp_formatter
+import helpers
+
+
+def make_params(**kwargs):
+    defaults = {"showlastupdate": True}
+    return helpers.make_params(**{**defaults, **kwargs})
+
+
+class TestTimestampFormatter(unittest.TestCase):
+    def test_same_as_isoformat(self):
+        format_time = timestamp_formatter()
+        format_seconds = timestamp_formatter("seconds")
+        for value in (datetime(2023, 1, 1), datetime(2023, 1, 1, 12, 30, 5, 25)):
+            self.assertEqual(format_time(value), value.isoformat(timespec="microseconds") + "Z")
+            self.assertEqual(format_seconds(value), value.isoformat(timespec="seconds") + "Z")
+
+    def test_repeated_values_are_formatted_once(self):
+        format_time = timestamp_formatter()
+        first = format_time(datetime(2023, 1, 2))
+        self.assertIs(format_time(datetime(2023, 1, 2)), first)
+
+    def test_memo_is_bounded(self):
+        format_time = timestamp_formatter()
+        for second in range(2 * TIMESTAMP_MEMO_SIZE):
+            format_time(datetime(2023, 1, 1) + timedelta(seconds=second))
+
+        self.assertEqual(format_time.cache_info().currsize, TIMESTAMP_MEMO_SIZE)
+
+
+class TestSelectColumns(unittest.TestCase):
+    def make_rows(self):
+        return [
+            ["NL", cha, "--", "BHZ", "D", 40.0, datetime(2023, 1, 1), datetime(2023, 1, 2, 6),
+             datetime(2023, 1, 3, 0, 0, 1, 500000), "OPEN", 1]
+            for cha in ("HGN", "DBN")
+        ]
+
+    def test_text_columns(self):
+        params = make_params()
+        rows = dal.select_columns(params, self.make_rows(), dal.get_indexes(params))
+
+        self.assertEqual(
+            rows[0],
+            ["NL", "HGN", "--", "BHZ", "D", "40.0", "2023-01-01T00:00:00.000000Z",
+             "2023-01-02T06:00:00.000000Z", "2023-01-03T00:00:01Z"],
+        )
+
+    def test_window_is_formatted(self):
+        params = make_params(format="json", showlastupdate=False, end=datetime(2023, 1, 2))
+        rows = dal.select_columns(params, self.make_rows(), dal.get_indexes(params))
+
+        self.assertEqual(rows[1][-2:], ["2023-01-01T00:00:00.000000Z", "2023-01-02T00:00:00.000000Z"])
+        self.assertEqual(rows[1][5], 40.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,161 @@
+"""
+Tests for the time shards of long windows (`_time_shards`) and their
+concurrent reading by `mongo_request`.
+"""
+
+import unittest
+import sys
+import os
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+# Ensure we can import modules from parent directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apps import wfcatalog_client
+import helpers
+
+
+def make_params(**kwargs):
+    defaults = {
+        "station": "HGN,DBN",
+        "quality": "D",
+        "start": datetime(2020, 3, 1, 12),
+        "end": datetime(2023, 6, 1),
+    }
+    return helpers.make_params(**{**defaults, **kwargs})
+
+
+def make_segments():
+    """Daily segments of two streams over five years, in index order"""
+    docs = []
+    for sta in ("DBN", "HGN"):
+        for day in range(0, 5 * 365, 3):
+            ts = datetime(2019, 1, 1) + timedelta(days=day)
+            docs.append({
+                "net": "NL", "sta": sta, "loc": "", "cha": "BHZ", "qlt": "D",
+                "srate": 40.0, "ts": ts, "te": ts + timedelta(days=2),
+            })
+    return docs
+
+
+def matches(doc, qry):
+    """Evaluates the station and time conditions of a query on a document"""
+    if "sta" in qry and doc["sta"] not in qry["sta"]["$in"]:
+        return False
+    for field in ("ts", "te"):
+        for op, value in qry.get(field, {}).items():
+            if op == "$gt" and not doc[field] > value:
+                return False
+            if op == "$gte" and not doc[field] >= value:
+                return False
+            if op == "$lt" and not doc[field] < value:
+                return False
+    return True
+
+
+class TestTimeShards(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(wfcatalog_client.settings, "query_shard_workers", 4)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_disabled_with_one_worker(self):
+        qry = {"ts": {"$lt": datetime(2023, 6, 2)}}
+        with patch.object(wfcatalog_client.settings, "query_shard_workers", 1):
+            self.assertEqual(wfcatalog_client._time_shards(qry, make_params()), [qry])
+
+    def test_window_without_start_is_not_split(self):
+        qry = {}
+        self.assertEqual(wfcatalog_client._time_shards(qry, make_params(start=None)), [qry])
+
+    def test_short_window_is_not_split(self):
+        qry = {"te": {"$gt": datetime(2023, 1, 1)}}
+        params = make_params(start=datetime(2023, 1, 1))
+        self.assertEqual(wfcatalog_client._time_shards(qry, params), [qry])
+
+    def test_shards_partition_start_times(self):
+        qry = {"te": {"$gt": datetime(2020, 3, 1)}, "ts": {"$lt": datetime(2023, 6, 2)}}
+
+        shards = wfcatalog_client._time_shards(qry, make_params())
+
+        self.assertEqual(len(shards), 4)
+        self.assertEqual(shards[0]["ts"], {"$lt": datetime(2021, 3, 1)})
+        self.assertEqual(shards[1]["ts"], {"$gte": datetime(2021, 3, 1), "$lt": datetime(2022, 3, 1)})
+        self.assertEqual(shards[-1]["ts"], {"$gte": datetime(2023, 3, 1), "$lt": datetime(2023, 6, 2)})
+        for shard in shards:
+            self.assertEqual(shard["te"], qry["te"])
+        self.assertNotIn("$gte", qry["ts"])
+
+    def test_open_window_ends_now(self):
+        params = make_params(start=datetime.utcnow() - timedelta(days=400), end=None)
+
+        shards = wfcatalog_client._time_shards({}, params)
+
+        self.assertEqual(len(shards), 2)
+        self.assertEqual(set(shards[-1]["ts"]), {"$gte"})
+
+
+class TestShardedRequest(unittest.TestCase):
+    def setUp(self):
+        wfcatalog_client.DB_CLIENT = None
+        wfcatalog_client.SHARD_EXECUTOR = None
+        self.mongo_patcher = patch("apps.wfcatalog_client.MongoClient")
+        self.mock_mongo_cls = self.mongo_patcher.start()
+        self.mock_collection = (
+            self.mock_mongo_cls.return_value.get_database.return_value.availability
+        )
+        segments = make_segments()
+        self.mock_collection.find.side_effect = lambda qry, **kwargs: [
+            dict(doc) for doc in segments if matches(doc, qry)
+        ]
+
+        self.ri_patcher = patch("apps.wfcatalog_client.RESTRICTED_INVENTORY")
+        self.mock_ri = self.ri_patcher.start()
+        sids = {"NL.HGN..BHZ", "NL.DBN..BHZ"}
+        self.mock_ri._inv = {sid: [] for sid in sids}
+        self.mock_ri._known_seedIDs = sids
+        self.mock_ri._restricted_seedIDs = set()
+
+    def tearDown(self):
+        self.mongo_patcher.stop()
+        self.ri_patcher.stop()
+        if wfcatalog_client.SHARD_EXECUTOR is not None:
+            wfcatalog_client.SHARD_EXECUTOR.shutdown()
+        wfcatalog_client.SHARD_EXECUTOR = None
+        wfcatalog_client.DB_CLIENT = None
+
+    def request(self, workers, params):
+        with patch.object(wfcatalog_client.settings, "query_shard_workers", workers):
+            return wfcatalog_client.mongo_request([dict(p) for p in params])
+
+    def test_same_records_as_single_query(self):
+        (_, expected) = self.request(1, [make_params()])
+        self.assertEqual(self.mock_collection.find.call_count, 1)
+        self.mock_collection.find.reset_mock()
+
+        (qries, data) = self.request(4, [make_params()])
+
+        self.assertEqual(self.mock_collection.find.call_count, 4)
+        self.assertEqual(len(qries), 4)
+        self.assertEqual(data, expected)
+        self.assertEqual(data, sorted(data, key=wfcatalog_client._row_order(make_params())))
+
+    def test_shards_of_several_selections_are_merged(self):
+        params = [make_params(station="HGN"), make_params(station="DBN", start=datetime(2021, 1, 1))]
+        (_, expected) = self.request(1, params)
+
+        (_, data) = self.request(3, params)
+
+        self.assertEqual(data, expected)
+        self.assertEqual(data[0][1], "DBN")
+
+    def test_pool_has_a_connection_per_worker(self):
+        with patch.object(wfcatalog_client.settings, "request_threads", 1):
+            self.request(3, [make_params()])
+
+        self.assertEqual(self.mock_mongo_cls.call_args[1]["maxPoolSize"], 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
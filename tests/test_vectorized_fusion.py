@@ -0,0 +1,102 @@
+"""
+Tests for the NumPy implementation of `fusion`.
+
+The merge parameter tests are run again with the NumPy engine, and both
+engines are compared on generated records.
+"""
+
+import unittest
+import sys
+import os
+import random
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+# Ensure we can import modules from parent directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import test_merge_parameter
+from apps import data_access_layer as dal
+from apps import vectorized
+
+
+def make_rows(seed, streams=4, segments=200):
+    """Records sorted as returned by MongoDB, with gaps, overlaps and
+    sample rate changes"""
+    rnd = random.Random(seed)
+    rows = []
+    for s in range(streams):
+        for qlt in ("D", "M"):
+            t = datetime(2023, 1, 1)
+            for _ in range(segments):
+                srate = rnd.choice([20.0, 20.0, 40.0])
+                t += timedelta(seconds=rnd.choice([-30, 0, 0, 0.02, 0.05, 1, 600, 86400]))
+                te = t + timedelta(seconds=rnd.choice([0, 10, 3600, 86400]))
+                created = datetime(2023, 2, 1) + timedelta(minutes=rnd.randrange(1000))
+                rows.append(["NL", f"S{s}", "--", "BHZ", qlt, srate, t, te, created, "OPEN", 1])
+                t = max(t, te - timedelta(seconds=60))
+    rows.sort(key=lambda r: r[:8])
+    return rows
+
+
+@unittest.skipUnless(vectorized.HAS_NUMPY, "NumPy is not installed")
+class TestMergeParameterVectorized(test_merge_parameter.TestMergeParameter):
+    """Merge parameter tests with the NumPy engine."""
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch.object(dal.settings, "fusion_engine", "numpy")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+@unittest.skipUnless(vectorized.HAS_NUMPY, "NumPy is not installed")
+class TestSameResult(unittest.TestCase):
+    def setUp(self):
+        self.params = {"extent": False, "mergegaps": None}
+
+    def assertSameFusion(self, params, data, indexes):
+        expected = list(dal.iter_fusion(params, [list(r) for r in data], indexes))
+        self.assertEqual(
+            vectorized.fusion(params, data, indexes, lambda *a: list(dal.iter_fusion(*a))),
+            expected,
+        )
+
+    def test_merge_options(self):
+        data = make_rows(1)
+        for merge in ([], ["quality"], ["samplerate"], ["quality", "samplerate"]):
+            for mergegaps in (None, 0.0, 1.0, 3600.0):
+                for extent in (False, True):
+                    params = dict(merge=merge, mergegaps=mergegaps, extent=extent)
+                    indexes = dal.get_indexes(params)
+                    # Rows are sorted by the merged key, as by `_sort_fields`
+                    rows = sorted(data, key=lambda r: [r[i] for i in indexes] + r[6:8])
+                    with self.subTest(merge=merge, mergegaps=mergegaps, extent=extent):
+                        self.assertSameFusion(params, rows, indexes)
+
+    def test_unsorted_groups_fall_back(self):
+        data = make_rows(2, streams=1, segments=20)
+        # Sorted by quality first within the merged key
+        self.assertSameFusion(
+            dict(self.params, merge=["quality"]), data, dal.get_indexes({"merge": ["quality"]})
+        )
+
+    def test_input_is_not_modified(self):
+        data = make_rows(3, streams=1, segments=20)
+        copy = [list(r) for r in data]
+        vectorized.fusion(self.params, data, [0, 1, 2, 3, 4, 5], dal.fusion)
+        self.assertEqual(data, copy)
+
+    def test_auto_engine_threshold(self):
+        data = make_rows(4)
+        self.assertGreater(len(data), dal.VECTORIZED_MIN_ROWS)
+        with patch("apps.data_access_layer.vectorized.fusion") as mock_fusion:
+            dal.fusion(self.params, data[:10], [0, 1, 2, 3, 4, 5])
+            mock_fusion.assert_not_called()
+            dal.fusion(self.params, data, [0, 1, 2, 3, 4, 5])
+            mock_fusion.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,229 @@
+"""
+Tests for the Python view builder.
+
+The integration tests run against a local MongoDB (MONGODB_HOST/MONGODB_PORT)
+in a throwaway database and are skipped if none is reachable.
+"""
+
+import unittest
+import sys
+import os
+from datetime import datetime
+from unittest.mock import MagicMock
+
+# Ensure we can import modules from parent directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+from apps import view_builder
+from apps.restriction import Restriction
+from apps.settings import settings
+
+TEST_DB = "test_view_builder"
+
+
+class TestPlanning(unittest.TestCase):
+    def test_split_range_covers_whole_days(self):
+        windows = view_builder.split_range(
+            datetime(2023, 1, 1, 6), datetime(2023, 1, 5, 12), 2
+        )
+        self.assertEqual(
+            windows,
+            [
+                (datetime(2023, 1, 1), datetime(2023, 1, 3)),
+                (datetime(2023, 1, 3), datetime(2023, 1, 5)),
+                (datetime(2023, 1, 5), datetime(2023, 1, 7)),
+            ],
+        )
+
+    def test_created_filter(self):
+        until = datetime(2023, 2, 1)
+        self.assertEqual(
+            view_builder.created_filter(None, until), {"created": {"$lte": until}}
+        )
+        since = datetime(2023, 1, 1)
+        self.assertEqual(
+            view_builder.created_filter(since, until)["created"],
+            {"$gt": since, "$lte": until},
+        )
+
+    def test_chunks_per_network_and_day_range(self):
+        db = MagicMock()
+        db.daily_streams.aggregate.return_value = [
+            {"_id": "BE", "first": datetime(2023, 1, 1), "last": datetime(2023, 1, 1)},
+            {"_id": "NL", "first": datetime(2023, 1, 1), "last": datetime(2023, 1, 15)},
+        ]
+        until = datetime(2023, 2, 1)
+
+        chunks = view_builder.plan_chunks(db, None, until, days=10, networks=["BE", "NL"])
+
+        self.assertEqual([c["net"] for c in chunks], ["BE", "NL", "NL"])
+        self.assertEqual(chunks[2]["ts"], {"$gte": datetime(2023, 1, 11), "$lt": datetime(2023, 1, 21)})
+        self.assertEqual(chunks[0]["created"], {"$lte": until})
+
+    def test_watermark_is_kept_when_a_chunk_fails(self):
+        db = MagicMock()
+        db.availability_meta.find_one.return_value = {"created": datetime(2023, 1, 1)}
+        db.daily_streams.find_one.return_value = {"created": datetime(2023, 2, 1)}
+        db.daily_streams.aggregate.side_effect = [
+            [{"_id": "NL", "first": datetime(2023, 1, 1), "last": datetime(2023, 1, 1)}],
+            Exception("boom"),
+        ]
+
+        view_builder.build(db, workers=1)
+
+        db.availability_meta.update_one.assert_not_called()
+
+
+class TestStampRestrictions(unittest.TestCase):
+    def setUp(self):
+        self.db = MagicMock()
+        self.inventory = MagicMock()
+        self.inventory.is_populated = True
+        self.inventory._inv = {"NL.HGN..BHZ": [], "NL.DBN..BHZ": []}
+        self.inventory._restricted_seedIDs = {"NL.DBN..BHZ"}
+        self.inventory.is_restricted.return_value = Restriction.RESTRICTED
+
+    def test_open_stream_is_stamped_in_bulk(self):
+        view_builder.stamp_restrictions(self.db, self.inventory, [("NL", "HGN", "", "BHZ")])
+
+        self.db.availability.find.assert_not_called()
+        (qry, update) = self.db.availability.update_many.call_args_list[0][0]
+        self.assertEqual(qry["cha"], "BHZ")
+        self.assertEqual(update, {"$set": {"restr": "OPEN"}})
+
+    def test_unknown_stream_is_never_returned(self):
+        view_builder.stamp_restrictions(self.db, self.inventory, [("XX", "HGN", "", "BHZ")])
+
+        (qry, update) = self.db.availability.update_many.call_args[0]
+        self.assertEqual(update, {"$set": {"restr": view_builder.UNKNOWN}})
+
+    def test_restricted_stream_is_stamped_per_segment(self):
+        self.db.availability.find.return_value = [
+            {"_id": 1, "ts": datetime(2023, 1, 1), "te": datetime(2023, 1, 2), "restr": "OPEN"},
+            {"_id": 2, "ts": datetime(2023, 1, 2), "te": datetime(2023, 1, 3), "restr": "RESTRICTED"},
+            {"_id": 3, "ts": datetime(2023, 1, 4), "te": datetime(2023, 1, 3), "restr": "OPEN"},
+        ]
+
+        view_builder.stamp_restrictions(self.db, self.inventory, [("NL", "DBN", "", "BHZ")])
+
+        updates = self.db.availability.bulk_write.call_args[0][0]
+        self.assertEqual(
+            [(u._filter["_id"], u._doc["$set"]["restr"]) for u in updates],
+            [(1, "RESTRICTED"), (3, view_builder.UNKNOWN)],
+        )
+
+    def test_empty_inventory_stamps_nothing(self):
+        self.inventory.is_populated = False
+
+        self.assertEqual(
+            view_builder.stamp_restrictions(self.db, self.inventory, [("NL", "HGN", "", "BHZ")]), 0
+        )
+        self.db.availability.update_many.assert_not_called()
+
+
+class TestSplitSpans(unittest.TestCase):
+    def setUp(self):
+        self.db = MagicMock()
+        self.db.daily_streams.find.return_value = [{"_id": 2}]
+
+    def test_spans_holding_processed_streams_are_materialized_again(self):
+        self.db.availability.find.return_value = [{"_id": "span", "sources": [1, 2, 3]}]
+
+        self.assertEqual(view_builder.split_spans(self.db, {"net": "NL"}), 1)
+
+        self.assertEqual(self.db.availability.find.call_args[0][0], {"sources": {"$in": [2]}})
+        self.db.availability.delete_many.assert_called_once_with({"_id": {"$in": ["span"]}})
+        pipelines = [c[0][0] for c in self.db.daily_streams.aggregate.call_args_list]
+        self.assertEqual(
+            [p[0]["$match"]["_id"] for p in pipelines], [{"$in": [1, 2, 3]}, {"$in": [1, 2, 3]}]
+        )
+
+    def test_nothing_to_split(self):
+        self.db.availability.find.return_value = []
+
+        self.assertEqual(view_builder.split_spans(self.db, {"net": "NL"}), 0)
+        self.db.availability.delete_many.assert_not_called()
+        self.db.daily_streams.aggregate.assert_not_called()
+
+
+class TestUpdateCoverage(unittest.TestCase):
+    def test_one_document_per_quality_sample_rate_and_year(self):
+        db = MagicMock()
+        segment = {"qlt": "D", "srate": 40.0, "created": datetime(2023, 1, 5)}
+        db.availability.find.return_value.sort.return_value = [
+            dict(segment, ts=datetime(2022, 12, 31), te=datetime(2023, 1, 2)),
+            dict(segment, srate=20.0, ts=datetime(2023, 1, 1), te=datetime(2023, 1, 2)),
+        ]
+
+        view_builder.update_coverage(db, ("NL", "HGN", "", "BHZ"))
+
+        keys = [c[0][0] for c in db.availability_coverage.replace_one.call_args_list]
+        self.assertEqual(
+            [(k["srate"], k["year"]) for k in keys], [(40.0, 2022), (40.0, 2023), (20.0, 2023)]
+        )
+        stale = db.availability_coverage.delete_many.call_args[0][0]
+        self.assertEqual(len(stale["$nor"]), 3)
+
+
+class TestBuildMongoDB(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.client = MongoClient(
+            settings.mongodb_host, settings.mongodb_port, serverSelectionTimeoutMS=500
+        )
+        try:
+            cls.client.admin.command("ping")
+        except PyMongoError:
+            raise unittest.SkipTest("No local MongoDB available")
+
+    def setUp(self):
+        self.client.drop_database(TEST_DB)
+        self.db = self.client.get_database(TEST_DB)
+
+    def tearDown(self):
+        self.client.drop_database(TEST_DB)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.client.close()
+
+    def add_day(self, _id, day, avail, created, segments=()):
+        self.db.daily_streams.insert_one({
+            "_id": _id, "net": "NL", "sta": "HGN", "loc": "", "cha": "BHZ", "qlt": "D",
+            "srate": [40.0], "ts": datetime(2023, 1, day), "te": datetime(2023, 1, day + 1),
+            "avail": avail, "created": created,
+        })
+        for ts, te in segments:
+            self.db.c_segments.insert_one({
+                "streamId": _id, "srate": 40.0, "ts": ts, "te": te,
+            })
+
+    def test_incremental_build(self):
+        self.add_day(1, 1, 100, datetime(2023, 1, 2))
+        self.add_day(2, 2, 50, datetime(2023, 1, 3), [
+            (datetime(2023, 1, 2, 0), datetime(2023, 1, 2, 6)),
+            (datetime(2023, 1, 2, 12), datetime(2023, 1, 3, 0)),
+        ])
+
+        self.assertEqual(view_builder.build(self.db, workers=2, days=1), 1)
+        self.assertEqual(self.db.availability.count_documents({}), 3)
+        self.assertEqual(view_builder.get_watermark(self.db), datetime(2023, 1, 3))
+        extent = self.db.availability_extent.find_one()
+        self.assertEqual(extent["timespans"], 2)
+
+        # Nothing new: nothing is processed
+        self.db.availability.delete_many({})
+        view_builder.build(self.db)
+        self.assertEqual(self.db.availability.count_documents({}), 0)
+
+        # A new day only processes that day
+        self.add_day(3, 3, 100, datetime(2023, 1, 4))
+        view_builder.build(self.db)
+        self.assertEqual([d["_id"] for d in self.db.availability.find()], [3])
+
+
+if __name__ == "__main__":
+    unittest.main()
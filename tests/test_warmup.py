@@ -0,0 +1,133 @@
+import json
+import os
+import runpy
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+# Ensure we can import modules from parent directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apps import warmup
+
+ACCESS_LOG = (
+    '127.0.0.1 - - [10/Oct/2023:13:55:36 +0000] '
+    '"GET /fdsnws/availability/1/query?net=NL&sta=HGN&start=2023-01-01T06:00:00 HTTP/1.1" '
+    '200 2326 "-" "curl/7.81.0"'
+)
+
+
+class TestParseLog(unittest.TestCase):
+    def test_access_log_line(self):
+        url, duration = warmup.parse_log_line(ACCESS_LOG)
+        self.assertEqual(
+            url, "/fdsnws/availability/1/query?net=NL&sta=HGN&start=2023-01-01T06:00:00"
+        )
+        self.assertIsNone(duration)
+
+    def test_jsonl_line(self):
+        line = json.dumps({"url": "/extent?net=NL", "duration": 2.5})
+        self.assertEqual(warmup.parse_log_line(line), ("/extent?net=NL", 2.5))
+
+    def test_unrelated_lines(self):
+        line = json.dumps({"request_id": "x", "title": "t", "body": "b"})
+        self.assertEqual(warmup.parse_log_line(line), (None, None))
+        self.assertEqual(warmup.parse_log_line("garbage"), (None, None))
+
+    def test_url_to_params(self):
+        params = warmup.url_to_params("/query?network=NL&sta=HGN&start=2023-01-01")
+        self.assertEqual(params["network"], "NL")
+        self.assertEqual(params["station"], "HGN")
+        self.assertEqual(params["start"], datetime(2023, 1, 1))
+        self.assertFalse(params["extent"])
+
+    def test_invalid_urls_are_skipped(self):
+        self.assertIsNone(warmup.url_to_params("/version"))
+        self.assertIsNone(warmup.url_to_params("/query?net=NL&foo=bar"))
+        self.assertIsNone(warmup.url_to_params("/query?net=NLXX"))
+
+
+class TestRankRequests(unittest.TestCase):
+    def test_canonical_requests_are_counted_together(self):
+        lines = [
+            json.dumps({"url": "/query?net=NL&start=2023-01-01T06:00:00"}),
+            json.dumps({"url": "/query?net=NL&start=2023-01-01T07:00:00&format=json"}),
+            json.dumps({"url": "/query?net=BE"}),
+        ]
+        ranked = warmup.rank_requests(lines, top=10)
+        self.assertEqual([p["network"] for p in ranked], ["NL", "BE"])
+
+    def test_rank_by_cost(self):
+        lines = [
+            json.dumps({"url": "/query?net=NL", "duration": 0.1}),
+            json.dumps({"url": "/query?net=NL", "duration": 0.1}),
+            json.dumps({"url": "/query?net=BE", "duration": 30.0}),
+        ]
+        ranked = warmup.rank_requests(lines, top=1, rank="cost")
+        self.assertEqual([p["network"] for p in ranked], ["BE"])
+
+
+class TestWarmCache(unittest.TestCase):
+    @patch("apps.warmup.collect_data")
+    def test_top_requests_are_replayed(self, mock_collect):
+        with tempfile.NamedTemporaryFile("w", suffix=".log", delete=False) as log:
+            log.write("\n".join([ACCESS_LOG, ACCESS_LOG, "/not/a/request"]))
+        try:
+            done = warmup.warm_cache(log.name, top=5, workers=2)
+        finally:
+            os.unlink(log.name)
+
+        self.assertEqual(done, 1)
+        mock_collect.assert_called_once()
+        self.assertEqual(mock_collect.call_args[0][0][0]["network"], "NL")
+
+
+class TestWarmWorker(unittest.TestCase):
+    def setUp(self):
+        patchers = [
+            patch("apps.warmup.RestrictionInventory"),
+            patch("apps.warmup.RedisClient"),
+            patch("apps.warmup.get_db_client"),
+            patch("apps.wfcatalog_client.RESTRICTED_INVENTORY", None),
+        ]
+        (self.mock_inventory, self.mock_redis, self.mock_db, _) = [p.start() for p in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+    def test_connections_are_opened(self):
+        timings = warmup.warm_worker()
+
+        self.assertEqual(list(timings), ["inventory", "redis", "mongodb"])
+        self.assertTrue(all(t is not None for t in timings.values()))
+        self.assertIs(warmup.wfcatalog_client.RESTRICTED_INVENTORY, self.mock_inventory.return_value)
+        self.mock_redis.return_value.ping.assert_called_once()
+        self.mock_db.return_value.admin.command.assert_called_once_with("ping")
+
+    def test_failed_step_does_not_stop_the_worker(self):
+        self.mock_db.return_value.admin.command.side_effect = ConnectionError("down")
+
+        with self.assertLogs(level="WARNING"):
+            timings = warmup.warm_worker()
+
+        self.assertIsNone(timings["mongodb"])
+        self.assertIsNotNone(timings["redis"])
+
+    def test_gunicorn_post_fork(self):
+        path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "gunicorn.conf.py")
+        config = runpy.run_path(path)
+
+        self.assertEqual(config["worker_class"], "gthread")
+        self.assertEqual(config["threads"], warmup.settings.request_threads)
+        self.assertGreaterEqual(config["workers"], 1)
+        self.assertTrue(config["preload_app"])
+        self.assertLess(config["max_requests_jitter"], config["max_requests"])
+
+        with patch("apps.warmup.warm_worker") as mock_warm:
+            config["post_fork"](MagicMock(), MagicMock())
+        mock_warm.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
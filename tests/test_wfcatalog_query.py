@@ -8,6 +8,7 @@ from datetime import timedelta
 # Ensure we can import modules from parent directory
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from apps import data_access_layer as dal
 from apps import wfcatalog_client
 from flask import Flask
 
@@ -130,5 +131,264 @@ class TestWFCatalogQuery(unittest.TestCase):
             self.assertEqual(len(results), 1)
             self.assertEqual(results[0][6], valid_segment["ts"]) # Index 6 is start time
 
+    def test_unknown_streams_skip_query(self):
+        """test that selections matching no inventory stream never reach MongoDB"""
+        self.mock_ri._inv = {"NL.HGN.02.BHZ": []}
+
+        params = [{
+            "network": "XX", "station": "*", "location": "*", "channel": "*", "quality": "*",
+            "start": None, "end": None
+        }]
+
+        queries, results = wfcatalog_client.mongo_request(params)
+
+        self.mock_collection.find.assert_not_called()
+        self.assertEqual(queries, [])
+        self.assertEqual(results, [])
+
+    def test_compacted_span_of_partial_stream_is_split(self):
+        """test that compacted spans are cut into days when restrictions change within them"""
+        self.mock_ri._restricted_seedIDs = ["NL.HGN.--.BHZ"]
+        self.mock_ri.is_restricted.return_value = None
+        span = {
+            "net": "NL", "sta": "HGN", "loc": "--", "cha": "BHZ", "qlt": "D", "srate": 100.0,
+            "ts": datetime(2023, 1, 1, 0, 0),
+            "te": datetime(2023, 1, 3, 12, 0),
+            "created": datetime(2023, 1, 4), "count": 3, "restr": "OPEN"
+        }
+
+        with patch('apps.wfcatalog_client._get_restricted_status',
+                   side_effect=lambda s: "PARTIAL" if s["te"] - s["ts"] > timedelta(days=1) else "OPEN"):
+            pieces = list(wfcatalog_client._split_compacted([span]))
+
+        self.assertEqual(
+            [(p["ts"], p["te"]) for p in pieces],
+            [
+                (datetime(2023, 1, 1), datetime(2023, 1, 2)),
+                (datetime(2023, 1, 2), datetime(2023, 1, 3)),
+                (datetime(2023, 1, 3), datetime(2023, 1, 3, 12)),
+            ]
+        )
+
+    def test_compacted_span_of_open_stream_is_kept(self):
+        span = {
+            "net": "NL", "sta": "HGN", "loc": "--", "cha": "BHZ",
+            "ts": datetime(2023, 1, 1), "te": datetime(2023, 3, 1)
+        }
+        self.assertEqual(list(wfcatalog_client._split_compacted([span])), [span])
+
+    def test_stamped_restrictions_are_filtered_in_query(self):
+        """test that stamped restrictions are filtered by MongoDB, not in Python"""
+        segment = {
+            "net": "NL", "sta": "HGN", "loc": "", "cha": "BHZ", "qlt": "D", "srate": 100.0,
+            "ts": datetime(2023, 1, 20), "te": datetime(2023, 1, 21),
+            "created": datetime(2023, 1, 22), "count": 1, "restr": "OPEN"
+        }
+        params = [{
+            "network": "NL", "station": "HGN", "location": "--", "channel": "BHZ", "quality": "D",
+            "start": None, "end": None
+        }]
+        self.mock_collection.find.return_value = [segment]
+
+        with patch('apps.wfcatalog_client._expand_wildcards', side_effect=lambda x: x), \
+                patch.object(wfcatalog_client.settings, "restriction_stamped", True), \
+                patch('apps.wfcatalog_client._get_restricted_status') as mock_status:
+            queries, results = wfcatalog_client.mongo_request(params)
+
+        self.assertEqual(queries[0]["restr"], {"$in": ["OPEN", "PARTIAL", None]})
+        mock_status.assert_not_called()
+        self.assertEqual(results[0][2], "--")
+        self.assertEqual(results[0][9], "OPEN")
+
+    def test_merge_is_sorted_by_mongodb(self):
+        """test that merge requests are grouped and sorted server-side on the reduced key"""
+        params = [{
+            "network": "NL", "station": "HGN", "location": "--", "channel": "BHZ", "quality": "*",
+            "start": None, "end": None, "merge": ["quality", "samplerate"]
+        }]
+        segments = [
+            {
+                "net": "NL", "sta": "HGN", "loc": "--", "cha": "BHZ", "qlt": qlt, "srate": 100.0,
+                "ts": datetime(2023, 1, day), "te": datetime(2023, 1, day + 1),
+                "created": datetime(2023, 2, 1), "count": 1, "restr": "OPEN"
+            }
+            for day, qlt in [(1, "M"), (2, "D"), (3, "M")]
+        ]
+        self.mock_collection.aggregate.return_value = segments
+
+        with patch('apps.wfcatalog_client._expand_wildcards', side_effect=lambda x: x):
+            queries, results = wfcatalog_client.mongo_request(params)
+
+        self.mock_collection.find.assert_not_called()
+        pipeline = self.mock_collection.aggregate.call_args[0][0]
+        self.assertEqual(
+            list(pipeline[1]["$sort"]), ["net", "sta", "loc", "cha", "ts", "te"]
+        )
+        # MongoDB order is kept, not re-sorted by quality
+        self.assertEqual([r[4] for r in results], ["M", "D", "M"])
+
+    def test_index_order_is_relied_on(self):
+        """test that segments are read in index order and selections merged without sorting"""
+        def segment(sta, day):
+            return {
+                "net": "NL", "sta": sta, "loc": "--", "cha": "BHZ", "qlt": "D", "srate": 100.0,
+                "ts": datetime(2023, 1, day), "te": datetime(2023, 1, day + 1),
+                "created": datetime(2023, 2, 1), "count": 1, "restr": "OPEN"
+            }
+        self.mock_ri._known_seedIDs = ["NL.HGN.--.BHZ", "NL.DBN.--.BHZ"]
+        self.mock_collection.find.side_effect = [
+            [segment("HGN", 1), segment("HGN", 2)],
+            [segment("DBN", 1), segment("DBN", 3)],
+        ]
+        params = [
+            {"network": "NL", "station": sta, "location": "--", "channel": "BHZ", "quality": "*",
+             "start": None, "end": None}
+            for sta in ("HGN", "DBN")
+        ]
+
+        with patch('apps.wfcatalog_client._expand_wildcards', side_effect=lambda x: x):
+            queries, results = wfcatalog_client.mongo_request(params)
+
+        self.assertEqual(
+            self.mock_collection.find.call_args[1]["sort"],
+            [("net", 1), ("sta", 1), ("loc", 1), ("cha", 1), ("qlt", 1), ("srate", 1), ("ts", 1), ("te", 1)]
+        )
+        # Not supported by find before MongoDB 4.4
+        self.assertNotIn("allow_disk_use", self.mock_collection.find.call_args[1])
+        self.assertEqual(
+            [(r[1], r[6].day) for r in results],
+            [("DBN", 1), ("DBN", 3), ("HGN", 1), ("HGN", 2)]
+        )
+
+    def test_stream_closes_cursor_when_stopped_early(self):
+        """test that lazily read selections release their cursor"""
+        segments = [
+            {
+                "net": "NL", "sta": "HGN", "loc": "--", "cha": "BHZ", "qlt": "D", "srate": 100.0,
+                "ts": datetime(2023, 1, day), "te": datetime(2023, 1, day + 1),
+                "created": datetime(2023, 2, 1), "count": 1, "restr": "OPEN"
+            }
+            for day in range(1, 10)
+        ]
+        cursor = MagicMock()
+        cursor.__iter__.return_value = iter(segments)
+        self.mock_collection.find.return_value = cursor
+        params = {
+            "network": "NL", "station": "HGN", "location": "--", "channel": "BHZ", "quality": "*",
+            "start": None, "end": None
+        }
+
+        with patch('apps.wfcatalog_client._expand_wildcards', side_effect=lambda x: x):
+            rows = wfcatalog_client.mongo_stream(params)
+            self.assertEqual(next(rows)[6], datetime(2023, 1, 1))
+            rows.close()
+
+        cursor.close.assert_called_once()
+
+    def test_codes_are_shared_between_rows(self):
+        """test that rows share their code strings instead of one copy per document"""
+        segments = [
+            {
+                "net": "".join(["N", "L"]), "sta": "".join(["HG", "N"]), "loc": "", "cha": "BHZ",
+                "qlt": "D", "srate": 100.0, "ts": datetime(2023, 1, day),
+                "te": datetime(2023, 1, day + 1), "created": datetime(2023, 2, 1), "count": 1,
+                "restr": "".join(["OP", "EN"])
+            }
+            for day in range(1, 3)
+        ]
+        self.assertIsNot(segments[0]["sta"], segments[1]["sta"])
+
+        rows = [wfcatalog_client._segment_row(s) for s in segments]
+
+        for i in (0, 1, 2, 3, 4, 9):
+            self.assertIs(rows[0][i], rows[1][i])
+
+    def test_projection_follows_request_needs(self):
+        """test that only the fields used by the request are fetched"""
+        segment = {
+            "net": "NL", "sta": "HGN", "loc": "--", "cha": "BHZ", "qlt": "D", "srate": 100.0,
+            "ts": datetime(2023, 1, 20), "te": datetime(2023, 1, 21)
+        }
+        self.mock_collection.find.return_value = [segment]
+        params = {
+            "network": "NL", "station": "HGN", "location": "--", "channel": "BHZ", "quality": "*",
+            "start": None, "end": None, "showlastupdate": False, "extent": False,
+            "orderby": "nslc_time_quality_samplerate"
+        }
+
+        with patch('apps.wfcatalog_client._expand_wildcards', side_effect=lambda x: x):
+            queries, results = wfcatalog_client.mongo_request([params])
+
+        kwargs = self.mock_collection.find.call_args[1]
+        self.assertNotIn("created", kwargs["projection"])
+        self.assertNotIn("count", kwargs["projection"])
+        self.assertNotIn("restr", kwargs["projection"])
+        self.assertEqual(kwargs["batch_size"], wfcatalog_client.BATCH_SIZE)
+        self.assertEqual(results[0][8:], [wfcatalog_client.NO_UPDATE, None, 1])
+
+        projection = wfcatalog_client._projection(dict(params, orderby="latestupdate_desc"))
+        self.assertIn("created", projection)
+        projection = wfcatalog_client._projection(dict(params, extent=True, showlastupdate=True))
+        self.assertIn("created", projection)
+        self.assertIn("restr", projection)
+
+class TestCompactedUpdates(unittest.TestCase):
+    """A compacted span reports the last update of the days in the window"""
+
+    def setUp(self):
+        self.params = {
+            "merge": [], "mergegaps": None, "extent": False, "showlastupdate": True,
+            "start": None, "end": None,
+        }
+        t0 = datetime(2023, 1, 1)
+        segment = {"net": "NL", "sta": "HGN", "loc": "--", "cha": "BHZ", "qlt": "D", "srate": 100.0}
+        self.daily = [
+            dict(segment, ts=t0, te=t0 + timedelta(days=1), created=datetime(2023, 1, 2)),
+            dict(segment, ts=t0 + timedelta(days=1), te=t0 + timedelta(days=2), created=datetime(2023, 1, 5)),
+        ]
+        self.span = [
+            dict(
+                segment, ts=t0, te=t0 + timedelta(days=2), created=datetime(2023, 1, 5),
+                updates=[
+                    {"day": t0, "created": datetime(2023, 1, 2)},
+                    {"day": t0 + timedelta(days=1), "created": datetime(2023, 1, 5)},
+                ],
+            )
+        ]
+
+    def merged(self, segments, **window):
+        params = dict(self.params, **window)
+        segments = wfcatalog_client._window_updates([dict(s) for s in segments], params)
+        rows = [wfcatalog_client._segment_row(s) for s in segments]
+        rows = wfcatalog_client._trim_to_window(rows, params)
+        return dal.fusion(params, rows, dal.get_indexes(params))
+
+    def test_same_update_for_whole_spans(self):
+        self.assertEqual(self.merged(self.daily), self.merged(self.span))
+        self.assertEqual(self.merged(self.span)[0][8], datetime(2023, 1, 5))
+
+    def test_window_within_a_span_reports_its_own_days(self):
+        for window, updated in [
+            ({"start": datetime(2023, 1, 1, 6), "end": datetime(2023, 1, 1, 12)}, datetime(2023, 1, 2)),
+            ({"start": None, "end": datetime(2023, 1, 1, 12)}, datetime(2023, 1, 2)),
+            ({"start": datetime(2023, 1, 2, 6), "end": None}, datetime(2023, 1, 5)),
+        ]:
+            with self.subTest(**window):
+                self.assertEqual(self.merged(self.daily, **window)[0][8], updated)
+                self.assertEqual(self.merged(self.span, **window)[0][8], updated)
+
+    def test_split_pieces_report_their_own_day(self):
+        with patch('apps.wfcatalog_client.RESTRICTED_INVENTORY') as mock_ri, \
+                patch('apps.wfcatalog_client._get_restricted_status', return_value="PARTIAL"):
+            mock_ri._restricted_seedIDs = ["NL.HGN.--.BHZ"]
+            pieces = list(wfcatalog_client._split_compacted(self.span))
+
+        self.assertEqual([p["created"] for p in pieces], [d["created"] for d in self.daily])
+
+    def test_updates_are_fetched_with_created(self):
+        self.assertIn("updates", wfcatalog_client._projection(self.params))
+        self.assertNotIn("updates", wfcatalog_client._projection(dict(self.params, showlastupdate=False)))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,19 +1,21 @@
 use("wfrepo");
 
 updateAvailabilityDaily = function (networks, stations, startDate, endDate) {
+  materializeDaily({
+    net: { $regex: networks },
+    sta: { $regex: stations },
+    ts: { $gte: startDate },
+    te: { $lte: endDate },
+  });
+};
+
+materializeDaily = function (match) {
   db.daily_streams.aggregate([
-    {
-      $match: {
-        net: { $regex: networks },
-        sta: { $regex: stations },
-        ts: { $gte: startDate },
-        te: { $lte: endDate },
-        avail: { $gte: 100 },
-      },
-    },
+    { $match: Object.assign({}, match, { avail: { $gte: 100 } }) },
     {
       $group: {
         _id: "$_id",
+        stream: { $first: "$_id" },
         net: { $first: "$net" },
         sta: { $first: "$sta" },
         loc: { $first: "$loc" },
@@ -39,16 +41,17 @@ updateAvailabilityContinuous = function (
   startDate,
   endDate
 ) {
+  materializeContinuous({
+    net: { $regex: networks },
+    sta: { $regex: stations },
+    ts: { $gte: startDate },
+    te: { $lte: endDate },
+  });
+};
+
+materializeContinuous = function (match) {
   db.daily_streams.aggregate([
-    {
-      $match: {
-        net: { $regex: networks },
-        sta: { $regex: stations },
-        ts: { $gte: startDate },
-        te: { $lte: endDate },
-        avail: { $lt: 100 },
-      },
-    },
+    { $match: Object.assign({}, match, { avail: { $lt: 100 } }) },
     {
       $lookup: {
         from: "c_segments",
@@ -61,6 +64,7 @@ updateAvailabilityContinuous = function (
     {
       $group: {
         _id: "$c_segments._id",
+        stream: { $first: "$_id" },
         net: { $first: "$net" },
         sta: { $first: "$sta" },
         loc: { $first: "$loc" },
@@ -80,6 +84,240 @@ updateAvailabilityContinuous = function (
   ]);
 };
 
+affectedStreams = function (networks, stations, startDate, endDate) {
+  // Streams touched by this run
+  return db.daily_streams
+    .aggregate([
+      {
+        $match: {
+          net: { $regex: networks },
+          sta: { $regex: stations },
+          ts: { $gte: startDate },
+          te: { $lte: endDate },
+        },
+      },
+      {
+        $group: { _id: { net: "$net", sta: "$sta", loc: "$loc", cha: "$cha" } },
+      },
+    ])
+    .toArray()
+    .map((stream) => stream._id);
+};
+
+splitReprocessedSpans = function (networks, stations, startDate, endDate) {
+  // Every daily stream of the window is materialized again under its own
+  // `_id`. Spans holding one of them (the spans overlapping the window) would
+  // keep claiming the coverage and last updates they were built with, next
+  // to the new segments: they are dropped and all their daily streams are
+  // materialized again, to be compacted again. Returns the start of the
+  // earliest span dropped, or null.
+  let earliest = null;
+  db.availability
+    .find({
+      net: { $regex: networks },
+      sta: { $regex: stations },
+      ts: { $lt: endDate },
+      te: { $gt: startDate },
+      sources: { $exists: true },
+    })
+    .toArray()
+    .forEach((span) => {
+      db.availability.deleteOne({ _id: span._id });
+      materializeDaily({ _id: { $in: span.sources } });
+      materializeContinuous({ _id: { $in: span.sources } });
+      if (earliest === null || span.ts < earliest) {
+        earliest = span.ts;
+      }
+    });
+  return earliest;
+};
+
+compactAvailability = function (networks, stations, startDate, endDate, split) {
+  // Spans ending up to one day before the window may be extended by new days,
+  // the segments of spans split by this run (from `split` on) are compacted
+  // again
+  let since = new Date(startDate.getTime() - 24 * 3600 * 1000);
+  if (split !== null && split < since) {
+    since = split;
+  }
+  affectedStreams(networks, stations, startDate, endDate).forEach((stream) =>
+    compactStream(stream, since)
+  );
+};
+
+compactStream = function (stream, since) {
+  // Merges contiguous segments of the same quality and sample rate into one
+  // span, with the tolerance the `fusion` step of the API always applies (one
+  // sample), so the timespans of query answers don't change. A span records
+  // the daily streams it was built from (`sources`) and the last update of
+  // each of its days (`updates`): the API reports the update of the days in
+  // the requested window, and spans holding a daily stream processed again
+  // are split back by `splitReprocessedSpans`. `created` is the latest
+  // update. Segments materialized without `stream` are left as they are.
+  let span = null;
+  let merged = [];
+  let sources = [];
+  let seen = new Set();
+  let updates = new Map();
+
+  const absorb = (segment) => {
+    (segment.sources || [segment.stream]).forEach((id) => {
+      if (!seen.has(String(id))) {
+        seen.add(String(id));
+        sources.push(id);
+      }
+    });
+    (
+      segment.updates || [
+        {
+          day: new Date(Math.floor(segment.ts.getTime() / 86400000) * 86400000),
+          created: segment.created,
+        },
+      ]
+    ).forEach((update) => {
+      const known = updates.get(update.day.getTime());
+      if (known === undefined || update.created > known.created) {
+        updates.set(update.day.getTime(), update);
+      }
+    });
+  };
+
+  const flush = () => {
+    if (merged.length > 1) {
+      const compacted = Object.assign({}, span, {
+        _id: new ObjectId(),
+        sources: sources,
+        updates: [...updates.values()].sort((a, b) => a.day - b.day),
+      });
+      delete compacted.stream;
+      db.availability.insertOne(compacted);
+      db.availability.deleteMany({ _id: { $in: merged } });
+    }
+  };
+
+  db.availability
+    .find({
+      net: stream.net,
+      sta: stream.sta,
+      loc: stream.loc,
+      cha: stream.cha,
+      te: { $gte: since },
+    })
+    .sort({ qlt: 1, srate: 1, ts: 1 })
+    .forEach((segment) => {
+      if (segment.ts > segment.te) {
+        return;
+      }
+      if (segment.sources === undefined && segment.stream === undefined) {
+        flush();
+        span = null;
+        merged = [];
+        return;
+      }
+      if (
+        span !== null &&
+        span.qlt === segment.qlt &&
+        span.srate === segment.srate &&
+        segment.ts - span.te <= 1000 / segment.srate
+      ) {
+        if (segment.te > span.te) {
+          span.te = segment.te;
+        }
+        if (segment.created > span.created) {
+          span.created = segment.created;
+        }
+        span.count += segment.count;
+        merged.push(segment._id);
+        absorb(segment);
+        return;
+      }
+      flush();
+      span = segment;
+      merged = [segment._id];
+      sources = [];
+      seen = new Set();
+      updates = new Map();
+      absorb(segment);
+    });
+  flush();
+};
+
+updateAvailabilityExtent = function (networks, stations, startDate, endDate) {
+  // Extents of the touched streams are recomputed from scratch
+  affectedStreams(networks, stations, startDate, endDate).forEach((stream) =>
+    updateStreamExtent(stream)
+  );
+};
+
+updateStreamExtent = function (stream) {
+  // Same rules as the `fusion` step of the API in extent mode: one extent per
+  // quality and sample rate, a new timespan starts after a gap larger than
+  // one sample.
+  const extents = [];
+  let extent = null;
+
+  db.availability
+    .find({ net: stream.net, sta: stream.sta, loc: stream.loc, cha: stream.cha })
+    .sort({ qlt: 1, srate: 1, ts: 1 })
+    .forEach((segment) => {
+      if (segment.ts > segment.te) {
+        return;
+      }
+      if (
+        extent === null ||
+        extent.qlt !== segment.qlt ||
+        extent.srate !== segment.srate
+      ) {
+        extent = {
+          net: segment.net,
+          sta: segment.sta,
+          loc: segment.loc,
+          cha: segment.cha,
+          qlt: segment.qlt,
+          srate: segment.srate,
+          earliest: segment.ts,
+          latest: segment.te,
+          updated: segment.created,
+          timespans: 1,
+          restr: segment.restr,
+        };
+        extents.push(extent);
+        return;
+      }
+      if (segment.ts - extent.latest > 1000 / segment.srate) {
+        extent.timespans += 1;
+      }
+      if (segment.te > extent.latest) {
+        extent.latest = segment.te;
+      }
+      if (segment.created > extent.updated) {
+        extent.updated = segment.created;
+      }
+    });
+
+  extents.forEach((e) =>
+    db.availability_extent.replaceOne(
+      {
+        net: e.net,
+        sta: e.sta,
+        loc: e.loc,
+        cha: e.cha,
+        qlt: e.qlt,
+        srate: e.srate,
+      },
+      e,
+      { upsert: true }
+    )
+  );
+
+  // Drop extents of qualities/sample rates no longer present
+  const stale = { net: stream.net, sta: stream.sta, loc: stream.loc, cha: stream.cha };
+  if (extents.length > 0) {
+    stale.$nor = extents.map((e) => ({ qlt: e.qlt, srate: e.srate }));
+  }
+  db.availability_extent.deleteMany(stale);
+};
+
 function formatDate(date) {
   return [
     date.getFullYear(),
@@ -113,8 +351,17 @@ console.log(
   `Processing WFCatalog entries using networks: '${net}', stations: '${sta}', start: '${ts}', end: '${te}' started!`
 );
 
-updateAvailabilityDaily(net, sta, new ISODate(ts), new ISODate(te));
-updateAvailabilityContinuous(net, sta, new ISODate(ts), new ISODate(te));
+// If provided, `extentsOnly` only refreshes the extents of the selected streams
+if (typeof extentsOnly === "undefined" || !extentsOnly) {
+  const split = splitReprocessedSpans(net, sta, new ISODate(ts), new ISODate(te));
+  updateAvailabilityDaily(net, sta, new ISODate(ts), new ISODate(te));
+  updateAvailabilityContinuous(net, sta, new ISODate(ts), new ISODate(te));
+  // If provided, `compact` merges contiguous segments into long spans
+  if (typeof compact !== "undefined" && compact) {
+    compactAvailability(net, sta, new ISODate(ts), new ISODate(te), split);
+  }
+}
+updateAvailabilityExtent(net, sta, new ISODate(ts), new ISODate(te));
 
 console.log(
   `Processing WFCatalog entries using networks: '${net}', stations: '${sta}', start: '${ts}', end: '${te}' completed!`